@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Batch Stock Comparison
+Runs many OLD/NEW comparisons at once (e.g. every warehouse at month end) on a pool of
+worker processes. Each workbook is parsed once, even when it appears in several pairs,
+and the results are collected into one summary with per-pair timings.
+
+Usage:
+    python stock_comparison_tool.py batch pairs.csv [--output-dir batch_output] [--workers 8]
+    python stock_comparison_tool.py batch stock_lists/ [--latest-only] [--outputs excel]
+
+A manifest is a CSV with `old` and `new` columns (paths relative to the manifest) and an
+optional `name` column (the output file name, without folders). A folder is searched for workbooks: in each sub-folder (and the folder
+itself) the workbooks sorted by name are compared in consecutive pairs, so date-stamped
+lists (Stock_List_20251110.xlsx, Stock_List_20251111.xlsx, ...) give one comparison per day.
+"""
+
+import argparse
+import csv
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from config_matching import MATCH_MODES
+from stock_comparison_tool import (DEDUPE_STRATEGIES, OUTPUT_TYPES, READER_ENGINES, REPORT_DETAIL_ROWS,
+                                   SIGNIFICANT_QTY_CHANGE, TOP_N, StockComparator, load_stock_file,
+                                   parse_outputs)
+
+
+WORKBOOK_SUFFIXES = {'.xlsx', '.xls'}
+SUMMARY_FILE = 'batch_summary.csv'
+
+# Summary columns, in order (stage timings are appended after them)
+SUMMARY_COLUMNS = ['name', 'status', 'old', 'new', 'total_configs_old', 'total_configs_new',
+                   'matching_configs', 'removed_configs', 'new_configs', 'significant_changes', 'anomalies',
+                   'net_qty_change', 'avg_price_old', 'avg_price_new', 'seconds', 'error']
+
+
+def read_manifest(path):
+    """Pairs listed in a CSV manifest: [(name, old_path, new_path)]."""
+    base = Path(path).resolve().parent
+    pairs = []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            old, new = (row.get('old') or '').strip(), (row.get('new') or '').strip()
+            if not old or not new:
+                raise ValueError(f"{path}, line {line}: both 'old' and 'new' are required")
+            name = (row.get('name') or '').strip()
+            if name and (any(char in name for char in '/\\:') or not name.strip('.')):
+                # The name becomes the output file name: keep it inside the output folder
+                raise ValueError(f"{path}, line {line}: name '{name}' must be a file name, not a path")
+            name = name or f"{Path(old).stem}_vs_{Path(new).stem}"
+            pairs.append((name, str(base / old), str(base / new)))
+    return pairs
+
+
+def find_folder_pairs(folder, latest_only=False):
+    """Consecutive pairs of workbooks (sorted by name) in `folder` and each of its sub-folders."""
+    folder = Path(folder)
+    groups = [folder] + sorted(p for p in folder.iterdir() if p.is_dir())
+    pairs = []
+    for group in groups:
+        workbooks = sorted(p for p in group.iterdir()
+                           if p.suffix.lower() in WORKBOOK_SUFFIXES and not p.name.startswith('~$'))
+        consecutive = list(zip(workbooks, workbooks[1:]))
+        if latest_only:
+            consecutive = consecutive[-1:]
+        prefix = '' if group == folder else f"{group.name}_"
+        pairs += [(f"{prefix}{new.stem}", str(old), str(new)) for old, new in consecutive]
+    return pairs
+
+
+def parse_workbook(path, cache_path, reader_engine):
+    """Worker: read one workbook and pickle the frame for the comparisons that use it."""
+    start = time.perf_counter()
+    df = load_stock_file(path, reader_engine)
+    df.to_pickle(cache_path)
+    return len(df), time.perf_counter() - start
+
+
+def compare_pair(name, old_path, new_path, old_cache, new_cache, output_file, options):
+    """Worker: compare one pair from the parsed frames and write its outputs.
+
+    Returns a summary row; failures are reported in it rather than raised.
+    """
+    start = time.perf_counter()
+    row = {'name': name, 'old': old_path, 'new': new_path}
+    try:
+        comparator = StockComparator(old_path, new_path, output_file, verbose=False, auto_open=False,
+                                     preloaded={'old': lambda: pd.read_pickle(old_cache),
+                                                'new': lambda: pd.read_pickle(new_cache)},
+                                     **options)
+        comparator.analyse()
+        comparator.timed('export', comparator.export_results)
+        row.update(comparator.summary(), status='ok')
+        row.update({f'{stage}_seconds': round(seconds, 3) for stage, seconds in comparator.timings.items()})
+    except Exception as e:
+        row.update(status='failed', error=f"{type(e).__name__}: {e}")
+    row['seconds'] = round(time.perf_counter() - start, 3)
+    return row
+
+
+def run_batch(pairs, output_dir, options, workers=None, reader_engine='auto'):
+    """Parse every distinct workbook once and compare every pair on a process pool.
+
+    A pair is submitted as soon as both of its workbooks are parsed. Returns
+    (summary rows in input order, {path: (rows, parse seconds)}).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    cache_dir = tempfile.mkdtemp(prefix='stock_batch_')
+    files = sorted({path for _, old, new in pairs for path in (old, new)})
+    cache = {path: os.path.join(cache_dir, f'{i}.pkl') for i, path in enumerate(files)}
+    parsed, failed_parses, rows = {}, {}, {}
+    waiting = list(enumerate(pairs))
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            parse_jobs = {pool.submit(parse_workbook, path, cache[path], reader_engine): path for path in files}
+            compare_jobs = {}
+            for job in as_completed(parse_jobs):
+                path = parse_jobs[job]
+                try:
+                    parsed[path] = job.result()
+                except Exception as e:
+                    failed_parses[path] = f"{type(e).__name__}: {e}"
+                    print(f"✗ Could not read {path}: {failed_parses[path]}")
+
+                still_waiting = []
+                for i, (name, old, new) in waiting:
+                    failure = failed_parses.get(old) or failed_parses.get(new)
+                    if failure:
+                        rows[i] = {'name': name, 'old': old, 'new': new, 'status': 'failed', 'error': failure}
+                    elif old in parsed and new in parsed:
+                        output_file = os.path.join(output_dir, f'{name}.xlsx')
+                        compare_jobs[pool.submit(compare_pair, name, old, new, cache[old], cache[new],
+                                                 output_file, options)] = i
+                    else:
+                        still_waiting.append((i, (name, old, new)))
+                waiting = still_waiting
+
+            for job in as_completed(compare_jobs):
+                row = rows[compare_jobs[job]] = job.result()
+                if row['status'] == 'ok':
+                    print(f"✓ {row['name']}: {row['significant_changes']:,} significant changes ({row['seconds']:.2f}s)")
+                else:
+                    print(f"✗ {row['name']}: {row['error']}")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    return [rows[i] for i in range(len(pairs))], parsed
+
+
+def batch_main(argv):
+    """CLI: compare every pair in a manifest or folder."""
+    parser = argparse.ArgumentParser(prog='stock_comparison_tool.py batch',
+                                     description='Compare many OLD/NEW stock list pairs in parallel.')
+    parser.add_argument('source', help='CSV manifest (old,new[,name] columns) or folder of workbooks')
+    parser.add_argument('--output-dir', default='batch_output',
+                        help='Folder for the reports and batch_summary.csv (default: batch_output)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f'Worker processes (default: one per core, {os.cpu_count()})')
+    parser.add_argument('--latest-only', action='store_true',
+                        help='Folder mode: only compare the two newest workbooks in each folder')
+    parser.add_argument('--threshold', type=float, default=SIGNIFICANT_QTY_CHANGE,
+                        help=f'Minimum absolute qty change for a significant change (default: {SIGNIFICANT_QTY_CHANGE})')
+    parser.add_argument('--top', type=int, default=TOP_N,
+                        help=f'Number of entries in each Top-N list (default: {TOP_N})')
+    parser.add_argument('--dedupe', choices=DEDUPE_STRATEGIES, default='keep-all',
+                        help='How to handle duplicated Item # rows (default: keep-all)')
+    parser.add_argument('--match', choices=MATCH_MODES, default='exact',
+                        help='How configuration keys are matched (default: exact)')
+    parser.add_argument('--reader', choices=READER_ENGINES, default='auto',
+                        help='Excel reader (default: auto)')
+    parser.add_argument('--item-diff', action='store_true', help='Also compare individual Item # rows')
+    parser.add_argument('--outputs', type=parse_outputs, default=OUTPUT_TYPES,
+                        help=f"Comma-separated artifacts to write per pair, from {','.join(OUTPUT_TYPES)} (default: all)")
+    parser.add_argument('--detail-rows', type=int, default=REPORT_DETAIL_ROWS,
+                        help=f'Rows in each report\'s detailed comparison section, 0 for all (default: {REPORT_DETAIL_ROWS})')
+    args = parser.parse_args(argv)
+
+    if os.path.isdir(args.source):
+        pairs = find_folder_pairs(args.source, args.latest_only)
+    elif os.path.isfile(args.source):
+        try:
+            pairs = read_manifest(args.source)
+        except ValueError as e:
+            print(f"✗ Error: {e}")
+            return 1
+    else:
+        print(f"✗ Error: manifest or folder not found: {args.source}")
+        return 1
+    if not pairs:
+        print(f"✗ Error: no pairs to compare in {args.source}")
+        return 1
+
+    missing = sorted({path for _, old, new in pairs for path in (old, new) if not os.path.exists(path)})
+    if missing:
+        for path in missing:
+            print(f"✗ Error: file not found: {path}")
+        return 1
+
+    names = [name for name, _, _ in pairs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        print(f"✗ Error: pair names must be unique (repeated: {', '.join(duplicates)})")
+        return 1
+
+    options = {'qty_threshold': args.threshold, 'top_n': args.top, 'dedupe': args.dedupe,
+               'match_mode': args.match, 'item_diff': args.item_diff, 'reader_engine': args.reader,
+               'outputs': args.outputs, 'detail_rows': args.detail_rows or None}
+    references = 2 * len(pairs)
+    distinct = len({path for _, old, new in pairs for path in (old, new)})
+    workers = args.workers or os.cpu_count()
+
+    print("=" * 80)
+    print("BATCH STOCK COMPARISON")
+    print("=" * 80)
+    print(f"Pairs:   {len(pairs)} ({distinct} workbooks, {references - distinct} shared reads saved)")
+    print(f"Workers: {workers}")
+    print(f"Output:  {os.path.abspath(args.output_dir)}")
+    print("=" * 80)
+
+    start = time.perf_counter()
+    rows, parsed = run_batch(pairs, args.output_dir, options, workers, args.reader)
+    wall = time.perf_counter() - start
+
+    df = pd.DataFrame(rows)
+    stage_columns = [c for c in df.columns if c.endswith('_seconds')]  # Pipeline order
+    df = df.reindex(columns=SUMMARY_COLUMNS + stage_columns)
+    summary_path = os.path.join(args.output_dir, SUMMARY_FILE)
+    df.to_csv(summary_path, index=False)
+
+    ok = df[df['status'] == 'ok']
+    print("\n" + "=" * 80)
+    print("BATCH SUMMARY")
+    print("=" * 80)
+    if len(ok):
+        table = ok[['name', 'total_configs_new', 'significant_changes', 'net_qty_change', 'seconds']]
+        table.columns = ['Pair', 'Configs', 'Significant', 'Net Qty', 'Seconds']
+        print(table.to_string(index=False, formatters={'Configs': lambda v: f"{v:,.0f}",
+                                                        'Significant': lambda v: f"{v:,.0f}",
+                                                        'Net Qty': lambda v: f"{v:+,.0f}",
+                                                        'Seconds': lambda v: f"{v:.2f}"}))
+        print(f"\nSignificant changes: {int(ok['significant_changes'].sum()):,}")
+        print(f"Net qty change:      {ok['net_qty_change'].sum():+,.0f}")
+    print(f"Pairs compared:      {len(ok)} of {len(df)}")
+    print(f"Workbooks parsed:    {len(parsed)} ({sum(seconds for _, seconds in parsed.values()):.2f}s)")
+    print(f"Comparison time:     {df['seconds'].sum():.2f}s across workers, {wall:.2f}s wall clock")
+    print(f"\n✓ Summary saved to: {summary_path}")
+    return 0 if len(ok) == len(df) else 1
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Stock Comparison Tool
+Times individual pipeline stages on generated stock lists.
+
+Usage:
+    python benchmark.py aggregation [--rows 100000 500000] [--repeat 3]
+    python benchmark.py dashboard [--rows 10000] [--repeat 3]
+    python benchmark.py report [--rows 100000] [--repeat 3]
+    python benchmark.py dedupe [--rows 1000000 3000000] [--repeat 3]
+    python benchmark.py matching [--rows 60000 600000] [--repeat 3]
+    python benchmark.py items [--rows 100000 1000000] [--repeat 3]
+    python benchmark.py readers [--rows 50000 500000] [--repeat 1]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from config_matching import MATCH_MODES, match_configurations
+from stock_comparison_tool import (DEDUPE_STRATEGIES, GROUPING_COLS, StockComparator,
+                                   aggregate_configurations, dedupe_items, diff_items,
+                                   load_stock_file, python_calamine)
+
+
+MODELS = ['iPhone 11', 'iPhone 12', 'iPhone 12 Pro', 'iPhone 13', 'iPhone 13 Pro', 'iPhone 13 Pro Max',
+          'iPhone 14', 'iPhone 14 Pro', 'iPhone 14 Pro Max', 'iPhone 15', 'iPhone 15 Pro', 'iPhone 15 Pro Max']
+CAPACITIES = ['64GB', '128GB', '256GB', '512GB', '1TB']
+COLORS = ['Black', 'White', 'Blue', 'Red', 'Purple', 'Gold', 'Silver', 'Graphite']
+LOCK_STATUSES = ['UNLOCKED', 'LOCKED']
+GRADES = ['A', 'B', 'B+', 'C', 'D']
+
+
+def generate_stock_frame(rows, seed=0, models=MODELS):
+    """Generate a stock list with the columns and value ranges of a real supplier feed."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Item #': rng.integers(10_000_000, 10_000_000 + rows * 2, rows).astype(str),
+        'Model': rng.choice(models, rows),
+        'Capacity': rng.choice(CAPACITIES, rows),
+        'Color': rng.choice(COLORS, rows),
+        'Lock Status': rng.choice(LOCK_STATUSES, rows),
+        'Grade': rng.choice(GRADES, rows),
+        'Available Quantity': rng.integers(0, 500, rows).astype(float),
+        'List Price': rng.uniform(80, 1200, rows).round(2),
+        'New Offer Price': rng.uniform(60, 1100, rows).round(2),
+    })
+
+
+def build_comparator(rows, output_dir, seed=0, models=MODELS):
+    """Run the comparison stages (no file I/O) on generated OLD/NEW lists of `rows` rows each."""
+    comparator = StockComparator('generated_old.xlsx', 'generated_new.xlsx',
+                                 os.path.join(output_dir, 'Benchmark.txt'))
+    comparator.df_old = generate_stock_frame(rows, seed, models)
+    comparator.df_new = generate_stock_frame(rows, seed + 1, models)
+    with contextlib.redirect_stdout(io.StringIO()):
+        comparator.clean_data()
+        comparator.group_by_configuration()
+        comparator.compare_configurations()
+    return comparator
+
+
+def time_call(func, repeat):
+    """Best wall-clock time of `repeat` calls, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def legacy_group_by_configuration(df):
+    """The original aggregation: weighted columns added to a frame, dict agg, then divide."""
+    df = df.copy()  # The original mutated the source frame; copy so repeats stay comparable
+    df['Weighted_List_Price'] = df['List Price'] * df['Available Quantity']
+    df['Weighted_Offer_Price'] = df['New Offer Price'] * df['Available Quantity']
+    grouped = df.groupby(GROUPING_COLS).agg({
+        'Item #': 'count',
+        'Available Quantity': 'sum',
+        'Weighted_List_Price': 'sum',
+        'Weighted_Offer_Price': 'sum'
+    }).reset_index()
+    grouped['List Price'] = grouped['Weighted_List_Price'] / grouped['Available Quantity']
+    grouped['New Offer Price'] = grouped['Weighted_Offer_Price'] / grouped['Available Quantity']
+    return grouped
+
+
+def legacy_detail_lines(comparator, df):
+    """The original detail section: iterrows() and one f-string per line."""
+    report_lines = []
+    for idx, row in df.iterrows():
+        item_name = comparator.format_item_name(row)
+        report_lines.append(f"\n{item_name}")
+        report_lines.append(f"  Quantity: {row['OLD Qty']:,.0f} -> {row['NEW Qty']:,.0f} | Change: {row['Qty Change']:+,.0f} ({row['Qty Change %']:+.1f}%)")
+        report_lines.append(f"  Price: ${row['OLD List Price']:.2f} -> ${row['NEW List Price']:.2f} | Change: ${row['List Price Change $']:+.2f} ({row['List Price Change %']:+.1f}%)")
+    return '\n'.join(report_lines)
+
+
+def bench_aggregation(args):
+    """Legacy dict-agg aggregation vs the fused aggregate_configurations()."""
+    print(f"{'Rows':>10} {'Legacy (s)':>12} {'Fused (s)':>12} {'Speedup':>9}")
+    for rows in args.rows:
+        df = generate_stock_frame(rows)
+        legacy = time_call(lambda: legacy_group_by_configuration(df), args.repeat)
+        fused = time_call(lambda: aggregate_configurations(df, ['List Price', 'New Offer Price']), args.repeat)
+        print(f"{rows:>10,} {legacy:>12.4f} {fused:>12.4f} {legacy / fused:>8.2f}x")
+
+
+def bench_dashboard(args):
+    """Executive dashboard generation time and file size for N significant changes."""
+    models = [f'Model {i}' for i in range(60)]  # Enough configurations for ~10k+ significant changes
+    print(f"{'Rows':>10} {'Generate (s)':>13} {'File size':>12} {'Bytes/row':>10}")
+    with tempfile.TemporaryDirectory() as output_dir:
+        for rows in args.rows:
+            comparator = build_comparator(rows * 12, output_dir, models=models)
+            comparator.df_filtered = comparator.df_filtered.head(rows)
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds = time_call(comparator._generate_executive_dashboard, args.repeat)
+                html_file = comparator._generate_executive_dashboard()
+            size = os.path.getsize(html_file)
+            print(f"{len(comparator.df_filtered):>10,} {seconds:>13.4f} {size / 1024:>10.1f}KB "
+                  f"{size / max(len(comparator.df_filtered), 1):>10.1f}")
+    print("\nClient render time is shown in the dashboard footer (and browser console) when opened.")
+
+
+def bench_report(args):
+    """Full text report (untruncated detail section) vs the legacy iterrows() detail block."""
+    models = [f'Model {i}' for i in range(600)]  # Enough configurations for 100k+ significant changes
+    print(f"{'Rows':>10} {'Legacy detail (s)':>18} {'Full report (s)':>16} {'File size':>12}")
+    with tempfile.TemporaryDirectory() as output_dir:
+        for rows in args.rows:
+            comparator = build_comparator(rows * 6, output_dir, models=models)
+            comparator.df_filtered = comparator.df_filtered.head(rows)
+            comparator.detail_rows = None
+            top_insights = comparator._generate_top_insights()
+            legacy = time_call(lambda: legacy_detail_lines(comparator, comparator.df_filtered), min(args.repeat, 1))
+            report = time_call(lambda: comparator.write_text_report(top_insights), args.repeat)
+            size = os.path.getsize(comparator.text_file)
+            print(f"{len(comparator.df_filtered):>10,} {legacy:>18.3f} {report:>16.3f} {size / 1024 / 1024:>10.1f}MB")
+
+
+def bench_dedupe(args):
+    """Each duplicate Item # strategy (reject excluded) on lists with ~20% repeated items."""
+    strategies = [strategy for strategy in DEDUPE_STRATEGIES if strategy != 'reject']
+    print(f"{'Rows':>10} {'Duplicates':>11} " + ' '.join(f"{strategy + ' (s)':>17}" for strategy in strategies))
+    for rows in args.rows:
+        df = generate_stock_frame(rows)
+        _, report = dedupe_items(df)
+        timings = [time_call(lambda: dedupe_items(df, strategy), args.repeat) for strategy in strategies]
+        print(f"{rows:>10,} {int(report['Occurrences'].sum() - len(report)):>11,} "
+              + ' '.join(f"{seconds:>17.3f}" for seconds in timings))
+
+
+def add_format_drift(df):
+    """Respell keys the way vendor feeds drift: '128 GB', 'Unlocked', a misspelled color."""
+    df = df.copy()
+    df['Capacity'] = df['Capacity'].str.replace('GB', ' GB')
+    df['Lock Status'] = df['Lock Status'].str.title()
+    df['Color'] = df['Color'].replace({'Silver': 'Silvr'})
+    return df
+
+
+def bench_matching(args):
+    """Configuration matching modes on a NEW list with formatting drift."""
+    models = [f'Model {i}' for i in range(600)]  # Tens of thousands of configurations
+    print(f"{'Rows':>10} {'Configs':>9} {'Mode':>11} {'Match (s)':>10} {'Matching':>9} {'Removed':>8} {'New':>8}")
+    for rows in args.rows:
+        old = aggregate_configurations(generate_stock_frame(rows, 0, models), ['List Price'])
+        new = aggregate_configurations(add_format_drift(generate_stock_frame(rows, 1, models)), ['List Price'])
+        for mode in MATCH_MODES:
+            seconds = time_call(lambda: match_configurations(old, new, GROUPING_COLS, mode), args.repeat)
+            df_old, df_new, _, _ = match_configurations(old, new, GROUPING_COLS, mode)
+            status = pd.merge(df_old[GROUPING_COLS], df_new[GROUPING_COLS], how='outer', indicator=True)['_merge']
+            counts = status.value_counts()
+            print(f"{rows:>10,} {len(old) + len(new):>9,} {mode:>11} {seconds:>10.3f} {counts['both']:>9,} "
+                  f"{counts['left_only']:>8,} {counts['right_only']:>8,}")
+
+
+def bench_items(args):
+    """Item-level diff (join, classification and configuration rollup) of two generated lists."""
+    print(f"{'Rows':>10} {'Items':>10} {'Diff (s)':>9} {'Configs':>8}")
+    for rows in args.rows:
+        df_old, df_new = generate_stock_frame(rows, 0), generate_stock_frame(rows, 1)
+        seconds = time_call(lambda: diff_items(df_old, df_new), args.repeat)
+        df_items, df_rollup = diff_items(df_old, df_new)
+        print(f"{rows:>10,} {len(df_items):>10,} {seconds:>9.3f} {len(df_rollup):>8,}")
+
+
+def bench_readers(args):
+    """Excel parsing with each installed reader engine (frames must be identical)."""
+    engines = ['openpyxl'] + (['calamine'] if python_calamine is not None else [])
+    if python_calamine is None:
+        print("python-calamine is not installed; timing openpyxl only")
+    print(f"{'Rows':>10} " + ' '.join(f"{engine + ' (s)':>15}" for engine in engines) + f" {'Speedup':>9}")
+    with tempfile.TemporaryDirectory() as output_dir:
+        for rows in args.rows:
+            path = os.path.join(output_dir, f'stock_{rows}.xlsx')
+            with pd.ExcelWriter(path, engine='openpyxl') as writer:
+                # Metadata rows above the header, as in supplier files
+                pd.DataFrame([['Stock List'], ['Generated for benchmark']]).to_excel(
+                    writer, index=False, header=False)
+                generate_stock_frame(rows).to_excel(writer, index=False, startrow=3)
+
+            frames, seconds = {}, {}
+            for engine in engines:
+                seconds[engine] = time_call(lambda: frames.__setitem__(engine, load_stock_file(path, engine)),
+                                            args.repeat)
+            if 'calamine' in frames:
+                pd.testing.assert_frame_equal(frames['openpyxl'], frames['calamine'])
+            speedup = f"{seconds['openpyxl'] / seconds['calamine']:>8.2f}x" if 'calamine' in seconds else ''
+            print(f"{rows:>10,} " + ' '.join(f"{seconds[engine]:>15.3f}" for engine in engines) + f" {speedup:>9}")
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Benchmark Stock Comparison Tool stages.")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    aggregation = subparsers.add_parser('aggregation', help='Configuration grouping / weighted averages')
+    aggregation.add_argument('--rows', type=int, nargs='+', default=[100_000, 500_000, 1_000_000])
+    aggregation.add_argument('--repeat', type=int, default=3)
+    aggregation.set_defaults(func=bench_aggregation)
+
+    dashboard = subparsers.add_parser('dashboard', help='Executive HTML dashboard generation')
+    dashboard.add_argument('--rows', type=int, nargs='+', default=[1_000, 10_000])
+    dashboard.add_argument('--repeat', type=int, default=3)
+    dashboard.set_defaults(func=bench_dashboard)
+
+    report = subparsers.add_parser('report', help='Text report rendering with every significant change')
+    report.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+    report.add_argument('--repeat', type=int, default=3)
+    report.set_defaults(func=bench_report)
+
+    dedupe = subparsers.add_parser('dedupe', help='Duplicate Item # strategies')
+    dedupe.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 3_000_000])
+    dedupe.add_argument('--repeat', type=int, default=3)
+    dedupe.set_defaults(func=bench_dedupe)
+
+    matching = subparsers.add_parser('matching', help='Exact / normalised / fuzzy configuration matching')
+    matching.add_argument('--rows', type=int, nargs='+', default=[60_000, 600_000])
+    matching.add_argument('--repeat', type=int, default=3)
+    matching.set_defaults(func=bench_matching)
+
+    items = subparsers.add_parser('items', help='Item-level diff and rollup')
+    items.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000])
+    items.add_argument('--repeat', type=int, default=3)
+    items.set_defaults(func=bench_items)
+
+    readers = subparsers.add_parser('readers', help='Excel reader engines (openpyxl vs calamine)')
+    readers.add_argument('--rows', type=int, nargs='+', default=[50_000, 500_000])
+    readers.add_argument('--repeat', type=int, default=1)
+    readers.set_defaults(func=bench_readers)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Configuration Matching
+Reconciles vendor formatting drift between OLD and NEW configurations before they
+are compared, so "128 GB" / "128GB" or "Unlocked" / "UNLOCKED" match instead of
+showing up as a Removed/New pair.
+
+Match modes:
+    exact       - join on the raw strings (the original behaviour)
+    normalised  - join on canonical keys (case, whitespace and underscores folded)
+    fuzzy       - normalised, then pair the remaining Removed/New configurations by
+                  Model/Color similarity within blocks of identical Capacity/Lock/Grade
+"""
+
+import re
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+MATCH_MODES = ['exact', 'normalised', 'fuzzy']
+
+# Key columns compared by similarity in fuzzy mode; the other key columns form the blocks
+FUZZY_COLUMNS = ['Model', 'Color']
+FUZZY_MATCH_CUTOFF = 0.8  # Minimum similarity of both Model and Color
+
+NORMALISE_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=NORMALISE_CACHE_SIZE)
+def normalise_value(value):
+    """Canonical key for one key value: casefolded, without whitespace or underscores.
+
+    Other punctuation is kept: it carries meaning in grades (B+, B- and B differ).
+    """
+    return re.sub(r'[\s_]+', '', str(value).casefold())
+
+
+@lru_cache(maxsize=NORMALISE_CACHE_SIZE)
+def value_tokens(value):
+    """Words and numbers of a key value, used to keep fuzzy matches to spelling drift."""
+    return tuple(re.findall(r'[a-z]+|\d+', str(value).casefold()))
+
+
+@lru_cache(maxsize=NORMALISE_CACHE_SIZE)
+def value_similarity(a, b):
+    """Similarity of two key values (0-1).
+
+    Values whose numbers differ or whose word counts differ never match, so
+    "iPhone 12" / "iPhone 13" or "13 Pro" / "13 Pro Max" stay distinct while
+    "Space Gray" / "Space Grey" do not.
+    """
+    if normalise_value(a) == normalise_value(b):
+        return 1.0
+    if value_signature(a) != value_signature(b):
+        return 0.0
+    return SequenceMatcher(None, normalise_value(a), normalise_value(b)).ratio()
+
+
+@lru_cache(maxsize=NORMALISE_CACHE_SIZE)
+def value_signature(value):
+    """Word count and numbers of a key value; only values sharing one can be similar."""
+    tokens = value_tokens(value)
+    return len(tokens), tuple(t for t in tokens if t.isdigit())
+
+
+def similarity_matrix(old_values, new_values, scored):
+    """value_similarity() of every OLD x NEW value, scoring only pairs with equal signatures.
+
+    `scored` memoises pair scores across calls.
+    """
+    similarity = np.zeros((len(old_values), len(new_values)))
+    candidates = {}
+    for j, b in enumerate(new_values):
+        candidates.setdefault(value_signature(b), []).append((j, b))
+    for i, a in enumerate(old_values):
+        for j, b in candidates.get(value_signature(a), ()):
+            if (a, b) not in scored:
+                scored[a, b] = value_similarity(a, b)
+            similarity[i, j] = scored[a, b]
+    return similarity
+
+
+def normalise_column(values):
+    """Canonical keys for a column; each distinct value is normalised once (and cached across runs).
+
+    Missing values stay None.
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    keys = np.array([normalise_value(value) for value in uniques], dtype=object)
+    return np.where(codes >= 0, keys[codes], None)
+
+
+def canonicalise_values(df_old, df_new, key_cols):
+    """Rewrite each key column of both frames to one spelling per canonical key.
+
+    The spelling used is the first one seen in the NEW frame (the current feed),
+    or in the OLD frame for keys that only exist there. Also returns how many
+    configurations were respelled.
+    """
+    df_old, df_new = df_old.copy(), df_new.copy()
+    changed = np.zeros(len(df_new) + len(df_old), dtype=bool)
+    for col in key_cols:
+        values = pd.concat([df_new[col], df_old[col]], ignore_index=True)
+        keys = pd.Series(normalise_column(values))
+        spelling = values.groupby(keys, sort=False).first()
+        canonical = keys.map(spelling).where(keys.notna(), values)
+        changed |= (canonical != values).to_numpy() & keys.notna().to_numpy()
+        df_new[col] = canonical.iloc[:len(df_new)].to_numpy()
+        df_old[col] = canonical.iloc[len(df_new):].to_numpy()
+    return df_old, df_new, int(changed.sum())
+
+
+def collapse_configurations(df, key_cols, count_col, qty_col, price_cols):
+    """Merge rows that now share a key: counts and qty summed, prices qty-weighted."""
+    if not df.duplicated(subset=key_cols).any():
+        return df
+    sums = {count_col: df[count_col], qty_col: df[qty_col]}
+    for col in price_cols:
+        sums[f'{col} wsum'] = df[col] * df[qty_col]
+        sums[f'{col} wqty'] = df[qty_col].where(df[col].notna())
+        sums[f'{col} sum'] = df[col]
+        sums[f'{col} n'] = df[col].notna()
+    grouped = pd.DataFrame(sums, index=df.index).groupby([df[col] for col in key_cols]).sum().reset_index()
+
+    result = grouped[key_cols + [count_col, qty_col]].copy()
+    for col in price_cols:
+        wqty = grouped[f'{col} wqty'].to_numpy(dtype=float)
+        pcount = grouped[f'{col} n'].to_numpy(dtype=float)
+        mean_price = np.divide(grouped[f'{col} sum'].to_numpy(dtype=float), pcount,
+                               out=np.full(len(grouped), np.nan), where=pcount > 0)
+        result[col] = np.divide(grouped[f'{col} wsum'].to_numpy(dtype=float), wqty, out=mean_price, where=wqty > 0)
+    return result[df.columns]
+
+
+def fuzzy_pairs(removed, new, key_cols, cutoff=FUZZY_MATCH_CUTOFF):
+    """Pair unmatched OLD and NEW configurations by Model/Color similarity.
+
+    Only configurations with identical remaining key columns (the block) are
+    compared. A pair is accepted when both similarities reach the cutoff and each
+    side is the other's unique best candidate.
+
+    Returns a frame of (old row label, new row label, score).
+    """
+    block_cols = [col for col in key_cols if col not in FUZZY_COLUMNS]
+
+    old_columns = {col: removed[col].to_numpy() for col in FUZZY_COLUMNS}
+    new_columns = {col: new[col].to_numpy() for col in FUZZY_COLUMNS}
+    scored = {col: {} for col in FUZZY_COLUMNS}
+
+    pairs = []
+    new_blocks = new.reset_index(drop=True).groupby(block_cols, sort=False).indices
+    for key, old_rows in removed.reset_index(drop=True).groupby(block_cols, sort=False).indices.items():
+        new_rows = new_blocks.get(key)
+        if new_rows is None:
+            continue
+
+        # Score the block's unique (OLD value, NEW value) pairs; configuration pairs index into these
+        score = None
+        for col in FUZZY_COLUMNS:
+            old_codes, old_values = pd.factorize(old_columns[col][old_rows])
+            new_codes, new_values = pd.factorize(new_columns[col][new_rows])
+            col_score = similarity_matrix(old_values, new_values, scored[col])[old_codes][:, new_codes]
+            score = col_score if score is None else np.minimum(score, col_score)
+
+        best_new = score.argmax(axis=1)
+        best_old = score.argmax(axis=0)
+        row_best = score.max(axis=1)
+        unique_row = (score == row_best[:, None]).sum(axis=1) == 1
+        unique_col = (score == score.max(axis=0)[None, :]).sum(axis=0) == 1
+        accepted = (row_best >= cutoff) & unique_row & unique_col[best_new] & \
+            (best_old[best_new] == np.arange(len(old_rows)))
+        for i in np.flatnonzero(accepted):
+            pairs.append((removed.index[old_rows[i]], new.index[new_rows[best_new[i]]], row_best[i]))
+    return pd.DataFrame(pairs, columns=['old', 'new', 'score'])
+
+
+def match_configurations(df_old, df_new, key_cols, mode='exact'):
+    """Reconcile the key spellings of two grouped frames according to `mode`.
+
+    Both frames are laid out like aggregate_configurations() output: key_cols,
+    item count, qty, then price columns.
+
+    Returns (df_old, df_new, stats, fuzzy matches frame) with OLD keys rewritten
+    to the NEW spelling wherever they were judged to be the same configuration.
+    """
+    if mode not in MATCH_MODES:
+        raise ValueError(f"Unknown match mode '{mode}' (choose from {', '.join(MATCH_MODES)})")
+    stats = {'mode': mode, 'respelled': 0, 'fuzzy_matches': 0}
+    matches = pd.DataFrame(columns=['Score'] + [f'OLD {col}' for col in FUZZY_COLUMNS]
+                           + [f'NEW {col}' for col in FUZZY_COLUMNS])
+    if mode == 'exact':
+        return df_old, df_new, stats, matches
+
+    df_old, df_new, stats['respelled'] = canonicalise_values(df_old, df_new, key_cols)
+    n = len(key_cols)
+    df_old = collapse_configurations(df_old, key_cols, df_old.columns[n], df_old.columns[n + 1],
+                                     list(df_old.columns[n + 2:]))
+    df_new = collapse_configurations(df_new, key_cols, df_new.columns[n], df_new.columns[n + 1],
+                                     list(df_new.columns[n + 2:]))
+    if mode == 'normalised':
+        return df_old, df_new, stats, matches
+
+    # Fuzzy: only the configurations the normalised join leaves unmatched
+    old_keys = pd.MultiIndex.from_frame(df_old[key_cols])
+    new_keys = pd.MultiIndex.from_frame(df_new[key_cols])
+    removed = df_old[~old_keys.isin(new_keys)]
+    added = df_new[~new_keys.isin(old_keys)]
+    pairs = fuzzy_pairs(removed, added, key_cols)
+    if len(pairs):
+        matches = pd.DataFrame({'Score': pairs['score'].round(3).to_numpy()})
+        for col in FUZZY_COLUMNS:
+            matches[f'OLD {col}'] = df_old.loc[pairs['old'], col].to_numpy()
+        for col in FUZZY_COLUMNS:
+            matches[f'NEW {col}'] = df_new.loc[pairs['new'], col].to_numpy()
+        for col in key_cols:
+            if col not in FUZZY_COLUMNS:
+                matches[col] = df_new.loc[pairs['new'], col].to_numpy()
+
+        df_old = df_old.copy()
+        for col in FUZZY_COLUMNS:
+            df_old.loc[pairs['old'], col] = df_new.loc[pairs['new'], col].to_numpy()
+        stats['fuzzy_matches'] = len(pairs)
+    return df_old, df_new, stats, matches
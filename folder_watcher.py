@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Stock List Folder Watcher
+Long-running process that compares every new stock list dropped into a folder against the
+previous one and publishes the reports, replacing the manual compare_stocks.sh step.
+
+Usage:
+    python stock_comparison_tool.py watch <folder> [--output-dir <folder>/comparisons]
+        [--settle-seconds 10] [--poll-seconds 5] [--polling] [--outputs excel,html]
+
+On Linux new files are noticed through inotify (via ctypes, no extra packages); elsewhere, or
+with --polling, the folder is scanned every --poll-seconds. A file is compared once it is
+complete: non-empty and unchanged for --settle-seconds. Only the previous snapshot's parsed
+frame is kept in memory, so memory stays flat however long it runs.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import gc
+import json
+import logging
+import os
+import select
+import shutil
+import signal
+import struct
+import sys
+import time
+from datetime import datetime
+
+from config_matching import MATCH_MODES
+from history_store import DEFAULT_HISTORY_DB
+from stock_comparison_tool import (DEDUPE_STRATEGIES, OUTPUT_TYPES, READER_ENGINES, SIGNIFICANT_QTY_CHANGE,
+                                   TOP_N, StockComparator, load_stock_file, parse_outputs)
+
+
+logger = logging.getLogger('folder_watcher')
+
+WORKBOOK_SUFFIXES = {'.xlsx', '.xls'}
+STAGING_FOLDER = '.staging'  # Inside the output folder, so publishing is an atomic rename
+LATEST_FILE = 'latest.json'  # Summary and artifacts of the most recent comparison
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len (name follows)
+INOTIFY_BUFFER_SIZE = 64 * 1024
+
+
+def is_workbook_name(name):
+    """Stock list workbooks, leaving out Excel lock files and hidden/partial uploads."""
+    return (os.path.splitext(name)[1].lower() in WORKBOOK_SUFFIXES
+            and not name.startswith(('~$', '.')))
+
+
+def scan_folder(folder):
+    """{name: (size, mtime)} of the workbooks in a folder."""
+    files = {}
+    for entry in os.scandir(folder):
+        if entry.is_file() and is_workbook_name(entry.name):
+            stat = entry.stat()
+            files[entry.name] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+class InotifyEvents:
+    """Names of files closed after writing or moved into a folder, via Linux inotify."""
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f'inotify_add_watch failed for {folder}')
+
+    def wait(self, timeout):
+        """File names with events in the next `timeout` seconds (empty list if none)."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, INOTIFY_BUFFER_SIZE)
+        names, offset = [], 0
+        while offset < len(data):
+            _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class StockWatcher:
+    """Compares each new workbook in a folder with the previous one and publishes the reports."""
+
+    def __init__(self, folder, output_dir=None, settle_seconds=10, poll_seconds=5, polling=False,
+                 history_db=None, keep_days=30, reader_engine='auto', outputs=OUTPUT_TYPES, **options):
+        self.folder = os.path.abspath(folder)
+        self.output_dir = os.path.abspath(output_dir or os.path.join(folder, 'comparisons'))
+        self.settle_seconds = settle_seconds
+        self.poll_seconds = poll_seconds
+        self.polling = polling
+        self.history_db = history_db
+        self.keep_days = keep_days  # Published reports older than this are removed (0 = keep all)
+        self.reader_engine = reader_engine
+        self.outputs = outputs
+        self.options = options  # Passed to StockComparator (threshold, top_n, dedupe, ...)
+        self.previous = None  # (path, parsed frame) of the snapshot new files are compared with
+        self.handled = {}  # name -> (size, mtime) already compared or skipped, for files still present
+        # Names seen but not yet complete -> ((size, mtime), monotonic time that signature was first seen)
+        self.pending = {}
+        self.stopping = False
+
+    def start(self):
+        """Use the newest workbook already in the folder as the first snapshot."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        files = scan_folder(self.folder)
+        self.handled = dict(files)
+        complete = [name for name, (size, _) in files.items() if size > 0]
+        if complete:
+            newest = max(complete, key=lambda name: files[name][1])
+            self.previous = (os.path.join(self.folder, newest), self.parse(os.path.join(self.folder, newest)))
+            logger.info(f"Baseline snapshot: {newest}")
+        else:
+            logger.info("No workbook in the folder yet; the first one dropped becomes the baseline")
+
+    def parse(self, path):
+        start = time.perf_counter()
+        df = load_stock_file(path, self.reader_engine)
+        logger.info(f"Parsed {os.path.basename(path)}: {len(df):,} rows in {time.perf_counter() - start:.2f}s")
+        return df
+
+    def collect(self, names):
+        """Queue new or changed workbooks for comparison once complete."""
+        files = scan_folder(self.folder)
+        # Forget files that are gone, so the bookkeeping can't grow without bound
+        self.handled = {name: sig for name, sig in self.handled.items() if name in files}
+        self.pending = {name: seen for name, seen in self.pending.items() if name in files}
+        for name in (files if names is None else [n for n in names if n in files]):
+            if self.handled.get(name) != files[name] and name not in self.pending:
+                self.pending[name] = (files[name], time.monotonic())
+
+        # Complete once non-empty and unchanged from scan to scan for settle_seconds; the mtime
+        # alone can't tell, as copies that keep it (cp -p, rsync -t) look old while half-written
+        ready = []
+        for name, (signature, since) in self.pending.items():
+            if signature != files[name]:
+                self.pending[name] = (files[name], time.monotonic())
+            elif files[name][0] > 0 and time.monotonic() - since >= self.settle_seconds:
+                ready.append(name)
+        for name in sorted(ready, key=lambda name: files[name][1]):
+            del self.pending[name]
+            self.handled[name] = files[name]
+            self.process(os.path.join(self.folder, name))
+
+    def process(self, path):
+        """Compare a complete new workbook with the previous snapshot and publish the reports."""
+        name = os.path.basename(path)
+        try:
+            df_new = self.parse(path)
+        except Exception as e:
+            logger.error(f"Could not read {name}, skipping it: {e}")
+            return
+        if self.previous is None:
+            self.previous = (path, df_new)
+            logger.info(f"Baseline snapshot: {name}")
+            return
+
+        old_path, df_old = self.previous
+        logger.info(f"Comparing {os.path.basename(old_path)} -> {name}")
+        staging = os.path.join(self.output_dir, STAGING_FOLDER)
+        os.makedirs(staging, exist_ok=True)
+        stem = os.path.splitext(name)[0]
+        start = time.perf_counter()
+        try:
+            comparator = StockComparator(old_path, path, os.path.join(staging, f'Comparison_{stem}.xlsx'),
+                                         history_db=self.history_db, outputs=self.outputs,
+                                         verbose=False, auto_open=False,
+                                         preloaded={'old': df_old.copy, 'new': df_new.copy}, **self.options)
+            comparator.analyse()
+            if self.history_db:
+                comparator.record_history()
+            comparator.export_results()
+            published = self.publish(comparator)
+        except Exception as e:
+            logger.error(f"Comparison of {name} failed: {e}")
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+
+        summary = comparator.summary()
+        self.write_latest(old_path, path, summary, published)
+        logger.info(f"Published {len(published)} file(s) for {name}: {summary['significant_changes']:,} "
+                    f"significant changes, net qty {summary['net_qty_change']:+,.0f} "
+                    f"({time.perf_counter() - start:.2f}s)")
+
+        # The new file is the next snapshot; drop everything else from this run
+        self.previous = (path, df_new)
+        del comparator, df_old
+        gc.collect()
+        self.prune_reports()
+
+    def publish(self, comparator):
+        """Move the finished artifacts from staging into the output folder (atomic renames)."""
+        published = []
+        for output in comparator.outputs:
+            source = comparator.artifact_path(output)
+            target = os.path.join(self.output_dir, os.path.basename(source))
+            os.replace(source, target)
+            published.append(target)
+        return published
+
+    def write_latest(self, old_path, new_path, summary, published):
+        """Point latest.json at the newest comparison (written atomically)."""
+        latest = {
+            'compared_at': datetime.now().isoformat(timespec='seconds'),
+            'old_file': old_path,
+            'new_file': new_path,
+            'summary': summary,
+            'files': published,
+        }
+        temp_path = os.path.join(self.output_dir, STAGING_FOLDER, LATEST_FILE)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(latest, f, indent=2)
+        os.replace(temp_path, os.path.join(self.output_dir, LATEST_FILE))
+
+    def prune_reports(self):
+        """Remove published reports older than keep_days."""
+        if not self.keep_days:
+            return
+        cutoff = time.time() - self.keep_days * 86400
+        for entry in os.scandir(self.output_dir):
+            if entry.is_file() and entry.name.startswith('Comparison_') and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+
+    def run(self):
+        """Watch until SIGTERM/SIGINT."""
+        self.start()
+        events = None
+        if not self.polling and sys.platform.startswith('linux'):
+            try:
+                events = InotifyEvents(self.folder)
+            except OSError as e:
+                logger.warning(f"inotify unavailable ({e}); polling every {self.poll_seconds}s instead")
+        logger.info(f"Watching {self.folder} ({'inotify' if events else 'polling'}), "
+                    f"publishing to {self.output_dir}")
+
+        try:
+            while not self.stopping:
+                if events is None:
+                    time.sleep(self.poll_seconds)
+                    self.collect(None)
+                else:
+                    # Files still settling are re-checked on each timeout until they are complete
+                    names = events.wait(self.poll_seconds)
+                    if names or self.pending:
+                        self.collect(names)
+        finally:
+            if events is not None:
+                events.close()
+        logger.info("Watcher stopped")
+
+    def stop(self, *_):
+        self.stopping = True
+
+
+def watch_main(argv):
+    """CLI: watch a folder and compare each new stock list with the previous one."""
+    parser = argparse.ArgumentParser(prog='stock_comparison_tool.py watch',
+                                     description='Compare every new stock list dropped into a folder.')
+    parser.add_argument('folder', help='Folder the supplier drops stock lists into')
+    parser.add_argument('--output-dir', help='Where reports are published (default: <folder>/comparisons)')
+    parser.add_argument('--settle-seconds', type=float, default=10,
+                        help='A file must be unchanged this long before it is compared (default: 10)')
+    parser.add_argument('--poll-seconds', type=float, default=5,
+                        help='Folder scan interval when polling (default: 5)')
+    parser.add_argument('--polling', action='store_true', help='Scan the folder instead of using inotify')
+    parser.add_argument('--keep-days', type=int, default=30,
+                        help='Remove published reports older than this, 0 to keep all (default: 30)')
+    parser.add_argument('--threshold', type=float, default=SIGNIFICANT_QTY_CHANGE,
+                        help=f'Minimum absolute qty change for a significant change (default: {SIGNIFICANT_QTY_CHANGE})')
+    parser.add_argument('--top', type=int, default=TOP_N,
+                        help=f'Number of entries in each Top-N list (default: {TOP_N})')
+    parser.add_argument('--dedupe', choices=DEDUPE_STRATEGIES, default='keep-all',
+                        help='How to handle duplicated Item # rows (default: keep-all)')
+    parser.add_argument('--match', choices=MATCH_MODES, default='exact',
+                        help='How configuration keys are matched (default: exact)')
+    parser.add_argument('--reader', choices=READER_ENGINES, default='auto', help='Excel reader (default: auto)')
+    parser.add_argument('--item-diff', action='store_true', help='Also compare individual Item # rows')
+    parser.add_argument('--outputs', type=parse_outputs, default=OUTPUT_TYPES,
+                        help=f"Comma-separated artifacts to publish, from {','.join(OUTPUT_TYPES)} (default: all)")
+    parser.add_argument('--history-db', default=DEFAULT_HISTORY_DB,
+                        help=f'History database to record each comparison in (default: {DEFAULT_HISTORY_DB})')
+    parser.add_argument('--no-history', action='store_true', help='Do not record comparisons in the history database')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.folder):
+        print(f"✗ Error: folder not found: {args.folder}")
+        return 1
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    watcher = StockWatcher(args.folder, args.output_dir, settle_seconds=args.settle_seconds,
+                           poll_seconds=args.poll_seconds, polling=args.polling,
+                           history_db=None if args.no_history else args.history_db, keep_days=args.keep_days,
+                           reader_engine=args.reader, outputs=args.outputs,
+                           qty_threshold=args.threshold, top_n=args.top, dedupe=args.dedupe,
+                           match_mode=args.match, item_diff=args.item_diff)
+    signal.signal(signal.SIGTERM, watcher.stop)
+    signal.signal(signal.SIGINT, watcher.stop)
+    watcher.run()
+    return 0
@@ -0,0 +1,51 @@
+"""
+Gunicorn configuration for the Stock Comparison web app (production entry point).
+
+    gunicorn -c gunicorn.conf.py web_app:app
+
+Every setting can be overridden with the environment variables below.
+"""
+
+import os
+import tempfile
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+
+# Worker processes, each with a few threads: a long comparison occupies one thread, while
+# downloads and results API calls keep being served by the others.
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# A large comparison (load, compare, Excel/PDF export) can take minutes
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 600))
+graceful_timeout = 60
+keepalive = 5
+
+# Recycle workers after this many requests so memory pandas never hands back is released;
+# the jitter stops every worker restarting at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 200))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 50))
+
+# Import the app (pandas, reportlab) once in the master; workers fork from it, so
+# recycled workers start quickly
+preload_app = True
+
+# Heartbeat files on tmpfs, so a slow disk can't make busy workers look dead
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = '-'
+errorlog = '-'
+
+# All workers must share one upload/results folder (uploads, artifacts and the result cache
+# live there); set before the app is imported
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(tempfile.gettempdir(), 'stock_comparison'))
+
+
+def on_starting(server):
+    """Clear files left over from a previous run, once, before any worker starts."""
+    import web_app
+    web_app.cleanup_old_files()
+    server.log.info(f"Upload folder: {web_app.app.config['UPLOAD_FOLDER']}")
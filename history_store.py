@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Comparison History Store
+Keeps every comparison's configuration-level results in an embedded SQLite
+database so price and quantity trends can be queried without re-reading Excel files.
+
+Usage:
+    python stock_comparison_tool.py history --model "iPhone 13" [--capacity 128GB]
+        [--color Blue] [--lock-status UNLOCKED] [--grade A] [--days 30] [--db stock_history.db]
+"""
+
+import argparse
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+
+DEFAULT_HISTORY_DB = os.environ.get('STOCK_HISTORY_DB', 'stock_history.db')
+
+# df_comparison column -> history column
+SNAPSHOT_COLUMNS = {
+    'Model': 'model',
+    'Capacity': 'capacity',
+    'Color': 'color',
+    'Lock Status': 'lock_status',
+    'Grade': 'grade',
+    'Status': 'status',
+    'OLD Qty': 'old_qty',
+    'NEW Qty': 'new_qty',
+    'OLD List Price': 'old_list_price',
+    'NEW List Price': 'new_list_price',
+    'OLD Offer Price': 'old_offer_price',
+    'Qty Change': 'qty_change',
+    'Qty Change %': 'qty_change_pct',
+    'List Price Change $': 'list_price_change',
+    'List Price Change %': 'list_price_change_pct',
+}
+
+KEY_COLUMNS = ['model', 'capacity', 'color', 'lock_status', 'grade']
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    snapshot_date TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    old_file TEXT,
+    new_file TEXT,
+    qty_threshold REAL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    snapshot_date TEXT NOT NULL,
+    model TEXT, capacity TEXT, color TEXT, lock_status TEXT, grade TEXT,
+    status TEXT,
+    old_qty REAL, new_qty REAL,
+    old_list_price REAL, new_list_price REAL, old_offer_price REAL,
+    qty_change REAL, qty_change_pct REAL,
+    list_price_change REAL, list_price_change_pct REAL
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_key_date
+    ON snapshots ({', '.join(KEY_COLUMNS)}, snapshot_date);
+CREATE INDEX IF NOT EXISTS idx_snapshots_date ON snapshots (snapshot_date);
+CREATE INDEX IF NOT EXISTS idx_runs_date ON runs (snapshot_date);
+"""
+
+
+class HistoryStore:
+    """Embedded store of per-run configuration snapshots, indexed by configuration and date."""
+
+    def __init__(self, db_path=DEFAULT_HISTORY_DB):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """A connection for one operation, committed (or rolled back) and closed afterwards."""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')  # Readers are not blocked while a run is written
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, comparator, snapshot_date=None):
+        """Store one comparison's configurations and deltas. Returns the run id."""
+        snapshot_date = snapshot_date or datetime.now().strftime('%Y-%m-%d')
+
+        df = comparator.df_comparison[list(SNAPSHOT_COLUMNS)].rename(columns=SNAPSHOT_COLUMNS)
+        df = df.astype(object).where(df.notna(), None)
+        for col in KEY_COLUMNS:
+            df[col] = df[col].map(lambda v: None if v is None else str(v))
+
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'INSERT INTO runs (snapshot_date, created_at, old_file, new_file, qty_threshold) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (snapshot_date, datetime.now().isoformat(timespec='seconds'),
+                 str(comparator.old_file), str(comparator.new_file), float(comparator.qty_threshold))
+            )
+            run_id = cursor.lastrowid
+
+            columns = ['run_id', 'snapshot_date'] + list(df.columns)
+            placeholders = ', '.join('?' * len(columns))
+            conn.executemany(
+                f"INSERT INTO snapshots ({', '.join(columns)}) VALUES ({placeholders})",
+                ((run_id, snapshot_date, *row) for row in df.itertuples(index=False, name=None))
+            )
+
+        return run_id
+
+    def trend(self, model, capacity=None, color=None, lock_status=None, grade=None, days=30):
+        """NEW-side qty and price per snapshot date for configurations matching the filters.
+
+        Unspecified key parts are aggregated over (qty summed, price qty-weighted). When
+        several runs on one snapshot date contain the same configuration, the latest of them
+        wins; runs of other stock lists that day don't hide it.
+        """
+        since = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        filters = {'model': model, 'capacity': capacity, 'color': color,
+                   'lock_status': lock_status, 'grade': grade}
+        where = ' AND '.join(f's.{col} = ?' for col, value in filters.items() if value is not None)
+        params = [value for value in filters.values() if value is not None]
+        latest = ' AND '.join(f'l.{col} IS s.{col}' for col in KEY_COLUMNS)  # IS: NULL-safe
+
+        query = f"""
+            SELECT s.snapshot_date AS snapshot_date,
+                   COUNT(*) AS configurations,
+                   SUM(s.new_qty) AS new_qty,
+                   SUM(s.new_list_price * s.new_qty) / NULLIF(SUM(CASE WHEN s.new_list_price IS NOT NULL
+                                                                       THEN s.new_qty END), 0) AS new_list_price,
+                   SUM(s.qty_change) AS qty_change
+            FROM snapshots s
+            WHERE {where} AND s.snapshot_date >= ?
+              AND s.run_id = (SELECT MAX(l.run_id) FROM snapshots l
+                              WHERE {latest} AND l.snapshot_date = s.snapshot_date)
+              AND s.status != 'Removed'
+            GROUP BY s.snapshot_date
+            ORDER BY s.snapshot_date
+        """
+        with self._connect() as conn:
+            return pd.read_sql_query(query, conn, params=params + [since])
+
+    def runs(self, limit=20):
+        """Most recent runs."""
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                'SELECT * FROM runs ORDER BY run_id DESC LIMIT ?', conn, params=[limit]
+            )
+
+
+def history_main(argv):
+    """CLI: print the price/qty trend for a configuration."""
+    parser = argparse.ArgumentParser(prog='stock_comparison_tool.py history',
+                                     description='Query price and quantity history.')
+    parser.add_argument('--model', help='Model, e.g. "iPhone 13" (omit to list recent runs)')
+    parser.add_argument('--capacity')
+    parser.add_argument('--color')
+    parser.add_argument('--lock-status')
+    parser.add_argument('--grade')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--db', default=DEFAULT_HISTORY_DB, help=f'History database (default: {DEFAULT_HISTORY_DB})')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"✗ Error: history database not found: {args.db}")
+        return 1
+
+    store = HistoryStore(args.db)
+    if not args.model:
+        print(store.runs().to_string(index=False))
+        return 0
+
+    df = store.trend(args.model, args.capacity, args.color, args.lock_status, args.grade, args.days)
+    if df.empty:
+        print("No history found for that configuration.")
+        return 0
+    print(df.to_string(index=False, float_format=lambda v: f"{v:,.2f}"))
+    return 0
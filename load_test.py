@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Load Test for the Stock Comparison Web App
+Starts local web_app.py server processes on generated workbooks, drives
+/api/compare and /api/download at a fixed concurrency and reports throughput,
+latency percentiles, error rate and peak RSS per server process.
+
+Runs are repeatable (fixed seed, same workbooks, same request order) and can be
+saved as JSON and compared against a previous release:
+
+Usage:
+    python load_test.py [--requests 20] [--concurrency 4] [--rows 2000] [--workers 1]
+    python load_test.py --server gunicorn --workers 4
+    python load_test.py --output release_a.json
+    python load_test.py --baseline release_a.json
+    python load_test.py --url http://localhost:5001   # existing server, no RSS figures
+"""
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmark import generate_stock_frame
+
+
+DOWNLOAD_TYPES = ['pdf', 'excel', 'html', 'text', 'zip']
+SERVER_START_TIMEOUT = 60  # Seconds to wait for /api/health
+REQUEST_TIMEOUT = 600
+
+
+def generate_workbooks(workbook_dir, pairs, rows, seed):
+    """Write `pairs` OLD/NEW workbook pairs (reused when they already exist)."""
+    paths = []
+    for pair in range(pairs):
+        pair_paths = []
+        for side, offset in (('old', 0), ('new', 1)):
+            path = os.path.join(workbook_dir, f'{side}_{rows}_{seed}_{pair:03d}.xlsx')
+            if not os.path.exists(path):
+                generate_stock_frame(rows, seed + 2 * pair + offset).to_excel(path, index=False)
+            pair_paths.append(path)
+        paths.append(tuple(pair_paths))
+    return paths
+
+
+def encode_multipart(fields, files):
+    """multipart/form-data body and content type for form fields and (name, path) files."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, path in files.items():
+        with open(path, 'rb') as f:
+            data = f.read()
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                     f'filename="{os.path.basename(path)}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def timed_request(url, data=None, headers=None):
+    """(status, body, seconds) for one request; status 0 on a connection error."""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers or {}),
+                                    timeout=REQUEST_TIMEOUT) as response:
+            body = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        body, status = e.read(), e.code
+    except (urllib.error.URLError, OSError) as e:
+        body, status = str(e).encode(), 0
+    return status, body, time.perf_counter() - start
+
+
+def run_session(base_url, old_path, new_path, downloads):
+    """One user session: compare a workbook pair, then download the requested artifacts.
+
+    Returns a list of (endpoint, status, seconds, bytes).
+    """
+    body, content_type = encode_multipart({}, {'old_file': old_path, 'new_file': new_path})
+    status, response, seconds = timed_request(f'{base_url}/api/compare', body, {'Content-Type': content_type})
+    samples = [('compare', status, seconds, len(body))]
+    if status != 200:
+        return samples
+
+    files = json.loads(response)['files']
+    for file_type in downloads:
+        status, response, seconds = timed_request(f'{base_url}{files[file_type]}')
+        samples.append(('download', status, seconds, len(response)))
+    return samples
+
+
+def start_server(port, workdir, server='dev', workers=1):
+    """Start web_app.py on `port` with its own history database and upload folder.
+
+    'dev' runs the Flask development server (one process); 'gunicorn' runs the
+    production configuration with `workers` worker processes.
+    """
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PORT=str(port), STOCK_HISTORY_DB=os.path.join(workdir, f'history_{port}.db'),
+               UPLOAD_FOLDER=os.path.join(workdir, f'uploads_{port}'), WEB_CONCURRENCY=str(workers))
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(app_dir, 'gunicorn.conf.py'), 'web_app:app']
+    else:
+        command = [sys.executable, os.path.join(app_dir, 'web_app.py')]
+    log = open(os.path.join(workdir, f'server_{port}.log'), 'w')
+    process = subprocess.Popen(command, cwd=app_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    process.log = log
+    return process
+
+
+def wait_until_healthy(base_url, process):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server for {base_url} exited with code {process.returncode}")
+        status, _, _ = timed_request(f'{base_url}/api/health')
+        if status == 200:
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become healthy within {SERVER_START_TIMEOUT}s")
+
+
+def worker_pids(pid):
+    """A server process and its direct children (gunicorn workers), from /proc on Linux."""
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [pid] + [int(child) for child in f.read().split()]
+    except OSError:
+        return [pid]
+
+
+def peak_rss_mb(pid):
+    """Peak resident set size of a process in MB (Linux /proc only), or None."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def latency_stats(seconds):
+    if not seconds:
+        return {'count': 0}
+    values = np.array(seconds)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'count': len(values), 'mean': float(values.mean()), 'p50': float(p50), 'p95': float(p95),
+            'p99': float(p99), 'max': float(values.max())}
+
+
+def summarise(samples, elapsed):
+    """Throughput, latency percentiles and error rate, overall and per endpoint."""
+    results = {'elapsed_s': elapsed, 'requests': len(samples),
+               'throughput_rps': len(samples) / elapsed if elapsed else 0.0,
+               'error_rate': sum(1 for _, status, _, _ in samples if status != 200) / len(samples) if samples else 0.0,
+               'endpoints': {}}
+    for endpoint in sorted({sample[0] for sample in samples}):
+        subset = [sample for sample in samples if sample[0] == endpoint]
+        ok = [seconds for _, status, seconds, _ in subset if status == 200]
+        results['endpoints'][endpoint] = {
+            **latency_stats(ok),
+            'requests': len(subset),
+            'errors': len(subset) - len(ok),
+            'throughput_rps': len(subset) / elapsed if elapsed else 0.0,
+            'bytes': sum(size for _, _, _, size in subset),
+        }
+    return results
+
+
+def print_results(results, baseline=None):
+    print(f"\n{'Endpoint':<10} {'Requests':>9} {'Errors':>7} {'Req/s':>8} {'p50 (s)':>9} {'p95 (s)':>9} {'p99 (s)':>9}")
+    for endpoint, stats in results['endpoints'].items():
+        print(f"{endpoint:<10} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput_rps']:>8.2f} "
+              f"{stats.get('p50', float('nan')):>9.3f} {stats.get('p95', float('nan')):>9.3f} "
+              f"{stats.get('p99', float('nan')):>9.3f}")
+    print(f"\nTotal: {results['requests']} requests in {results['elapsed_s']:.1f}s "
+          f"({results['throughput_rps']:.2f} req/s), error rate {results['error_rate']:.1%}")
+    for worker, rss in results['peak_rss_mb'].items():
+        print(f"Peak RSS {worker}: {rss:.1f} MB" if rss is not None else f"Peak RSS {worker}: n/a")
+
+    if baseline is not None:
+        print(f"\nVs baseline ({baseline['config'].get('label') or 'unlabelled'}):")
+        print(f"{'Endpoint':<10} {'Req/s':>16} {'p95 (s)':>18}")
+        for endpoint, stats in results['endpoints'].items():
+            old = baseline['results']['endpoints'].get(endpoint)
+            if old is None or 'p95' not in old or 'p95' not in stats:
+                continue
+            print(f"{endpoint:<10} {old['throughput_rps']:>7.2f} -> {stats['throughput_rps']:<6.2f} "
+                  f"{old['p95']:>8.3f} -> {stats['p95']:<7.3f}")
+        print(f"{'error rate':<10} {baseline['results']['error_rate']:.1%} -> {results['error_rate']:.1%}")
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Load test the Stock Comparison web app.")
+    parser.add_argument('--requests', type=int, default=20, help='Compare sessions to run (default: 20)')
+    parser.add_argument('--concurrency', type=int, default=4, help='Sessions in flight at once (default: 4)')
+    parser.add_argument('--rows', type=int, default=2000, help='Rows per generated workbook (default: 2000)')
+    parser.add_argument('--pairs', type=int, default=None,
+                        help='Distinct workbook pairs, cycled across sessions (default: one per session, '
+                             'so every compare misses the result cache)')
+    parser.add_argument('--downloads', nargs='*', default=DOWNLOAD_TYPES, choices=DOWNLOAD_TYPES,
+                        help='Artifacts downloaded after each compare (default: all)')
+    parser.add_argument('--server', choices=['dev', 'gunicorn'], default='dev',
+                        help='Local server: Flask development server or the gunicorn production config')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='dev: server processes, requests round-robin; gunicorn: worker processes')
+    parser.add_argument('--port', type=int, default=5101, help='First local server port (default: 5101)')
+    parser.add_argument('--url', nargs='+', help='Test already-running servers instead of starting local ones')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workbook-dir', help='Where generated workbooks are kept between runs '
+                                               '(default: a temporary folder)')
+    parser.add_argument('--label', help='Name for this run in the JSON output, e.g. a release tag')
+    parser.add_argument('--output', help='Write config and results as JSON')
+    parser.add_argument('--baseline', help='JSON from a previous run to compare against')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        workbook_dir = args.workbook_dir or workdir
+        os.makedirs(workbook_dir, exist_ok=True)
+        pairs = args.pairs or args.requests
+        print(f"Generating {pairs} workbook pair(s) of {args.rows:,} rows...")
+        workbooks = generate_workbooks(workbook_dir, pairs, args.rows, args.seed)
+
+        processes = []
+        if args.url:
+            base_urls = [url.rstrip('/') for url in args.url]
+        else:
+            servers = 1 if args.server == 'gunicorn' else args.workers
+            base_urls = [f'http://127.0.0.1:{args.port + i}' for i in range(servers)]
+            processes = [start_server(args.port + i, workdir, args.server, args.workers) for i in range(servers)]
+
+        try:
+            for base_url, process in itertools.zip_longest(base_urls, processes):
+                wait_until_healthy(base_url, process)
+
+            sessions = [(base_urls[i % len(base_urls)], *workbooks[i % pairs]) for i in range(args.requests)]
+            print(f"Running {args.requests} session(s) at concurrency {args.concurrency} "
+                  f"against {len(base_urls)} server(s)...")
+            samples, lock = [], threading.Lock()
+
+            def worker(session):
+                result = run_session(*session, args.downloads)
+                with lock:
+                    samples.extend(result)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                list(pool.map(worker, sessions))
+            elapsed = time.perf_counter() - start
+
+            results = summarise(samples, elapsed)
+            results['peak_rss_mb'] = {}
+            for base_url, process in itertools.zip_longest(base_urls, processes):
+                pids = worker_pids(process.pid) if process is not None else [None]
+                for pid in pids:
+                    name = base_url if len(pids) == 1 else f'{base_url} pid {pid}'
+                    results['peak_rss_mb'][name] = peak_rss_mb(pid) if pid is not None else None
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+                process.log.close()
+
+    print_results(results, baseline)
+
+    if args.output:
+        config = {key: getattr(args, key) for key in ('label', 'requests', 'concurrency', 'rows', 'downloads',
+                                                       'server', 'workers', 'seed')}
+        config['pairs'] = pairs
+        with open(args.output, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2)
+        print(f"\n✓ Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
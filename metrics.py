@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Service Metrics
+Minimal Prometheus-compatible counters, gauges and histograms for the web service,
+rendered in the text exposition format by the /metrics endpoint.
+
+Given a directory, every metric keeps its values in one file there, updated under an
+flock, so all worker processes add to the same totals and any of them can answer a
+scrape; counters survive worker restarts. Gauges are summed over the live processes.
+Without a directory (or fcntl) values are kept per process.
+"""
+
+import bisect
+import json
+import os
+import threading
+
+try:
+    import fcntl  # Optional: values shared by worker processes (not available on Windows)
+except ImportError:
+    fcntl = None
+
+
+# Seconds; covers everything from a cached API call to a multi-minute comparison
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def format_labels(labelnames, values, extra=()):
+    """Render a label set, e.g. {route="/api/compare",method="POST"}."""
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    """Render a sample value (integers without a trailing .0)."""
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def process_alive(pid):
+    """Whether process `pid` still exists."""
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Exists, owned by another user
+    return True
+
+
+class Metric:
+    """A named metric family with optional labels."""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        self.path = None  # Values file shared by every process, set by Registry(directory)
+
+    def label_key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def decode_value(self, value):
+        return value
+
+    def update(self, change):
+        """Apply change(values) to the values; to the shared file under an exclusive lock if there is one."""
+        with self.lock:
+            if self.path is None:
+                change(self.values)
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                text = f.read()
+                values = {tuple(key): self.decode_value(value) for key, value in json.loads(text)} if text else {}
+                change(values)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps([[list(key), value] for key, value in values.items()]))
+
+    def current_values(self):
+        """{label tuple: value} as of now."""
+        if self.path is None:
+            with self.lock:
+                return dict(self.values)
+        try:
+            with open(self.path) as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                text = f.read()
+        except FileNotFoundError:
+            return {}
+        return {tuple(key): self.decode_value(value) for key, value in json.loads(text)} if text else {}
+
+    def samples(self):
+        """(suffix, label text, value) for every sample of this family."""
+        return [('', format_labels(self.labelnames, key), value)
+                for key, value in sorted(self.current_values().items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{self.name}{suffix}{labels} {format_value(value)}' for suffix, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing total."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_key(labels)
+
+        def add(values):
+            values[key] = values.get(key, 0) + amount
+        self.update(add)
+
+
+class Gauge(Metric):
+    """Value that goes up and down, or is computed by a function (set_function).
+
+    Each process's values are kept under its pid; samples are the sum over live processes.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.function = None
+        self.per_process = False
+        self.published = None
+
+    def update(self, change):
+        def prune_and_change(values):
+            dead = {key[0] for key in values if not process_alive(int(key[0]))}
+            for key in [key for key in values if key[0] in dead]:
+                del values[key]
+            change(values)
+        super().update(prune_and_change)
+
+    def set(self, value, **labels):
+        key = (str(os.getpid()),) + self.label_key(labels)
+
+        def assign(values):
+            values[key] = value
+        self.update(assign)
+
+    def inc(self, amount=1, **labels):
+        key = (str(os.getpid()),) + self.label_key(labels)
+
+        def add(values):
+            values[key] = values.get(key, 0) + amount
+        self.update(add)
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, per_process=False):
+        """Compute the samples with function() -> {label tuple: value}.
+
+        Functions of shared state (e.g. files on disk) run when scraped. Per-process ones
+        (e.g. in-memory caches) are published by each process on refresh().
+        """
+        self.function = function
+        self.per_process = per_process
+
+    def refresh(self):
+        """Publish this process's per-process function values, if they changed since the last refresh."""
+        if self.function is None or not self.per_process:
+            return
+        values = {tuple(str(v) for v in key): value for key, value in self.function().items()}
+        if values == self.published:
+            return
+        self.published = values
+        pid = str(os.getpid())
+
+        def replace(shared):
+            for key in [key for key in shared if key[0] == pid]:
+                del shared[key]
+            shared.update({(pid,) + key: value for key, value in values.items()})
+        self.update(replace)
+
+    def current_values(self):
+        if self.function is not None and not self.per_process:
+            return dict(self.function())
+        totals = {}
+        for (pid, *key), value in super().current_values().items():
+            if process_alive(int(pid)):
+                totals[tuple(key)] = totals.get(tuple(key), 0) + value
+        return totals
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, plus their sum and count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def decode_value(self, value):
+        counts, total = value
+        return counts, total
+
+    def observe(self, value, **labels):
+        key = self.label_key(labels)
+
+        def add(values):
+            counts, total = values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts = list(counts)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            values[key] = (counts, total + value)
+        self.update(add)
+
+    def samples(self):
+        samples = []
+        items = sorted(self.current_values().items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else format_value(bound)
+                samples.append(('_bucket', format_labels(self.labelnames, key, [('le', le)]), cumulative))
+            samples.append(('_sum', format_labels(self.labelnames, key), total))
+            samples.append(('_count', format_labels(self.labelnames, key), cumulative))
+        return samples
+
+
+class Registry:
+    """Collection of metric families rendered together."""
+
+    def __init__(self, directory=None):
+        """Values are shared through one file per metric in `directory`, or kept per process."""
+        self.directory = directory if fcntl is not None else None
+        self.metrics = []
+
+    def register(self, metric):
+        if self.directory is not None:
+            metric.path = os.path.join(self.directory, f'{metric.name}.json')
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def refresh(self):
+        """Publish this process's per-process gauge values."""
+        for metric in self.metrics:
+            if isinstance(metric, Gauge):
+                metric.refresh()
+
+    def render(self):
+        """Text exposition format (Content-Type: text/plain; version=0.0.4)."""
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
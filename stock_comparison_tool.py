@@ -5,24 +5,929 @@ Compares OLD and NEW stock lists to provide purchasing insights.
 
 Usage:
     python stock_comparison_tool.py <old_file.xlsx> <new_file.xlsx> [output_file.txt]
+        [--threshold 100] [--top 10] [--history-db stock_history.db | --no-history] [--preview]
+    python stock_comparison_tool.py history --model "iPhone 13" [--capacity 128GB] [--days 30]
+    python stock_comparison_tool.py batch <manifest.csv | folder> [--output-dir batch_output] [--workers N]
+    python stock_comparison_tool.py watch <folder> [--output-dir <folder>/comparisons]
 """
 
 import pandas as pd
 import numpy as np
-from datetime import datetime
+from pandas.io.parsers import TextParser
+from datetime import date, datetime
+import argparse
 import sys
 import os
 from pathlib import Path
 import subprocess
 import zipfile
+import io
+import base64
+import json
+import string
+import time
+from functools import lru_cache
+from itertools import chain, islice
+
+import openpyxl
+from openpyxl.utils.exceptions import InvalidFileException
+
+from history_store import HistoryStore, DEFAULT_HISTORY_DB, history_main
+from config_matching import MATCH_MODES, match_configurations, normalise_value
+
+try:
+    import python_calamine  # Optional: native xlsx reader, much faster than openpyxl
+except ImportError:
+    python_calamine = None
+
+# Matching configurations whose absolute qty change reaches this are "significant"
+SIGNIFICANT_QTY_CHANGE = 100
+
+# Number of entries in each Top-N insight list
+TOP_N = 10
+
+# Columns that identify a configuration
+GROUPING_COLS = ['Model', 'Capacity', 'Color', 'Lock Status', 'Grade']
+
+# Drill-down hierarchy of the rollup cube; every prefix (including the grand total) is a node
+ROLLUP_LEVELS = ['Model', 'Capacity', 'Grade']
+# Qty-weighted prices carried up the cube: price column -> the qty column that weights it
+ROLLUP_PRICES = {'OLD List Price': 'OLD Qty', 'OLD Offer Price': 'OLD Qty', 'NEW List Price': 'NEW Qty'}
+
+# Anomaly scoring: modified z-scores of each matching configuration's qty and price move
+# against the other configurations of its Model family, weighted by volume
+ANOMALY_FAMILY_COL = 'Model'
+ANOMALY_THRESHOLD = 3.5  # Anomaly Score at which a move is flagged (Iglewicz-Hoaglin cut-off)
+ANOMALY_COLS = ['Qty Score', 'Price Score', 'Volume Weight', 'Anomaly Score']
+
+# Text report: item blocks are str.format templates compiled once (see ReportTemplate)
+REPORT_FIELDS = {
+    'old_price': 'OLD List Price',
+    'new_price': 'NEW List Price',
+    'price_change': 'List Price Change $',
+    'price_pct': 'List Price Change %',
+    'old_qty': 'OLD Qty',
+    'new_qty': 'NEW Qty',
+    'qty_change': 'Qty Change',
+    'qty_pct': 'Qty Change %',
+    'anomaly_score': 'Anomaly Score',
+    'qty_score': 'Qty Score',
+    'price_score': 'Price Score',
+}
+REPORT_PRICE_LINE = "  {label}: ${{old_price:.2f}} -> ${{new_price:.2f}} | Change: ${{price_change:+.2f}} ({{price_pct:+.1f}}%)"
+REPORT_QTY_LINE = "  {label}: {{old_qty:,.0f}} -> {{new_qty:,.0f}}{units} | Change: {{qty_change:+,.0f}} ({{qty_pct:+.1f}}%)"
+ITEM_NAME_PARTS = [('Model', '', ''), ('Capacity', '', ''), ('Color', '', ''),
+                   ('Lock Status', '(', ')'), ('Grade', '(DLS ', ')')]
+REPORT_DETAIL_ROWS = 50  # Rows in the detail section; None renders every significant change
+REPORT_CHUNK_ROWS = 10000
+REPORT_BUFFER_SIZE = 1024 * 1024
+
+# Executive dashboard template and the metrics embedded for every significant change
+DASHBOARD_TEMPLATE_PATH = Path(__file__).resolve().parent / 'templates' / 'executive_dashboard.html'
+DASHBOARD_METRICS = ['OLD Qty', 'NEW Qty', 'Qty Change', 'Qty Change %',
+                     'OLD List Price', 'NEW List Price', 'List Price Change %', 'Anomaly Score']
+DASHBOARD_MAX_ANOMALIES = 50  # Largest choice of the dashboard's Top-N selector
+
+# Duplicate Item # handling: keep-all (default, every row counts toward its configuration),
+# keep-first, keep-max-qty (row with the largest qty), sum (one row, qty summed and prices
+# qty-weighted) or reject (raise if any Item # repeats)
+DEDUPE_STRATEGIES = ['keep-all', 'keep-first', 'keep-max-qty', 'sum', 'reject']
+EXCEL_MAX_ROWS = 1048576
+DUPLICATE_REPORT_COLS = ['Item #', 'Occurrences', 'Model', 'Capacity', 'Color', 'Lock Status', 'Grade',
+                         'Total Qty', 'Min List Price', 'Max List Price']
+
+# Item-level diff classes, in priority order (an item gets the first that applies)
+ITEM_CHANGES = ['added', 'removed', 'reclassified', 'qty change', 'price change', 'unchanged']
+ITEM_PRICE_TOLERANCE = 0.005  # List price differences below half a cent are not a change
+ITEM_ROLLUP_CHANGES = ['added', 'removed', 'reclassified in', 'reclassified out',
+                       'qty change', 'price change', 'unchanged']
+
+# Excel reader engines: auto uses calamine when python-calamine is installed, else openpyxl
+READER_ENGINES = ['auto', 'calamine', 'openpyxl']
+HEADER_SCAN_ROWS = 20  # Rows searched for the 'Item #' header (supplier files have metadata above it)
+PREVIEW_ROWS = 2000  # Data rows sampled from each file for a preview (see preview())
+
+# Artifacts export_results can write (--outputs); the web app renders each on first download
+OUTPUT_TYPES = ['text', 'excel', 'html', 'zip']
+# Comparator state the artifact renderers read, saved by render_state() for rendering later
+RENDER_STATE_ATTRS = ['old_file', 'new_file', 'output_file', 'qty_threshold', 'top_n', 'detail_rows',
+                      'df_old_grouped', 'df_new_grouped', 'df_comparison', 'df_filtered',
+                      'df_items', 'df_item_rollup', 'fuzzy_matches', 'duplicates', 'cube', 'df_anomalies']
+
+# Package members in these formats are already compressed and are stored as-is
+PACKAGE_STORED_SUFFIXES = {'.xlsx', '.xls', '.zip', '.pdf', '.png', '.jpg', '.gz'}
+PACKAGE_CHUNK_SIZE = 256 * 1024
+
+# Top-N insight lists: name -> (rank column, sign column, increases?)
+TOP_INSIGHT_QUERIES = {
+    'price_increases': ('List Price Change %', 'List Price Change %', True),
+    'price_decreases': ('List Price Change %', 'List Price Change %', False),
+    'qty_increases': ('Qty Change %', 'Qty Change', True),
+    'qty_decreases': ('Qty Change %', 'Qty Change', False),
+}
+
+
+def resolve_reader_engine(engine='auto'):
+    """The concrete reader for an engine setting ('auto' picks the fastest installed)."""
+    if engine not in READER_ENGINES:
+        raise ValueError(f"Unknown reader engine '{engine}' (choose from {', '.join(READER_ENGINES)})")
+    if engine == 'auto':
+        return 'calamine' if python_calamine is not None else 'openpyxl'
+    if engine == 'calamine' and python_calamine is None:
+        raise ImportError("The calamine reader needs python-calamine (pip install python-calamine)")
+    return engine
+
+
+def calamine_sheet_data(path):
+    """Cells of the first sheet as rows, converted the way pandas' openpyxl reader does."""
+    sheet = python_calamine.CalamineWorkbook.from_object(path).get_sheet_by_index(0)
+    return sheet_rows_to_data(sheet.to_python(skip_empty_area=False))
+
+
+def sheet_rows_to_data(rows):
+    """Rows of cell values as pandas' openpyxl reader would hand them to TextParser.
+
+    Whole-number floats become ints, dates become datetimes, empty cells are '', trailing
+    empty cells and rows are trimmed and short rows padded, so TextParser builds the same
+    frame read_excel would.
+    """
+    data = []
+    last_row_with_data = -1
+    for row in rows:
+        row = [int(value) if value.__class__ is float and value.is_integer() else
+               datetime(value.year, value.month, value.day) if value.__class__ is date else
+               '' if value is None else value
+               for value in row]
+        while row and row[-1] == '':
+            row.pop()
+        if row:
+            last_row_with_data = len(data)
+        data.append(row)
+    data = data[:last_row_with_data + 1]
+
+    if data:
+        width = max(len(row) for row in data)
+        data = [row + [''] * (width - len(row)) if len(row) < width else row for row in data]
+    return data
+
+
+def find_header_row(first_column):
+    """Index of the 'Item #' header among the first HEADER_SCAN_ROWS values of column A, or None."""
+    for i, value in enumerate(first_column[:HEADER_SCAN_ROWS]):
+        if str(value).strip() == 'Item #':
+            return i
+    return None
+
+
+def load_stock_file(path, engine='auto'):
+    """Read a stock list workbook, starting at its 'Item #' header row.
+
+    `path` may also be the workbook's bytes or a binary file object. Both engines produce
+    the same frame: calamine rows go through the same TextParser step pandas.read_excel uses.
+    """
+    if isinstance(path, (bytes, bytearray)):
+        path = io.BytesIO(path)
+    if resolve_reader_engine(engine) == 'calamine':
+        data = calamine_sheet_data(path)
+        header_row = find_header_row([row[0] for row in data[:HEADER_SCAN_ROWS]])
+        return TextParser(data, header=header_row or 0, skip_blank_lines=False).read()
+
+    def read_excel(**kwargs):
+        if hasattr(path, 'seek'):
+            path.seek(0)  # The workbook is read twice
+        return pd.read_excel(path, **kwargs)
+
+    # Try to find the header row (supplier files may have metadata rows above it)
+    df_temp = read_excel(header=None, nrows=HEADER_SCAN_ROWS)
+    header_row = find_header_row(list(df_temp.iloc[:, 0])) if len(df_temp.columns) else None
+    if header_row is None:
+        # No header metadata, try default
+        return read_excel()
+    return read_excel(header=header_row)
+
+
+def sample_stock_file(path, rows=PREVIEW_ROWS, stride=1, engine='auto'):
+    """The first `rows` data rows of a stock list workbook (every `stride`-th row with stride > 1).
+
+    .xlsx files are streamed with openpyxl's read-only reader, which stops as soon as the
+    sample is complete, so the cost grows with rows * stride rather than with the sheet.
+    Other formats (.xls) are read in full with load_stock_file() and sampled afterwards.
+    Columns and header detection match load_stock_file().
+    """
+    if isinstance(path, (bytes, bytearray)):
+        path = io.BytesIO(path)
+    try:
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile):
+        if hasattr(path, 'seek'):
+            path.seek(0)
+        return load_stock_file(path, engine).iloc[::stride].head(rows).reset_index(drop=True)
+
+    try:
+        sheet_rows = workbook.worksheets[0].iter_rows(values_only=True)
+        head = list(islice(sheet_rows, HEADER_SCAN_ROWS))
+        if not head:
+            raise pd.errors.EmptyDataError('No columns to parse from file')  # As load_stock_file() reports it
+        header_row = find_header_row([row[0] if row else None for row in head]) or 0
+        body = chain(head[header_row + 1:], sheet_rows)
+        data = sheet_rows_to_data([head[header_row]] + list(islice(body, 0, rows * stride, stride)))
+    finally:
+        workbook.close()
+    return TextParser(data, header=0, skip_blank_lines=False).read()
+
+
+def aggregate_configurations(df, price_columns):
+    """Aggregate rows per configuration with qty-weighted average prices.
+
+    Count, sum(qty), and per price column sum(price * qty), the qty that carries a
+    price, sum(price) and the number of prices are all computed by a single grouped
+    sum; the source frame is not modified. A price is weighted only by the qty of
+    rows that actually have that price. Configurations whose priced qty is zero fall
+    back to the plain mean price instead of producing inf/NaN.
+
+    Returns one row per configuration with GROUPING_COLS, 'Item Count', 'Qty' and one
+    weighted average column per price column (NaN if the column is missing).
+    """
+    qty = df['Available Quantity']
+    sums = {'Item Count': np.ones(len(df), dtype=np.int64), 'Qty': qty}
+    present = [col for col in price_columns if col in df.columns]
+    for col in present:
+        price = df[col]
+        sums[f'{col} wsum'] = price * qty
+        sums[f'{col} wqty'] = qty.where(price.notna())
+        sums[f'{col} sum'] = price
+        sums[f'{col} n'] = price.notna()
+
+    grouped = pd.DataFrame(sums, index=df.index).groupby(
+        [df[col] for col in GROUPING_COLS]
+    ).sum().reset_index()
+
+    result = grouped[GROUPING_COLS + ['Item Count', 'Qty']].copy()
+    for col in price_columns:
+        if col not in present:
+            result[col] = np.nan
+            continue
+        wsum = grouped[f'{col} wsum'].to_numpy(dtype=float)
+        wqty = grouped[f'{col} wqty'].to_numpy(dtype=float)
+        psum = grouped[f'{col} sum'].to_numpy(dtype=float)
+        pcount = grouped[f'{col} n'].to_numpy(dtype=float)
+
+        mean_price = np.divide(psum, pcount, out=np.full(len(grouped), np.nan), where=pcount > 0)
+        result[col] = np.divide(wsum, wqty, out=mean_price, where=wqty > 0)
+
+    return result
+
+
+def dedupe_items(df, strategy='keep-all', label='file'):
+    """Resolve duplicated Item # rows with one of DEDUPE_STRATEGIES.
+
+    Item numbers are hashed once (pd.factorize); codes are assigned in order of
+    first appearance, so every strategy is a linear pass over those codes.
+
+    Returns (deduped frame, duplicates report with one row per repeated Item #).
+    """
+    if strategy not in DEDUPE_STRATEGIES:
+        raise ValueError(f"Unknown dedupe strategy '{strategy}' (choose from {', '.join(DEDUPE_STRATEGIES)})")
+
+    codes, uniques = pd.factorize(df['Item #'], use_na_sentinel=False)
+    counts = np.bincount(codes, minlength=len(uniques))
+    # A row is the first of its Item # when its code exceeds every earlier code
+    first = np.empty(len(codes), dtype=bool)
+    if len(codes):
+        first[0] = True
+        first[1:] = codes[1:] > np.maximum.accumulate(codes)[:-1]
+
+    qty = df['Available Quantity'].to_numpy(dtype=float)
+    price = df['List Price'].to_numpy(dtype=float)
+    repeated = counts > 1
+    report = df.loc[first & repeated[codes], GROUPING_COLS + ['Item #']].copy()
+    repeated_codes = codes[first & repeated[codes]]
+    report['Occurrences'] = counts[repeated_codes]
+    report['Total Qty'] = np.bincount(codes, weights=np.nan_to_num(qty), minlength=len(uniques))[repeated_codes]
+    if repeated.any():
+        dup_rows = repeated[codes]
+        prices = pd.Series(price[dup_rows]).groupby(codes[dup_rows], sort=False)
+        report['Min List Price'] = prices.min().reindex(repeated_codes).to_numpy()
+        report['Max List Price'] = prices.max().reindex(repeated_codes).to_numpy()
+    else:
+        report['Min List Price'] = report['Max List Price'] = np.nan
+    report = report[DUPLICATE_REPORT_COLS].reset_index(drop=True)
+
+    if strategy == 'keep-all' or not repeated.any():
+        return df, report
+    if strategy == 'reject':
+        examples = ', '.join(report['Item #'].astype(str).head(5))
+        raise ValueError(f"{label}: {len(report):,} Item # values are duplicated (e.g. {examples})")
+    if strategy == 'keep-first':
+        return df[first], report
+    if strategy == 'keep-max-qty':
+        # Ties keep the earliest row; rows without a qty lose to any row with one
+        ranked = np.nan_to_num(qty, nan=-np.inf)
+        group_max = pd.Series(ranked).groupby(codes).max().to_numpy()
+        candidates = np.flatnonzero(ranked == group_max[codes])
+        keep = np.zeros(len(df), dtype=bool)
+        keep[candidates[~pd.Series(codes[candidates]).duplicated().to_numpy()]] = True
+        return df[keep], report
+
+    # sum: first row of each Item # carries the summed qty and qty-weighted prices
+    result = df[first].copy()
+    first_codes = codes[first]
+    qty_sum = np.bincount(codes, weights=np.nan_to_num(qty), minlength=len(uniques))
+    result['Available Quantity'] = np.where(
+        np.bincount(codes, weights=~np.isnan(qty), minlength=len(uniques)) > 0, qty_sum, np.nan
+    )[first_codes]
+    for col in ['List Price', 'New Offer Price']:
+        if col not in df.columns:
+            continue
+        values = df[col].to_numpy(dtype=float)
+        priced = ~np.isnan(values)
+        wsum = np.bincount(codes, weights=np.where(priced, values * np.nan_to_num(qty), 0), minlength=len(uniques))
+        wqty = np.bincount(codes, weights=np.where(priced, np.nan_to_num(qty), 0), minlength=len(uniques))
+        psum = np.bincount(codes, weights=np.where(priced, values, 0), minlength=len(uniques))
+        pcount = np.bincount(codes, weights=priced, minlength=len(uniques))
+        mean_price = np.divide(psum, pcount, out=np.full(len(uniques), np.nan), where=pcount > 0)
+        result[col] = np.divide(wsum, wqty, out=mean_price, where=wqty > 0)[first_codes]
+    return result, report
+
+
+def item_key_codes(old_values, new_values, normalise=True):
+    """Integer codes for one key column across OLD and NEW items (-1 = missing).
+
+    Equal codes mean the same key; with normalise, spellings that differ only in
+    case/spacing/punctuation share a code. Also returns the display spelling per
+    code: the first one seen in NEW, else OLD, as in canonicalise_values().
+    """
+    codes, uniques = pd.factorize(np.concatenate([new_values, old_values]))
+    if normalise:
+        key_codes, _ = pd.factorize(np.array([normalise_value(value) for value in uniques], dtype=object))
+        spelling = pd.Series(uniques).groupby(key_codes, sort=False).first().to_numpy()
+        codes = np.where(codes >= 0, key_codes[codes], -1)
+    else:
+        spelling = np.asarray(uniques, dtype=object)
+    return codes[len(new_values):], codes[:len(new_values)], spelling
+
+
+def diff_items(df_old, df_new, normalise=True):
+    """Item-level diff: join OLD and NEW on Item # and classify every item (see ITEM_CHANGES).
+
+    Item # is hashed once into codes shared by both sides, so the join is a pair
+    of position arrays. Repeated Item # rows are summed per item as in
+    dedupe_items 'sum', and each item keeps its first row's configuration. Key
+    columns are hashed into integer codes too, so every classification is a
+    vectorized comparison. With normalise, keys that differ only in
+    case/spacing/punctuation don't count as reclassified.
+
+    Returns (items, rollup). items has one row per item: Item #, Change, its
+    configuration (NEW, or OLD when removed), the previous configuration when
+    reclassified, and OLD/NEW qty and price. rollup has per-configuration change
+    counts (see rollup_item_changes()).
+    """
+    codes, items = pd.factorize(pd.concat([df_old['Item #'], df_new['Item #']], ignore_index=True))
+    sides = {}
+    for label, df, side_codes in [('OLD', df_old, codes[:len(df_old)]), ('NEW', df_new, codes[len(df_old):])]:
+        # First row of each item carries its configuration; qty and price are summed over repeats
+        first = np.flatnonzero(~pd.Series(side_codes).duplicated().to_numpy())
+        pos = np.full(len(items), -1)
+        pos[side_codes[first]] = first
+        qty = df['Available Quantity'].to_numpy(dtype=float)
+        price = df['List Price'].to_numpy(dtype=float)
+        priced = ~np.isnan(price)
+
+        def total(weights):
+            return np.bincount(side_codes, weights=weights, minlength=len(items))
+
+        qty_sum = np.where(total(~np.isnan(qty)) > 0, total(np.nan_to_num(qty)), np.nan)
+        wqty = total(np.where(priced, np.nan_to_num(qty), 0))
+        pcount = total(priced)
+        mean_price = np.divide(total(np.where(priced, price, 0)), pcount,
+                               out=np.full(len(items), np.nan), where=pcount > 0)
+        price_avg = np.divide(total(np.where(priced, price * np.nan_to_num(qty), 0)), wqty,
+                              out=mean_price, where=wqty > 0)
+        present = pos >= 0
+        sides[label] = {'pos': pos, 'present': present,
+                        'qty': np.where(present, qty_sum, np.nan), 'price': np.where(present, price_avg, np.nan)}
+
+    old_pos, new_pos = sides['OLD']['pos'], sides['NEW']['pos']
+    in_old, in_new = sides['OLD']['present'], sides['NEW']['present']
+    both = in_old & in_new
+    old_qty, new_qty = sides['OLD']['qty'], sides['NEW']['qty']
+    old_price, new_price = sides['OLD']['price'], sides['NEW']['price']
+
+    reclassified = np.zeros(len(items), dtype=bool)
+    current, previous = {}, {}
+    current_codes, previous_codes, spellings = [], [], []
+    for col in GROUPING_COLS:
+        # Key values of each item's first row, hashed once across both sides
+        old_subset, new_subset, spelling = item_key_codes(
+            df_old[col].to_numpy(dtype=object)[old_pos[in_old]],
+            df_new[col].to_numpy(dtype=object)[new_pos[in_new]], normalise)
+        old_codes = np.full(len(items), -1)
+        new_codes = np.full(len(items), -1)
+        old_codes[in_old] = old_subset
+        new_codes[in_new] = new_subset
+        reclassified |= both & (old_codes != new_codes)
+        current_codes.append(np.where(in_new, new_codes, old_codes))
+        previous_codes.append(old_codes)
+        spellings.append(spelling)
+        spelling = np.append(spelling, None)  # code -1 -> None
+        current[col] = spelling[current_codes[-1]]
+        previous[col] = spelling[old_codes]
+    current, previous = pd.DataFrame(current), pd.DataFrame(previous)
+
+    qty_changed = (old_qty != new_qty) & ~(np.isnan(old_qty) & np.isnan(new_qty))
+    price_changed = np.abs(np.nan_to_num(new_price - old_price)) >= ITEM_PRICE_TOLERANCE
+    price_changed |= np.isnan(old_price) != np.isnan(new_price)
+    change = np.select(
+        [~in_old, ~in_new, reclassified, qty_changed, price_changed],
+        range(len(ITEM_CHANGES) - 1), default=len(ITEM_CHANGES) - 1
+    )
+
+    df_items = pd.concat([pd.DataFrame({'Item #': items, 'Change': np.array(ITEM_CHANGES, dtype=object)[change]}),
+                          current], axis=1)
+
+    # Name each distinct previous configuration once
+    moved = np.flatnonzero(change == ITEM_CHANGES.index('reclassified'))
+    config, first = combine_key_codes([codes[moved] for codes in previous_codes], spellings)
+    names = np.array(format_item_names(previous.iloc[moved[first]]), dtype=object)
+    df_items['Previous Configuration'] = None
+    df_items.loc[moved, 'Previous Configuration'] = names[config]
+    df_items['OLD Qty'] = old_qty
+    df_items['NEW Qty'] = new_qty
+    df_items['Qty Change'] = np.where(both, new_qty - old_qty, np.nan)
+    df_items['OLD List Price'] = old_price
+    df_items['NEW List Price'] = new_price
+    df_items['List Price Change $'] = np.where(both, new_price - old_price, np.nan)
+    return df_items, rollup_item_changes(current_codes, previous_codes, spellings, change)
+
+
+def combine_key_codes(key_codes, spellings):
+    """One integer id per distinct combination of per-column key codes (first-appearance order).
+
+    Built column by column with factorize so the ids never overflow. Returns the
+    ids and, for each id, the position of its first row.
+    """
+    combined = np.zeros(len(key_codes[0]), dtype=np.int64)
+    for codes, spelling in zip(key_codes, spellings):
+        combined, _ = pd.factorize(combined * (len(spelling) + 1) + (codes + 1))
+    first = np.empty(len(combined), dtype=bool)
+    if len(combined):
+        first[0] = True
+        first[1:] = combined[1:] > np.maximum.accumulate(combined)[:-1]
+    return combined, np.flatnonzero(first)
+
+
+def rollup_item_changes(current, previous, spellings, change):
+    """Count item changes per configuration from per-column key codes.
+
+    change holds indexes into ITEM_CHANGES. Items count toward their current
+    configuration; a reclassified item also counts as 'reclassified out' of its
+    previous configuration. Items with a missing key value are left out, as in
+    configuration grouping.
+    """
+    # ITEM_CHANGES index -> ITEM_ROLLUP_CHANGES index (reclassified counts as 'in' here)
+    to_rollup = np.array([ITEM_ROLLUP_CHANGES.index('reclassified in' if name == 'reclassified' else name)
+                          for name in ITEM_CHANGES])
+    moved = change == ITEM_CHANGES.index('reclassified')
+    event_change = np.concatenate([to_rollup[change],
+                                   np.full(moved.sum(), ITEM_ROLLUP_CHANGES.index('reclassified out'))])
+    keys = [np.concatenate([cur, prev[moved]]) for cur, prev in zip(current, previous)]
+    valid = np.all([codes >= 0 for codes in keys], axis=0)
+    keys = [codes[valid] for codes in keys]
+
+    config, first = combine_key_codes(keys, spellings)
+    n_changes = len(ITEM_ROLLUP_CHANGES)
+    counts = np.bincount(config * n_changes + event_change[valid],
+                         minlength=len(first) * n_changes).reshape(-1, n_changes)
+    rollup = pd.DataFrame({col: spelling[codes[first]] for col, codes, spelling in zip(GROUPING_COLS, keys, spellings)})
+    for i, name in enumerate(ITEM_ROLLUP_CHANGES):
+        rollup[f'Items {name.title()}'] = counts[:, i]
+    return rollup.sort_values(GROUPING_COLS, ignore_index=True)
+
+
+def format_item_names(df):
+    """Vectorized format_item_name(): 'Model Capacity Color (Lock Status) (DLS Grade)'."""
+    parts = []
+    for col, prefix, suffix in ITEM_NAME_PARTS:
+        values = df[col].astype(str)
+        parts.append((prefix + values + suffix).where(df[col].notna() & (values != ''), '').tolist())
+    return [' '.join(filter(None, row)) or 'Unknown Item' for row in zip(*parts)]
+
+
+class ReportTemplate:
+    """A str.format template compiled once into a printf-style format and mapped over whole columns.
+
+    Specs printf can't express (thousands separators) are formatted once per unique value
+    and substituted as strings.
+    """
+
+    def __init__(self, template):
+        self.fields = []  # (field, spec) per placeholder, in order; spec None = pre-formatted string
+        parts = []
+        for literal, field, spec, _ in string.Formatter().parse(template):
+            parts.append(literal.replace('%', '%%'))
+            if field is None:
+                continue
+            if field == 'name' or ',' in spec:
+                parts.append('%s')
+                self.fields.append((field, spec))
+            else:
+                parts.append('%' + spec)
+                self.fields.append((field, None))
+        self.compiled = ''.join(parts)
+
+    def render(self, df):
+        """Render one string per row of df (fields are 'name' or keys of REPORT_FIELDS)."""
+        columns = []
+        for field, spec in self.fields:
+            if field == 'name':
+                columns.append(format_item_names(df))
+                continue
+            values = df[REPORT_FIELDS[field]]
+            if spec is None:
+                columns.append(values.tolist())
+            else:
+                codes, uniques = pd.factorize(values, use_na_sentinel=False)
+                formatted = np.array([format(value, spec) for value in uniques.tolist()], dtype=object)
+                columns.append(formatted[codes].tolist())
+        compiled = self.compiled
+        return [compiled % row for row in zip(*columns)]
+
+
+class ReportWriter:
+    """Writes report lines ('\\n'-separated) to a text stream in chunks."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.started = False
+
+    def lines(self, lines):
+        for line in lines:
+            if self.started:
+                self.stream.write('\n')
+            self.stream.write(line)
+            self.started = True
+
+    def block(self, template, df):
+        """Render df through a ReportTemplate and stream it out REPORT_CHUNK_ROWS rows at a time."""
+        for start in range(0, len(df), REPORT_CHUNK_ROWS):
+            self.lines(['\n'.join(template.render(df.iloc[start:start + REPORT_CHUNK_ROWS]))])
+
+
+REPORT_PRICE_TEMPLATE = ReportTemplate('\n'.join([
+    "\n{name}",
+    REPORT_PRICE_LINE.format(label='Price'),
+    REPORT_QTY_LINE.format(label='QTY', units=''),
+]))
+REPORT_QTY_TEMPLATE = ReportTemplate('\n'.join([
+    "\n{name}",
+    REPORT_QTY_LINE.format(label='QTY', units=' units'),
+    REPORT_PRICE_LINE.format(label='PRICE'),
+]))
+REPORT_DETAIL_TEMPLATE = ReportTemplate('\n'.join([
+    "\n{name}",
+    REPORT_QTY_LINE.format(label='Quantity', units=''),
+    REPORT_PRICE_LINE.format(label='Price'),
+]))
+
+REPORT_ANOMALY_TEMPLATE = ReportTemplate('\n'.join([
+    "\n{name}",
+    "  Anomaly score: {anomaly_score:.1f} (qty z {qty_score:+.1f}, price z {price_score:+.1f})",
+    REPORT_QTY_LINE.format(label='Quantity', units=''),
+    REPORT_PRICE_LINE.format(label='Price'),
+]))
+
+# (top_insights key, section title, item template, wording when the list is empty)
+REPORT_TOP_SECTIONS = [
+    ('price_increases', 'PRICE INCREASES', REPORT_PRICE_TEMPLATE, 'price increases'),
+    ('price_decreases', 'PRICE DECREASES', REPORT_PRICE_TEMPLATE, 'price decreases'),
+    ('qty_increases', 'QUANTITY INCREASES', REPORT_QTY_TEMPLATE, 'quantity increases'),
+    ('qty_decreases', 'QUANTITY DECREASES', REPORT_QTY_TEMPLATE, 'quantity decreases'),
+]
+
+
+class DashboardTemplate(string.Template):
+    """string.Template with @@name placeholders, which never clash with JavaScript `${...}`."""
+    delimiter = '@@'
+
+
+@lru_cache(maxsize=1)
+def load_dashboard_template():
+    """Read and compile the executive dashboard template once per process."""
+    return DashboardTemplate(DASHBOARD_TEMPLATE_PATH.read_text(encoding='utf-8'))
+
+
+def pack_array(values, dtype):
+    """Pack a numeric array as base64 little-endian bytes for a JavaScript typed array."""
+    data = np.ascontiguousarray(values, dtype=dtype).tobytes()
+    return {'type': np.dtype(dtype).kind + str(np.dtype(dtype).itemsize),
+            'data': base64.b64encode(data).decode('ascii')}
+
+
+def package_member(path):
+    """ZipInfo for one package member: stored if already compressed, deflated otherwise."""
+    info = zipfile.ZipInfo.from_file(path, os.path.basename(path))
+    if Path(path).suffix.lower() in PACKAGE_STORED_SUFFIXES:
+        info.compress_type = zipfile.ZIP_STORED
+    else:
+        info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only, unseekable sink that hands zip bytes back to stream_package()."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_package(paths, chunk_size=PACKAGE_CHUNK_SIZE):
+    """Yield a zip of `paths` chunk by chunk, without writing the archive anywhere.
+
+    Each member is read and compressed incrementally, so memory use stays around
+    chunk_size regardless of the size of the files.
+    """
+    sink = _ZipStream()
+    with zipfile.ZipFile(sink, 'w') as zipf:
+        for path in paths:
+            info = package_member(path)
+            with open(path, 'rb') as src, \
+                    zipf.open(info, 'w', force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as dest:
+                for block in iter(lambda: src.read(chunk_size), b''):
+                    dest.write(block)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+def write_package(zip_path, paths):
+    """Write a zip package of `paths` to disk (see package_member() for compression)."""
+    with zipfile.ZipFile(zip_path, 'w') as zipf:
+        for path in paths:
+            info = package_member(path)
+            with open(path, 'rb') as src, \
+                    zipf.open(info, 'w', force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as dest:
+                for block in iter(lambda: src.read(PACKAGE_CHUNK_SIZE), b''):
+                    dest.write(block)
+    return zip_path
+
+
+class ComparisonIndex:
+    """Pre-sorted views of the matching configurations.
+
+    Sorting happens once when the index is built; threshold and Top-N queries
+    afterwards are a binary search plus array slicing, so they can be re-run
+    with different parameters without repeating the comparison.
+    """
+
+    SORTED_METRICS = ['Qty Change %', 'List Price Change %', 'From Offer to List Price Change %']
+
+    def __init__(self, df_comparison):
+        self.matching = df_comparison[df_comparison['Status'] == 'Matching']
+
+        # Absolute qty change, sorted descending (stable keeps original order among ties)
+        self.abs_qty = self.matching['Qty Change'].abs().to_numpy(dtype=float)
+        self._abs_qty_order = np.argsort(-self.abs_qty, kind='stable')
+        self._abs_qty_sorted = self.abs_qty[self._abs_qty_order]
+
+        self._orders = {}
+        for metric in self.SORTED_METRICS:
+            self._sort_order(metric, descending=True)
+            self._sort_order(metric, descending=False)
+
+    def _sort_order(self, column, descending):
+        """Stable sort order of a column (NaN last), computed once per column/direction."""
+        key = (column, descending)
+        if key not in self._orders:
+            values = self.matching[column].to_numpy(dtype=float)
+            self._orders[key] = np.argsort(-values if descending else values, kind='stable')
+        return self._orders[key]
+
+    def count_significant(self, threshold):
+        """Number of matching configurations with abs(Qty Change) >= threshold."""
+        # _abs_qty_sorted is descending, so search the negated (ascending) values
+        return int(np.searchsorted(-self._abs_qty_sorted, -threshold, side='right'))
+
+    def significant(self, threshold):
+        """Matching configurations with abs(Qty Change) >= threshold, in original row order."""
+        positions = np.sort(self._abs_qty_order[:self.count_significant(threshold)])
+        return self.matching.iloc[positions].copy()
+
+    def top(self, name, n, threshold):
+        """Top-N rows of one insight list among configurations meeting the threshold."""
+        rank_col, sign_col, increases = TOP_INSIGHT_QUERIES[name]
+        order = self._sort_order(rank_col, descending=increases)
+
+        rank = self.matching[rank_col].to_numpy(dtype=float)[order]
+        sign = self.matching[sign_col].to_numpy(dtype=float)[order]
+        eligible = (self.abs_qty[order] >= threshold) & ~np.isnan(rank)
+        eligible &= (sign > 0) if increases else (sign < 0)
+
+        return self.matching.iloc[order[eligible][:n]]
+
+    def top_insights(self, n, threshold):
+        """All Top-N insight lists for a threshold."""
+        return {name: self.top(name, n, threshold) for name in TOP_INSIGHT_QUERIES}
+
+
+def robust_z_scores(values, codes):
+    """Modified z-score of each value within its group: (x - median) / (1.4826 * MAD).
+
+    `values` is a 2-D float array (one column per metric) and `codes` the group of each
+    row. Medians and MADs come from two grouped reductions over all rows and columns at
+    once. Where a group's MAD is zero the mean absolute deviation (scaled by 1.2533) is used
+    instead; where that is zero too the score is 0. NaN values score NaN and are ignored
+    by their group's statistics.
+    """
+    frame = pd.DataFrame(values)
+    median = frame.groupby(codes).median().to_numpy()[codes]
+    deviation = np.abs(values - median)
+    spread = pd.DataFrame(deviation).groupby(codes).agg(['median', 'mean']).to_numpy()
+    mad, mean_ad = spread[:, 0::2][codes], spread[:, 1::2][codes]
+
+    scale = np.where(mad > 0, 1.4826 * mad, 1.2533 * mean_ad)
+    z = np.divide(values - median, scale, out=np.zeros_like(values), where=scale > 0)
+    z[np.isnan(values)] = np.nan
+    return z
+
+
+def score_anomalies(df_comparison, family_col=ANOMALY_FAMILY_COL):
+    """Anomaly scores of the matching configurations (NaN for new and removed ones).
+
+    Qty Score is the robust z-score of log(1 + NEW Qty) - log(1 + OLD Qty), Price Score that
+    of log(NEW List Price / OLD List Price), both within the configuration's family, so a
+    move is judged against how the rest of that Model moved and a 1 -> 3 unit change is
+    not a +200% outlier. Volume Weight is 2v / (v + family median v) with v = OLD + NEW Qty:
+    1 for a typical configuration, towards 0 for tiny ones and up to 2 for the largest.
+    Anomaly Score = the larger absolute z-score times the volume weight.
+
+    Returns a frame of ANOMALY_COLS on df_comparison's index.
+    """
+    scores = pd.DataFrame(np.nan, index=df_comparison.index, columns=ANOMALY_COLS)
+    matching = (df_comparison['Status'] == 'Matching').to_numpy()
+    df = df_comparison[matching]
+    if not len(df):
+        return scores
+
+    old_qty = df['OLD Qty'].to_numpy(dtype=float).clip(min=0)
+    new_qty = df['NEW Qty'].to_numpy(dtype=float).clip(min=0)
+    old_price = df['OLD List Price'].to_numpy(dtype=float)
+    new_price = df['NEW List Price'].to_numpy(dtype=float)
+    priced = (old_price > 0) & (new_price > 0)
+    price_move = np.full(len(df), np.nan)
+    price_move[priced] = np.log(new_price[priced] / old_price[priced])
+    volume = old_qty + new_qty
+
+    codes, _ = pd.factorize(df[family_col].astype(str))
+    z = robust_z_scores(np.column_stack([np.log1p(new_qty) - np.log1p(old_qty), price_move]), codes)
+    typical_volume = pd.Series(volume).groupby(codes).median().to_numpy()[codes]
+    weight = np.divide(2 * volume, volume + typical_volume, out=np.zeros(len(df)),
+                       where=volume + typical_volume > 0)
+
+    scores.loc[matching, 'Qty Score'] = z[:, 0]
+    scores.loc[matching, 'Price Score'] = z[:, 1]
+    scores.loc[matching, 'Volume Weight'] = weight
+    scores.loc[matching, 'Anomaly Score'] = np.fmax(np.abs(z[:, 0]), np.abs(z[:, 1])) * weight
+    return scores
+
+
+def flag_anomalies(df_comparison, threshold=ANOMALY_THRESHOLD):
+    """Configurations whose Anomaly Score is at least `threshold`, highest first."""
+    flagged = df_comparison[df_comparison['Anomaly Score'] >= threshold]
+    return flagged.sort_values('Anomaly Score', ascending=False, kind='stable')
+
+
+class RollupCube:
+    """Totals for every prefix of ROLLUP_LEVELS (all, Model, Model/Capacity, Model/Capacity/Grade).
+
+    The configurations are reduced once to the finest level; each coarser level is then
+    summed from the level below it, so the cube costs one grouped pass over the comparison
+    plus passes over ever smaller frames. Prices are carried as sum(price * qty) and the qty
+    that has a price, so every node gets a true qty-weighted average. Afterwards a node and
+    its children are dict lookups.
+
+    Node measures: Configs, Matching, New, Removed, OLD/NEW Item Count, OLD/NEW Qty,
+    Qty Change (net change of the matching configurations) and the ROLLUP_PRICES columns
+    (None when nothing under the node has a price). Key values are strings, '' for blanks.
+    """
+
+    COUNT_COLS = ['OLD Item Count', 'NEW Item Count', 'OLD Qty', 'NEW Qty', 'Qty Change']
+
+    def __init__(self, df_comparison, levels=ROLLUP_LEVELS):
+        self.levels = list(levels)
+        df = df_comparison
+        sums = {'Configs': np.ones(len(df), dtype=np.int64)}
+        for status in ['Matching', 'New', 'Removed']:
+            sums[status] = (df['Status'] == status).to_numpy(dtype=np.int64)
+        for col in self.COUNT_COLS:
+            sums[col] = df[col]
+        for price_col, qty_col in ROLLUP_PRICES.items():
+            price, qty = df[price_col], df[qty_col]
+            sums[f'{price_col} wsum'] = price * qty
+            sums[f'{price_col} wqty'] = qty.where(price.notna())
+
+        keys = [df[col].fillna('').astype(str).rename(col) for col in self.levels]
+        frame = pd.DataFrame(sums, index=df.index).groupby(keys).sum()
+
+        self.nodes = {}
+        self.children = {}
+        for depth in range(len(self.levels), -1, -1):
+            if depth < len(self.levels):
+                frame = (frame.groupby(level=list(range(depth))).sum() if depth
+                         else frame.sum().to_frame().T)
+            paths = ([()] if depth == 0 else
+                     [(key,) if depth == 1 else key for key in frame.index])
+            for path, measures in zip(paths, self._measures(frame)):
+                self.nodes[path] = measures
+                if path:
+                    self.children.setdefault(path[:-1], []).append(path[-1])
+
+    @staticmethod
+    def _measures(frame):
+        """JSON-ready measure dicts, one per row of a summed frame."""
+        out = frame[['Configs', 'Matching', 'New', 'Removed', 'OLD Item Count', 'NEW Item Count']].astype(int)
+        for col in ['OLD Qty', 'NEW Qty', 'Qty Change']:
+            out[col] = frame[col].astype(float)
+        for price_col in ROLLUP_PRICES:
+            wsum = frame[f'{price_col} wsum'].to_numpy(dtype=float)
+            wqty = frame[f'{price_col} wqty'].to_numpy(dtype=float)
+            out[price_col] = np.divide(wsum, wqty, out=np.full(len(frame), np.nan), where=wqty > 0).round(2)
+        records = out.to_dict('records')
+        for record in records:
+            for col in ROLLUP_PRICES:
+                if pd.isna(record[col]):
+                    record[col] = None
+        return records
+
+    def drill(self, path=()):
+        """A node's totals and those of its children, one level down. Raises KeyError for unknown paths."""
+        path = tuple(path)
+        totals = self.nodes[path]
+        level = self.levels[len(path)] if len(path) < len(self.levels) else None
+        return {
+            'path': list(path),
+            'level': level,
+            'totals': totals,
+            'children': [{'name': name, **self.nodes[path + (name,)]}
+                         for name in self.children.get(path, [])],
+        }
 
 
 class StockComparator:
     """Compares two stock list Excel files and generates analysis."""
 
-    def __init__(self, old_file, new_file, output_file=None):
+    def __init__(self, old_file, new_file, output_file=None,
+                 qty_threshold=SIGNIFICANT_QTY_CHANGE, top_n=TOP_N,
+                 history_db=None, snapshot_date=None, detail_rows=REPORT_DETAIL_ROWS,
+                 package=True, dedupe='keep-all', match_mode='exact', item_diff=False,
+                 progress_callback=None, reader_engine='auto', preloaded=None, outputs=None,
+                 verbose=True, auto_open=True):
         self.old_file = old_file
         self.new_file = new_file
+        self.qty_threshold = qty_threshold
+        self.top_n = top_n
+        self.history_db = history_db  # Record results in this history store (None = don't)
+        self.snapshot_date = snapshot_date
+        self.detail_rows = detail_rows  # Rows in the report's detail section (None = all)
+        self.package = package  # Write _Package.zip (the web app streams it on demand instead)
+        # Artifacts export_results writes, a subset of OUTPUT_TYPES (None = all, less zip without package)
+        if outputs is None:
+            outputs = OUTPUT_TYPES if package else [o for o in OUTPUT_TYPES if o != 'zip']
+        self.outputs = [o for o in OUTPUT_TYPES if o in outputs]
+        self.dedupe = dedupe  # Duplicate Item # strategy, one of DEDUPE_STRATEGIES
+        self.duplicates = {}  # 'OLD'/'NEW' -> duplicates report from dedupe_items()
+        self.dedupe_timings = {}  # 'OLD'/'NEW' -> seconds spent in dedupe_items()
+        self.match_mode = match_mode  # Configuration key matching, one of MATCH_MODES
+        self.match_stats = {}
+        self.fuzzy_matches = None  # OLD -> NEW spelling pairs accepted by fuzzy matching
+        self.item_diff = item_diff  # Also diff individual Item # rows (see compare_items())
+        self.timings = {}  # Pipeline stage -> seconds, filled in by run()
+        self.rows_loaded = {}  # 'old'/'new' -> rows read from each file
+        self.progress_callback = progress_callback  # Called with a dict per progress event (see report_progress())
+        self.reader_engine = reader_engine  # Excel reader, one of READER_ENGINES
+        # 'old'/'new' -> callable returning that file's already-parsed frame (or None to read it here),
+        # e.g. a background parse started while the other file was still uploading
+        self.preloaded = preloaded or {}
+        self.verbose = verbose  # Print progress to stdout (see log())
+        self.auto_open = auto_open  # Open the workbook and dashboard when written (macOS)
+        self.run_started = time.perf_counter()
+        self.df_items = None
+        self.df_item_rollup = None
         self.output_file = output_file or f"Stock_Comparison_Report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
 
         # Determine file format from output_file extension
@@ -32,6 +937,8 @@ class StockComparator:
         else:
             self.text_file = self.output_file
             self.excel_file = self.output_file.replace('.txt', '.xlsx')
+        self.html_file = self.text_file.replace('.txt', '_Dashboard.html')
+        self.zip_file = self.text_file.replace('.txt', '_Package.zip')
 
         self.df_old = None
         self.df_new = None
@@ -39,6 +946,9 @@ class StockComparator:
         self.df_new_grouped = None
         self.df_comparison = None
         self.df_filtered = None
+        self.index = None
+        self.cube = None
+        self.df_anomalies = None  # Matching configurations flagged by score_anomalies(), highest first
 
     def format_item_name(self, row):
         """Create item name from grouping columns."""
@@ -55,55 +965,48 @@ class StockComparator:
             parts.append(f"(DLS {row['Grade']})")
         return ' '.join(parts) if parts else "Unknown Item"
 
+    def log(self, message=''):
+        """Print a progress message, unless the comparator was created with verbose=False."""
+        if self.verbose:
+            print(message)
+
+    def read_stock_file(self, label, path, engine):
+        """The preloaded frame for 'old'/'new' if there is one, else the file read now.
+
+        `path` may also be an already-loaded DataFrame (used as is, copied) or workbook bytes.
+        """
+        if isinstance(path, pd.DataFrame):
+            return path.copy()
+        loader = self.preloaded.get(label)
+        df = loader() if loader is not None else None
+        return df if df is not None else load_stock_file(path, engine)
+
     def load_data(self):
         """Load and prepare data from both files."""
-        print("Loading data...")
+        engine = resolve_reader_engine(self.reader_engine)
+        self.log(f"Loading data ({engine} reader)...")
 
         # Load OLD file (detect header row)
         try:
-            # Try to find the header row in OLD file
-            df_temp = pd.read_excel(self.old_file, header=None, nrows=20)
-            header_row = None
-            for i in range(len(df_temp)):
-                if str(df_temp.iloc[i, 0]).strip() == 'Item #':
-                    header_row = i
-                    break
-
-            if header_row is None:
-                # No header metadata, try default
-                self.df_old = pd.read_excel(self.old_file)
-            else:
-                self.df_old = pd.read_excel(self.old_file, header=header_row)
-
-            print(f"✓ Loaded OLD file: {len(self.df_old)} rows")
+            self.df_old = self.read_stock_file('old', self.old_file, engine)
+            self.log(f"✓ Loaded OLD file: {len(self.df_old)} rows")
         except Exception as e:
-            print(f"✗ Error loading OLD file: {e}")
+            self.log(f"✗ Error loading OLD file: {e}")
             raise
 
         # Load NEW file (detect header row)
         try:
-            # Try to find the header row
-            df_temp = pd.read_excel(self.new_file, header=None, nrows=20)
-            header_row = None
-            for i in range(len(df_temp)):
-                if str(df_temp.iloc[i, 0]).strip() == 'Item #':
-                    header_row = i
-                    break
-
-            if header_row is None:
-                # No header metadata, try default
-                self.df_new = pd.read_excel(self.new_file)
-            else:
-                self.df_new = pd.read_excel(self.new_file, header=header_row)
-
-            print(f"✓ Loaded NEW file: {len(self.df_new)} rows")
+            self.df_new = self.read_stock_file('new', self.new_file, engine)
+            self.log(f"✓ Loaded NEW file: {len(self.df_new)} rows")
         except Exception as e:
-            print(f"✗ Error loading NEW file: {e}")
+            self.log(f"✗ Error loading NEW file: {e}")
             raise
 
+        self.rows_loaded = {'old': len(self.df_old), 'new': len(self.df_new)}
+
     def clean_data(self):
         """Clean and prepare data for comparison."""
-        print("\nCleaning data...")
+        self.log("\nCleaning data...")
 
         # Validate required columns
         required_cols = ['Item #', 'Model', 'Capacity', 'Color', 'Lock Status', 'Grade',
@@ -115,17 +1018,6 @@ class StockComparator:
             if col not in self.df_new.columns:
                 raise ValueError(f"Required column '{col}' not found in NEW file")
 
-        # Track duplicates but DON'T remove them yet
-        # (Colleague's approach: keep all rows for configuration grouping)
-        old_dupes = self.df_old.duplicated(subset=['Item #'], keep='first').sum()
-        new_dupes = self.df_new.duplicated(subset=['Item #'], keep='first').sum()
-
-        old_unique = self.df_old['Item #'].nunique()
-        new_unique = self.df_new['Item #'].nunique()
-
-        print(f"  OLD file: {len(self.df_old)} rows, {old_unique} unique items, {old_dupes} duplicates")
-        print(f"  NEW file: {len(self.df_new)} rows, {new_unique} unique items, {new_dupes} duplicates")
-
         # Convert Item # to string
         self.df_old['Item #'] = self.df_old['Item #'].astype(str)
         self.df_new['Item #'] = self.df_new['Item #'].astype(str)
@@ -138,76 +1030,63 @@ class StockComparator:
             if col in self.df_new.columns:
                 self.df_new[col] = pd.to_numeric(self.df_new[col], errors='coerce')
 
-        print(f"✓ Data cleaned and ready for grouping")
+        # Duplicate Item # rows are counted and resolved in one hashed pass per file.
+        # The default keeps them all (colleague's approach: every row counts toward its configuration).
+        for label, attr in [('OLD', 'df_old'), ('NEW', 'df_new')]:
+            df = getattr(self, attr)
+            start = time.perf_counter()
+            deduped, report = dedupe_items(df, self.dedupe, label=f"{label} file")
+            self.dedupe_timings[label] = time.perf_counter() - start
+            self.duplicates[label] = report
 
-    def group_by_configuration(self):
-        """Group items by configuration (Model + Capacity + Color + Lock Status + Grade)."""
-        print("\nGrouping by configuration...")
+            dupes = int(report['Occurrences'].sum() - len(report))
+            self.log(f"  {label} file: {len(df)} rows, {len(df) - dupes} unique items, {dupes} duplicates")
+            if self.dedupe != 'keep-all':
+                self.log(f"    dedupe '{self.dedupe}': {len(df) - len(deduped):,} rows removed "
+                      f"in {self.dedupe_timings[label]:.3f}s")
+            setattr(self, attr, deduped)
 
-        grouping_cols = ['Model', 'Capacity', 'Color', 'Lock Status', 'Grade']
+        self.log(f"✓ Data cleaned and ready for grouping")
 
-        # Calculate weighted averages for OLD file
-        # Weighted average = sum(price * qty) / sum(qty)
-        self.df_old['Weighted_List_Price'] = self.df_old['List Price'] * self.df_old['Available Quantity']
-        self.df_old['Weighted_Offer_Price'] = self.df_old['New Offer Price'] * self.df_old['Available Quantity']
-
-        self.df_old_grouped = self.df_old.groupby(grouping_cols).agg({
-            'Item #': 'count',
-            'Available Quantity': 'sum',
-            'Weighted_List_Price': 'sum',
-            'Weighted_Offer_Price': 'sum'
-        }).reset_index()
-
-        # Calculate weighted averages
-        self.df_old_grouped['OLD List Price'] = (
-            self.df_old_grouped['Weighted_List_Price'] / self.df_old_grouped['Available Quantity']
-        )
-        self.df_old_grouped['OLD Offer Price'] = (
-            self.df_old_grouped['Weighted_Offer_Price'] / self.df_old_grouped['Available Quantity']
-        )
-
-        # Rename and select final columns
-        self.df_old_grouped = self.df_old_grouped.rename(columns={
-            'Item #': 'OLD Item Count',
-            'Available Quantity': 'OLD Qty'
+    def group_by_configuration(self):
+        """Group items by configuration (Model + Capacity + Color + Lock Status + Grade)."""
+        self.log("\nGrouping by configuration...")
+
+        # Weighted averages = sum(price * qty) / sum(qty), computed in one grouped reduction
+        self.df_old_grouped = aggregate_configurations(self.df_old, ['List Price', 'New Offer Price']).rename(columns={
+            'Item Count': 'OLD Item Count',
+            'Qty': 'OLD Qty',
+            'List Price': 'OLD List Price',
+            'New Offer Price': 'OLD Offer Price'
         })
-        self.df_old_grouped = self.df_old_grouped[['Model', 'Capacity', 'Color', 'Lock Status', 'Grade',
-                                                     'OLD Item Count', 'OLD Qty', 'OLD List Price', 'OLD Offer Price']]
-
-        # Calculate weighted averages for NEW file
-        self.df_new['Weighted_List_Price'] = self.df_new['List Price'] * self.df_new['Available Quantity']
 
-        self.df_new_grouped = self.df_new.groupby(grouping_cols).agg({
-            'Item #': 'count',
-            'Available Quantity': 'sum',
-            'Weighted_List_Price': 'sum'
-        }).reset_index()
-
-        # Calculate weighted average
-        self.df_new_grouped['NEW List Price'] = (
-            self.df_new_grouped['Weighted_List_Price'] / self.df_new_grouped['Available Quantity']
-        )
-
-        # Rename and select final columns
-        self.df_new_grouped = self.df_new_grouped.rename(columns={
-            'Item #': 'NEW Item Count',
-            'Available Quantity': 'NEW Qty'
+        self.df_new_grouped = aggregate_configurations(self.df_new, ['List Price']).rename(columns={
+            'Item Count': 'NEW Item Count',
+            'Qty': 'NEW Qty',
+            'List Price': 'NEW List Price'
         })
-        self.df_new_grouped = self.df_new_grouped[['Model', 'Capacity', 'Color', 'Lock Status', 'Grade',
-                                                     'NEW Item Count', 'NEW Qty', 'NEW List Price']]
 
-        print(f"✓ OLD configurations: {len(self.df_old_grouped)}")
-        print(f"✓ NEW configurations: {len(self.df_new_grouped)}")
+        self.log(f"✓ OLD configurations: {len(self.df_old_grouped)}")
+        self.log(f"✓ NEW configurations: {len(self.df_new_grouped)}")
 
     def compare_configurations(self):
         """Compare OLD and NEW configurations."""
-        print("\nComparing configurations...")
+        self.log("\nComparing configurations...")
+
+        # Reconcile formatting drift in the configuration keys before joining
+        self.df_old_grouped, self.df_new_grouped, self.match_stats, self.fuzzy_matches = match_configurations(
+            self.df_old_grouped, self.df_new_grouped, GROUPING_COLS, self.match_mode
+        )
+        if self.match_stats['respelled']:
+            self.log(f"  Normalised key spelling of {self.match_stats['respelled']} configurations")
+        if self.match_stats['fuzzy_matches']:
+            self.log(f"  Fuzzy-matched {self.match_stats['fuzzy_matches']} configurations")
 
         # Merge on configuration keys
         self.df_comparison = pd.merge(
             self.df_old_grouped,
             self.df_new_grouped,
-            on=['Model', 'Capacity', 'Color', 'Lock Status', 'Grade'],
+            on=GROUPING_COLS,
             how='outer',
             indicator=True
         )
@@ -247,341 +1126,125 @@ class StockComparator:
             (self.df_comparison['From Offer to List Price Change $'] / self.df_comparison['OLD Offer Price']) * 100
         )
 
+        # Robust per-family scores, so real outliers stand out from small-base percentages
+        self.df_comparison[ANOMALY_COLS] = score_anomalies(self.df_comparison)
+
         # Reorder columns
         col_order = ['Model', 'Capacity', 'Color', 'Lock Status', 'Grade', 'Status',
                     'OLD Item Count', 'OLD Qty', 'OLD List Price', 'OLD Offer Price',
                     'NEW Item Count', 'NEW Qty', 'NEW List Price',
                     'Qty Change', 'Qty Change %',
                     'List Price Change $', 'List Price Change %',
-                    'From Offer to List Price Change $', 'From Offer to List Price Change %']
+                    'From Offer to List Price Change $', 'From Offer to List Price Change %'] + ANOMALY_COLS
         self.df_comparison = self.df_comparison[col_order]
 
         matching = (self.df_comparison['Status'] == 'Matching').sum()
         removed = (self.df_comparison['Status'] == 'Removed').sum()
         new = (self.df_comparison['Status'] == 'New').sum()
 
-        print(f"✓ Matching configurations: {matching}")
-        print(f"✓ Removed configurations: {removed}")
-        print(f"✓ New configurations: {new}")
-
-        # Filter for absolute qty change >= 100 (matching items only)
-        matching_df = self.df_comparison[self.df_comparison['Status'] == 'Matching'].copy()
-        self.df_filtered = matching_df[abs(matching_df['Qty Change']) >= 100].copy()
-        print(f"✓ Items with qty change >= 100: {len(self.df_filtered)}")
-
-    def _generate_top_insights(self):
-        """Generate Top 10 insights for each category (filtered items only)."""
-        insights = {}
-
-        # Top 10 Price Increases (from filtered data)
-        price_increases = self.df_filtered[self.df_filtered['List Price Change %'] > 0].nlargest(10, 'List Price Change %')
-        insights['price_increases'] = price_increases
-
-        # Top 10 Price Decreases (from filtered data)
-        price_decreases = self.df_filtered[self.df_filtered['List Price Change %'] < 0].nsmallest(10, 'List Price Change %')
-        insights['price_decreases'] = price_decreases
-
-        # Top 10 Quantity Increases (from filtered data, by percentage)
-        qty_increases = self.df_filtered[self.df_filtered['Qty Change'] > 0].nlargest(10, 'Qty Change %')
-        insights['qty_increases'] = qty_increases
-
-        # Top 10 Quantity Decreases (from filtered data, by percentage)
-        qty_decreases = self.df_filtered[self.df_filtered['Qty Change'] < 0].nsmallest(10, 'Qty Change %')
-        insights['qty_decreases'] = qty_decreases
-
-        return insights
-
-    def _generate_executive_dashboard(self, top_insights):
-        """Generate executive HTML dashboard."""
-        html_file = self.text_file.replace('.txt', '_Dashboard.html')
-
-        # Prepare data for JavaScript
-        price_increases = []
-        price_decreases = []
-        qty_increases = []
-        qty_decreases = []
-
-        for idx, row in top_insights['price_increases'].iterrows():
-            price_increases.append({
-                'model': f"{row['Model']} {row['Capacity']} {row['Color']} ({row['Lock Status']})",
-                'grade': f"DLS {row['Grade']}" if pd.notna(row['Grade']) else "N/A",
-                'oldPrice': float(row['OLD List Price']),
-                'newPrice': float(row['NEW List Price']),
-                'priceChange': float(row['List Price Change %']),
-                'oldQty': int(row['OLD Qty']),
-                'newQty': int(row['NEW Qty']),
-                'qtyChange': float(row['Qty Change %'])
-            })
-
-        for idx, row in top_insights['price_decreases'].iterrows():
-            price_decreases.append({
-                'model': f"{row['Model']} {row['Capacity']} {row['Color']} ({row['Lock Status']})",
-                'grade': f"DLS {row['Grade']}" if pd.notna(row['Grade']) else "N/A",
-                'oldPrice': float(row['OLD List Price']),
-                'newPrice': float(row['NEW List Price']),
-                'priceChange': float(row['List Price Change %']),
-                'oldQty': int(row['OLD Qty']),
-                'newQty': int(row['NEW Qty']),
-                'qtyChange': float(row['Qty Change %'])
-            })
-
-        for idx, row in top_insights['qty_increases'].iterrows():
-            qty_increases.append({
-                'model': f"{row['Model']} {row['Capacity']} {row['Color']} ({row['Lock Status']})",
-                'grade': f"DLS {row['Grade']}" if pd.notna(row['Grade']) else "N/A",
-                'oldQty': int(row['OLD Qty']),
-                'newQty': int(row['NEW Qty']),
-                'qtyChange': float(row['Qty Change %']),
-                'oldPrice': float(row['OLD List Price']),
-                'newPrice': float(row['NEW List Price']),
-                'priceChange': float(row['List Price Change %'])
-            })
-
-        for idx, row in top_insights['qty_decreases'].iterrows():
-            qty_decreases.append({
-                'model': f"{row['Model']} {row['Capacity']} {row['Color']} ({row['Lock Status']})",
-                'grade': f"DLS {row['Grade']}" if pd.notna(row['Grade']) else "N/A",
-                'oldQty': int(row['OLD Qty']),
-                'newQty': int(row['NEW Qty']),
-                'qtyChange': float(row['Qty Change %']),
-                'oldPrice': float(row['OLD List Price']),
-                'newPrice': float(row['NEW List Price']),
-                'priceChange': float(row['List Price Change %'])
-            })
+        self.log(f"✓ Matching configurations: {matching}")
+        self.log(f"✓ Removed configurations: {removed}")
+        self.log(f"✓ New configurations: {new}")
+
+        # Filter for absolute qty change >= threshold (matching items only)
+        self.index = ComparisonIndex(self.df_comparison)
+        self.df_filtered = self.index.significant(self.qty_threshold)
+        self.log(f"✓ Items with qty change >= {self.qty_threshold:g}: {len(self.df_filtered)}")
+        self.df_anomalies = flag_anomalies(self.df_comparison)
+        self.log(f"✓ Anomalies (score >= {ANOMALY_THRESHOLD:g}): {len(self.df_anomalies)}")
+
+        # Drill-down totals, built after key reconciliation so both sides share one spelling
+        self.cube = RollupCube(self.df_comparison)
+        self.log(f"✓ Rollup cube: {len(self.cube.nodes):,} nodes ({' → '.join(ROLLUP_LEVELS)})")
+
+    def compare_items(self):
+        """Item-level diff of the cleaned OLD and NEW rows, with a per-configuration rollup."""
+        self.log("\nComparing items...")
+        self.df_items, self.df_item_rollup = diff_items(self.df_old, self.df_new,
+                                                        normalise=self.match_mode != 'exact')
+        counts = self.df_items['Change'].value_counts()
+        for change in ITEM_CHANGES:
+            self.log(f"✓ Items {change}: {counts.get(change, 0):,}")
+
+    def record_history(self):
+        """Write this run's configurations and deltas to the history store."""
+        try:
+            run_id = HistoryStore(self.history_db).record(self, self.snapshot_date)
+            self.log(f"✓ Recorded in history: {self.history_db} (run {run_id})")
+        except Exception as e:
+            # History is a side channel; never fail the comparison because of it
+            self.log(f"⚠ Could not record history: {e}")
+
+    def _generate_top_insights(self, top_n=None, threshold=None):
+        """Generate Top N insights for each category (filtered items only)."""
+        top_n = self.top_n if top_n is None else top_n
+        threshold = self.qty_threshold if threshold is None else threshold
+        return self.index.top_insights(top_n, threshold)
+
+    def _generate_executive_dashboard(self):
+        """Generate a self-contained executive HTML dashboard.
+
+        Every significant change is embedded as base64-packed typed arrays
+        (dictionary-encoded key columns, float32 metrics); charts and the table are
+        drawn by a small inline renderer, so the file works offline.
+        """
+        html_file = self.html_file
+        df = self.df_filtered
+
+        columns = {}
+        dictionaries = {}
+        for col in GROUPING_COLS:
+            codes, uniques = pd.factorize(df[col].fillna('').astype(str))
+            dictionaries[col] = list(uniques)
+            columns[col] = pack_array(codes, '<u2' if len(uniques) < 2 ** 16 else '<u4')
+        for col in DASHBOARD_METRICS:
+            columns[col] = pack_array(df[col].to_numpy(dtype=float), '<f4')
 
         matching = self.df_comparison[self.df_comparison['Status'] == 'Matching']
-
-        html_content = f'''<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>iPhone Stock Comparison - Executive Report</title>
-    <script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.0"></script>
-    <style>
-        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
-        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap');
-
-        body {{
-            font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'SF Pro Display', sans-serif;
-            background: #f5f5f7;
-            color: #1d1d1f;
-            line-height: 1.6;
-        }}
-
-        .container {{
-            max-width: 1400px;
-            margin: 0 auto;
-            padding: 40px 20px;
-        }}
-
-        header {{
-            text-align: center;
-            margin-bottom: 48px;
-            animation: fadeIn 0.6s ease-in;
-        }}
-
-        h1 {{
-            font-size: 48px;
-            font-weight: 700;
-            letter-spacing: -0.02em;
-            margin-bottom: 12px;
-            color: #1d1d1f;
-        }}
-
-        .subtitle {{
-            font-size: 18px;
-            color: #6e6e73;
-            font-weight: 400;
-        }}
-
-        .stats-grid {{
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(220px, 1fr));
-            gap: 20px;
-            margin-bottom: 48px;
-            animation: fadeIn 0.8s ease-in 0.2s both;
-        }}
-
-        .stat-card {{
-            background: white;
-            padding: 28px;
-            border-radius: 16px;
-            box-shadow: 0 2px 12px rgba(0,0,0,0.08);
-            transition: transform 0.3s cubic-bezier(0.4, 0, 0.2, 1), box-shadow 0.3s;
-        }}
-
-        .stat-card:hover {{
-            transform: translateY(-4px);
-            box-shadow: 0 8px 24px rgba(0,0,0,0.12);
-        }}
-
-        .stat-label {{
-            font-size: 13px;
-            color: #86868b;
-            font-weight: 500;
-            text-transform: uppercase;
-            letter-spacing: 0.05em;
-            margin-bottom: 8px;
-        }}
-
-        .stat-value {{
-            font-size: 36px;
-            font-weight: 700;
-            color: #1d1d1f;
-        }}
-
-        .section {{
-            margin-bottom: 48px;
-            animation: fadeIn 1s ease-in 0.4s both;
-        }}
-
-        .section-title {{
-            font-size: 28px;
-            font-weight: 600;
-            margin-bottom: 24px;
-            color: #1d1d1f;
-        }}
-
-        .charts-grid {{
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(500px, 1fr));
-            gap: 32px;
-            margin-bottom: 48px;
-        }}
-
-        .chart-card {{
-            background: white;
-            padding: 32px;
-            border-radius: 16px;
-            box-shadow: 0 2px 12px rgba(0,0,0,0.08);
-        }}
-
-        .chart-title {{
-            font-size: 20px;
-            font-weight: 600;
-            margin-bottom: 24px;
-            color: #1d1d1f;
-        }}
-
-        table {{
-            width: 100%;
-            background: white;
-            border-radius: 16px;
-            overflow: hidden;
-            box-shadow: 0 2px 12px rgba(0,0,0,0.08);
-            border-collapse: collapse;
-        }}
-
-        th {{
-            background: #1d1d1f;
-            color: white;
-            padding: 16px 20px;
-            text-align: left;
-            font-weight: 600;
-            font-size: 13px;
-            text-transform: uppercase;
-            letter-spacing: 0.05em;
-        }}
-
-        td {{
-            padding: 16px 20px;
-            border-bottom: 1px solid #d2d2d7;
-            font-size: 15px;
-        }}
-
-        tr:last-child td {{
-            border-bottom: none;
-        }}
-
-        tr:hover {{
-            background: #f5f5f7;
-        }}
-
-        .grade-badge {{
-            display: inline-block;
-            padding: 4px 10px;
-            background: #e8e8ed;
-            border-radius: 6px;
-            font-size: 12px;
-            font-weight: 600;
-            color: #1d1d1f;
-            margin-left: 8px;
-        }}
-
-        .positive {{ color: #30d158; font-weight: 600; }}
-        .negative {{ color: #ff3b30; font-weight: 600; }}
-
-        @keyframes fadeIn {{
-            from {{ opacity: 0; transform: translateY(20px); }}
-            to {{ opacity: 1; transform: translateY(0); }}
-        }}
-
-        @media print {{
-            body {{ background: white; }}
-            .stat-card, .chart-card, table {{ box-shadow: none; border: 1px solid #d2d2d7; }}
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <header>
-            <h1>iPhone Stock Comparison</h1>
-            <p class="subtitle">Executive Report • {datetime.now().strftime('%B %d, %Y')}</p>
-        </header>
-
-        <div class="stats-grid">
-            <div class="stat-card">
-                <div class="stat-label">Total Configs</div>
-                <div class="stat-value">{len(self.df_old_grouped)} → {len(self.df_new_grouped)}</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-label">Matching Items</div>
-                <div class="stat-value">{len(matching):,}</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-label">Significant Changes</div>
-                <div class="stat-value">{len(self.df_filtered)}</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-label">Net Qty Change</div>
-                <div class="stat-value">{matching['Qty Change'].sum():+,.0f}</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-label">Avg Price (OLD)</div>
-                <div class="stat-value">${matching[matching['OLD List Price'] > 0]['OLD List Price'].mean():.0f}</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-label">Avg Price (NEW)</div>
-                <div class="stat-value">${matching[matching['NEW List Price'] > 0]['NEW List Price'].mean():.0f}</div>
-            </div>
-        </div>
-
-        <div class="section">
-            <h2 class="section-title">Analysis Complete</h2>
-            <p style="text-align: center; color: #6e6e73; font-size: 16px; margin-top: 24px; line-height: 1.6;">
-                Your stock comparison has been completed successfully.<br>
-                For detailed analysis and full data, please refer to the <strong>Excel workbook</strong> or <strong>Text report</strong>.
-            </p>
-        </div>
-    </div>
-
-    <script>
-        // Dashboard loaded successfully
-        console.log('HYLA Stock Comparison Dashboard loaded');
-    </script>
-</body>
-</html>'''
+        by_model = [model for model in self.cube.drill()['children'] if model['Matching']]
+        anomalies = self.df_anomalies.head(max(DASHBOARD_MAX_ANOMALIES, self.top_n))
+
+        payload = {
+            'rows': len(df),
+            'threshold': f"{self.qty_threshold:g}",
+            'top_n': self.top_n,
+            'summary': [
+                ['Total Configs', f"{len(self.df_old_grouped)} → {len(self.df_new_grouped)}"],
+                ['Matching Items', f"{len(matching):,}"],
+                ['Significant Changes', f"{len(df):,}"],
+                ['Net Qty Change', f"{matching['Qty Change'].sum():+,.0f}"],
+                ['Avg Price (OLD)', f"${matching[matching['OLD List Price'] > 0]['OLD List Price'].mean():.0f}"],
+                ['Avg Price (NEW)', f"${matching[matching['NEW List Price'] > 0]['NEW List Price'].mean():.0f}"],
+            ],
+            'anomalies': {
+                'names': format_item_names(anomalies),
+                'scores': anomalies['Anomaly Score'].round(2).tolist(),
+                'qty_change_pct': anomalies['Qty Change %'].round(1).tolist(),
+                'price_change_pct': anomalies['List Price Change %'].round(1).tolist(),
+            },
+            'models': {
+                'names': [model['name'] for model in by_model],
+                'qty_change': [round(model['Qty Change']) for model in by_model],
+            },
+            'columns': columns,
+            'dictionaries': dictionaries,
+        }
+
+        html_content = load_dashboard_template().substitute(
+            generated=datetime.now().strftime('%B %d, %Y'),
+            # Keep "</script>" inside strings from closing the script element
+            payload=json.dumps(payload, separators=(',', ':')).replace('</', '<\\/')
+        )
 
         with open(html_file, 'w', encoding='utf-8') as f:
             f.write(html_content)
 
-        print(f"✓ Executive dashboard generated: {html_file}")
+        self.log(f"✓ Executive dashboard generated: {html_file}")
         return html_file
 
     def export_to_excel(self):
         """Export comparison results to Excel workbook."""
-        print(f"\nGenerating Excel workbook...")
+        self.log(f"\nGenerating Excel workbook...")
 
         try:
             with pd.ExcelWriter(self.excel_file, engine='openpyxl') as writer:
@@ -594,7 +1257,8 @@ class StockComparator:
                         'Matching Configurations',
                         'Removed Configurations',
                         'New Configurations',
-                        'Items with Qty Change >= 100',
+                        f'Items with Qty Change >= {self.qty_threshold:g}',
+                        f'Anomalies (score >= {ANOMALY_THRESHOLD:g})',
                         '',
                         'Total Quantity (OLD)',
                         'Total Quantity (NEW)',
@@ -611,6 +1275,7 @@ class StockComparator:
                         (self.df_comparison['Status'] == 'Removed').sum(),
                         (self.df_comparison['Status'] == 'New').sum(),
                         len(self.df_filtered),
+                        len(self.df_anomalies),
                         '',
                         self.df_old_grouped['OLD Qty'].sum(),
                         self.df_new_grouped['NEW Qty'].sum(),
@@ -625,7 +1290,7 @@ class StockComparator:
                 df_summary = pd.DataFrame(summary_data)
                 df_summary.to_excel(writer, sheet_name='Summary', index=False)
 
-                # Sheet 2: Full Comparison (items with qty change >= 100)
+                # Sheet 2: Full Comparison (items with qty change >= threshold)
                 self.df_filtered.to_excel(writer, sheet_name='Significant Changes', index=False)
 
                 # Sheet 3: All Matching Items
@@ -650,219 +1315,488 @@ class StockComparator:
                 if len(top_insights['qty_decreases']) > 0:
                     top_insights['qty_decreases'].to_excel(writer, sheet_name='Top Qty Decreases', index=False)
 
-            print(f"✓ Excel workbook saved: {self.excel_file}")
+                # Moves that are outliers within their Model family
+                if len(self.df_anomalies) > 0:
+                    self.df_anomalies.head(EXCEL_MAX_ROWS - 1).to_excel(writer, sheet_name='Anomalies', index=False)
+
+                # Item-level changes (unchanged items left out) and their configuration rollup
+                if self.df_items is not None:
+                    changed_items = self.df_items[self.df_items['Change'] != 'unchanged']
+                    changed_items.head(EXCEL_MAX_ROWS - 1).to_excel(writer, sheet_name='Item Changes', index=False)
+                    self.df_item_rollup.to_excel(writer, sheet_name='Item Changes by Config', index=False)
+
+                # Configurations paired despite differently spelled Model/Color
+                if self.fuzzy_matches is not None and len(self.fuzzy_matches) > 0:
+                    self.fuzzy_matches.to_excel(writer, sheet_name='Fuzzy Matches', index=False)
+
+                # Repeated Item # values in either file
+                reports = [report.assign(File=label) for label, report in self.duplicates.items() if len(report)]
+                if reports:
+                    df_dupes = pd.concat(reports, ignore_index=True)
+                    df_dupes = df_dupes[['File'] + DUPLICATE_REPORT_COLS].head(EXCEL_MAX_ROWS - 1)
+                    df_dupes.to_excel(writer, sheet_name='Duplicate Items', index=False)
+
+            self.log(f"✓ Excel workbook saved: {self.excel_file}")
             return self.excel_file
         except Exception as e:
-            print(f"✗ Error generating Excel file: {e}")
+            self.log(f"✗ Error generating Excel file: {e}")
             import traceback
             traceback.print_exc()
             return None
 
-    def export_results(self):
-        """Export comparison results to text report."""
-        print(f"\nGenerating comparison report...")
-
-        # Generate Top 10 insights
-        top_insights = self._generate_top_insights()
-
-        report_lines = []
-        report_lines.append("="*80)
-        report_lines.append("STOCK LIST COMPARISON REPORT")
-        report_lines.append("="*80)
-        report_lines.append(f"\nOld File: {self.old_file}")
-        report_lines.append(f"New File: {self.new_file}")
-        report_lines.append(f"Generated: {datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')}")
-        report_lines.append("\n" + "="*80)
-
-        # Section 1: Top 10 Price Increases
-        report_lines.append("\n1. TOP 10 PRICE INCREASES (with qty change >= 100)")
-        report_lines.append("="*80)
-        if len(top_insights['price_increases']) > 0:
-            for idx, row in top_insights['price_increases'].iterrows():
-                item_name = self.format_item_name(row)
-                report_lines.append(f"\n{item_name}")
-                report_lines.append(f"  Price: ${row['OLD List Price']:.2f} -> ${row['NEW List Price']:.2f} | Change: ${row['List Price Change $']:+.2f} ({row['List Price Change %']:+.1f}%)")
-                report_lines.append(f"  QTY: {row['OLD Qty']:,.0f} -> {row['NEW Qty']:,.0f} | Change: {row['Qty Change']:+,.0f} ({row['Qty Change %']:+.1f}%)")
-        else:
-            report_lines.append("\nNo price increases found with qty change >= 100")
-
-        # Section 2: Top 10 Price Decreases
-        report_lines.append("\n\n" + "="*80)
-        report_lines.append("2. TOP 10 PRICE DECREASES (with qty change >= 100)")
-        report_lines.append("="*80)
-        if len(top_insights['price_decreases']) > 0:
-            for idx, row in top_insights['price_decreases'].iterrows():
-                item_name = self.format_item_name(row)
-                report_lines.append(f"\n{item_name}")
-                report_lines.append(f"  Price: ${row['OLD List Price']:.2f} -> ${row['NEW List Price']:.2f} | Change: ${row['List Price Change $']:+.2f} ({row['List Price Change %']:+.1f}%)")
-                report_lines.append(f"  QTY: {row['OLD Qty']:,.0f} -> {row['NEW Qty']:,.0f} | Change: {row['Qty Change']:+,.0f} ({row['Qty Change %']:+.1f}%)")
-        else:
-            report_lines.append("\nNo price decreases found with qty change >= 100")
-
-        # Section 3: Top 10 Qty Increases
-        report_lines.append("\n\n" + "="*80)
-        report_lines.append("3. TOP 10 QUANTITY INCREASES (with qty change >= 100)")
-        report_lines.append("="*80)
-        if len(top_insights['qty_increases']) > 0:
-            for idx, row in top_insights['qty_increases'].iterrows():
-                item_name = self.format_item_name(row)
-                report_lines.append(f"\n{item_name}")
-                report_lines.append(f"  QTY: {row['OLD Qty']:,.0f} -> {row['NEW Qty']:,.0f} units | Change: {row['Qty Change']:+,.0f} ({row['Qty Change %']:+.1f}%)")
-                report_lines.append(f"  PRICE: ${row['OLD List Price']:.2f} -> ${row['NEW List Price']:.2f} | Change: ${row['List Price Change $']:+.2f} ({row['List Price Change %']:+.1f}%)")
-        else:
-            report_lines.append("\nNo quantity increases found with qty change >= 100")
-
-        # Section 4: Top 10 Qty Decreases
-        report_lines.append("\n\n" + "="*80)
-        report_lines.append("4. TOP 10 QUANTITY DECREASES (with qty change >= 100)")
-        report_lines.append("="*80)
-        if len(top_insights['qty_decreases']) > 0:
-            for idx, row in top_insights['qty_decreases'].iterrows():
-                item_name = self.format_item_name(row)
-                report_lines.append(f"\n{item_name}")
-                report_lines.append(f"  QTY: {row['OLD Qty']:,.0f} -> {row['NEW Qty']:,.0f} units | Change: {row['Qty Change']:+,.0f} ({row['Qty Change %']:+.1f}%)")
-                report_lines.append(f"  PRICE: ${row['OLD List Price']:.2f} -> ${row['NEW List Price']:.2f} | Change: ${row['List Price Change $']:+.2f} ({row['List Price Change %']:+.1f}%)")
-        else:
-            report_lines.append("\nNo quantity decreases found with qty change >= 100")
-
-        # Section 5: Detailed Comparison
-        report_lines.append("\n\n" + "="*80)
-        report_lines.append("5. DETAILED COMPARISON BY MODEL-CAPACITY-GRADE-LOCK STATUS")
-        report_lines.append("="*80)
-        report_lines.append("\nAll items with significant changes (qty change >= 100):")
-        report_lines.append(f"\nTotal items: {len(self.df_filtered):,}")
-
-        # Sort by absolute qty change for detailed view
-        df_filtered_sorted = self.df_filtered.sort_values('Qty Change', ascending=False, key=abs)
-
-        report_lines.append("\n" + "-"*80)
-        for idx, row in df_filtered_sorted.head(50).iterrows():  # Show top 50 most significant changes
-            item_name = self.format_item_name(row)
-            report_lines.append(f"\n{item_name}")
-            report_lines.append(f"  Quantity: {row['OLD Qty']:,.0f} -> {row['NEW Qty']:,.0f} | Change: {row['Qty Change']:+,.0f} ({row['Qty Change %']:+.1f}%)")
-            report_lines.append(f"  Price: ${row['OLD List Price']:.2f} -> ${row['NEW List Price']:.2f} | Change: ${row['List Price Change $']:+.2f} ({row['List Price Change %']:+.1f}%)")
-
-        # Summary statistics
-        matching = self.df_comparison[self.df_comparison['Status'] == 'Matching']
-        report_lines.append("\n\n" + "="*80)
-        report_lines.append("6. SUMMARY STATISTICS")
-        report_lines.append("="*80)
-        report_lines.append(f"\nTotal unique items (old file): {len(self.df_old_grouped):,}")
-        report_lines.append(f"Total unique items (new file): {len(self.df_new_grouped):,}")
-        report_lines.append(f"Items with qty change >= 100: {len(self.df_filtered):,}")
-        report_lines.append(f"\nTotal quantity (old): {self.df_old_grouped['OLD Qty'].sum():,.0f} units")
-        report_lines.append(f"Total quantity (new): {self.df_new_grouped['NEW Qty'].sum():,.0f} units")
-        report_lines.append(f"Net quantity change: {matching['Qty Change'].sum():+,.0f} units")
-
-        # Price statistics
-        valid_old_prices = matching[matching['OLD List Price'] > 0]['OLD List Price']
-        valid_new_prices = matching[matching['NEW List Price'] > 0]['NEW List Price']
-        if len(valid_old_prices) > 0 and len(valid_new_prices) > 0:
-            report_lines.append(f"\nAverage price (old): ${valid_old_prices.mean():.2f}")
-            report_lines.append(f"Average price (new): ${valid_new_prices.mean():.2f}")
-
-        report_lines.append("\n" + "="*80)
-        report_lines.append("END OF REPORT")
-        report_lines.append("="*80)
-
-        # Write report to file
-        try:
-            with open(self.text_file, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(report_lines))
-            print(f"✓ Report saved to: {self.text_file}")
-        except Exception as e:
-            print(f"✗ ERROR saving report: {e}")
-            return None
+    def write_text_report(self, top_insights):
+        """Write the text report through a buffered stream, one rendered block at a time."""
+        rule = "=" * 80
+        threshold = f"{self.qty_threshold:g}"
+
+        with open(self.text_file, 'w', encoding='utf-8', buffering=REPORT_BUFFER_SIZE) as f:
+            report = ReportWriter(f)
+            report.lines([
+                rule,
+                "STOCK LIST COMPARISON REPORT",
+                rule,
+                f"\nOld File: {self.old_file}",
+                f"New File: {self.new_file}",
+                f"Generated: {datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')}",
+                "\n" + rule,
+            ])
+
+            # Sections 1-4: Top N lists
+            for number, (key, title, template, empty) in enumerate(REPORT_TOP_SECTIONS, start=1):
+                heading = f"{number}. TOP {self.top_n} {title} (with qty change >= {threshold})"
+                if number == 1:
+                    report.lines(["\n" + heading, rule])
+                else:
+                    report.lines(["\n\n" + rule, heading, rule])
+                if len(top_insights[key]) > 0:
+                    report.block(template, top_insights[key])
+                else:
+                    report.lines([f"\nNo {empty} found with qty change >= {threshold}"])
+
+            # Section 5: Detailed Comparison
+            report.lines([
+                "\n\n" + rule,
+                "5. DETAILED COMPARISON BY MODEL-CAPACITY-GRADE-LOCK STATUS",
+                rule,
+                f"\nAll items with significant changes (qty change >= {threshold}):",
+                f"\nTotal items: {len(self.df_filtered):,}",
+                "\n" + "-" * 80,
+            ])
+
+            # Sort by absolute qty change for detailed view (most significant first)
+            df_filtered_sorted = self.df_filtered.sort_values('Qty Change', ascending=False, key=abs)
+            if self.detail_rows is not None:
+                df_filtered_sorted = df_filtered_sorted.head(self.detail_rows)
+            report.block(REPORT_DETAIL_TEMPLATE, df_filtered_sorted)
+
+            # Section 6: Summary statistics
+            matching = self.df_comparison[self.df_comparison['Status'] == 'Matching']
+            report.lines([
+                "\n\n" + rule,
+                "6. SUMMARY STATISTICS",
+                rule,
+                f"\nTotal unique items (old file): {len(self.df_old_grouped):,}",
+                f"Total unique items (new file): {len(self.df_new_grouped):,}",
+                f"Items with qty change >= {threshold}: {len(self.df_filtered):,}",
+                f"\nTotal quantity (old): {self.df_old_grouped['OLD Qty'].sum():,.0f} units",
+                f"Total quantity (new): {self.df_new_grouped['NEW Qty'].sum():,.0f} units",
+                f"Net quantity change: {matching['Qty Change'].sum():+,.0f} units",
+            ])
+
+            # Price statistics
+            valid_old_prices = matching[matching['OLD List Price'] > 0]['OLD List Price']
+            valid_new_prices = matching[matching['NEW List Price'] > 0]['NEW List Price']
+            if len(valid_old_prices) > 0 and len(valid_new_prices) > 0:
+                report.lines([
+                    f"\nAverage price (old): ${valid_old_prices.mean():.2f}",
+                    f"Average price (new): ${valid_new_prices.mean():.2f}",
+                ])
+
+            # Section 7: Anomalies
+            report.lines([
+                "\n\n" + rule,
+                f"7. TOP {self.top_n} ANOMALIES (robust z-score within each model, volume weighted)",
+                rule,
+                f"\nConfigurations with anomaly score >= {ANOMALY_THRESHOLD:g}: {len(self.df_anomalies):,}",
+            ])
+            if len(self.df_anomalies) > 0:
+                report.block(REPORT_ANOMALY_TEMPLATE, self.df_anomalies.head(self.top_n))
+
+            report.lines(["\n" + rule, "END OF REPORT", rule])
+
+        return self.text_file
+
+    def package_files(self):
+        """Files that make up the zip package (the HTML dashboard is excluded)."""
+        return [self.text_file, self.excel_file]
+
+    def artifact_path(self, output):
+        """File an artifact (one of OUTPUT_TYPES) is written to."""
+        return {'text': self.text_file, 'excel': self.excel_file,
+                'html': self.html_file, 'zip': self.zip_file}[output]
+
+    def render(self, output):
+        """Write one artifact (one of OUTPUT_TYPES); returns its path, or None if it failed."""
+        if output == 'text':
+            return self.write_text_report(self._generate_top_insights())
+        if output == 'excel':
+            return self.export_to_excel()
+        if output == 'html':
+            return self._generate_executive_dashboard()
+        if output == 'zip':
+            # The package holds the text report and workbook; any not among self.outputs are
+            # written just for it and removed again
+            extra = [member for member in ('text', 'excel') if member not in self.outputs]
+            try:
+                for member in extra:
+                    if self.render(member) is None:
+                        return None
+                return write_package(self.zip_file, self.package_files())
+            finally:
+                for member in extra:
+                    if os.path.exists(self.artifact_path(member)):
+                        os.remove(self.artifact_path(member))
+        raise ValueError(f"Unknown output '{output}', expected one of {OUTPUT_TYPES}")
+
+    def render_state(self):
+        """What the renderers need, so artifacts can be written later (see from_state())."""
+        return {attr: getattr(self, attr) for attr in RENDER_STATE_ATTRS}
+
+    @classmethod
+    def from_state(cls, state, output_file=None):
+        """Comparator restored from render_state(), ready to render() without the source files."""
+        comparator = cls(state['old_file'], state['new_file'], output_file or state['output_file'],
+                         qty_threshold=state['qty_threshold'], top_n=state['top_n'])
+        for attr in RENDER_STATE_ATTRS:
+            if attr != 'output_file':
+                setattr(comparator, attr, state[attr])
+        comparator.index = ComparisonIndex(comparator.df_comparison)
+        return comparator
 
-        print(f"\nReport location: {os.path.abspath(self.text_file)}")
-        print(f"Total items analyzed: {len(self.df_comparison):,}")
-        print(f"Items with significant changes: {len(self.df_filtered):,}")
+    def export_results(self):
+        """Write the artifacts listed in self.outputs; returns the zip package path, if written."""
+        if 'text' in self.outputs:
+            self.log(f"\nGenerating comparison report...")
+            try:
+                self.render('text')
+                self.log(f"✓ Report saved to: {self.text_file}")
+            except Exception as e:
+                self.log(f"✗ ERROR saving report: {e}")
+                return None
+            self.log(f"\nReport location: {os.path.abspath(self.text_file)}")
+
+        self.log(f"Total items analyzed: {len(self.df_comparison):,}")
+        self.log(f"Items with significant changes: {len(self.df_filtered):,}")
 
         # Generate Excel workbook
-        excel_file = self.export_to_excel()
-        if excel_file is None:
-            return None
+        if 'excel' in self.outputs:
+            self.report_progress('export', 'running', step='excel')
+            if self.render('excel') is None:
+                return None
 
         # Generate executive dashboard
-        html_file = self._generate_executive_dashboard(top_insights)
+        if 'html' in self.outputs:
+            self.report_progress('export', 'running', step='dashboard')
+            self.render('html')
 
         # Create zip package (excluding HTML dashboard)
-        zip_file = self.text_file.replace('.txt', '_Package.zip')
-        with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            zipf.write(self.text_file, os.path.basename(self.text_file))
-            zipf.write(excel_file, os.path.basename(excel_file))
-            # HTML dashboard excluded from package
+        zip_file = None
+        if 'zip' in self.outputs:
+            zip_file = self.render('zip')
+            self.log(f"✓ Package created: {zip_file}")
+
+        # Auto-open the Excel file and dashboard (macOS only; `open` means something else elsewhere)
+        opened = [self.artifact_path(o) for o in ('excel', 'html') if o in self.outputs]
+        if opened and self.auto_open and sys.platform == 'darwin':
+            try:
+                for path in opened:
+                    subprocess.run(['open', path], check=False)
+                self.log(f"✓ Opened {' and '.join(os.path.basename(path) for path in opened)}")
+            except Exception as e:
+                self.log(f"⚠ Could not auto-open files: {e}")
 
-        print(f"✓ Package created: {zip_file}")
+        return zip_file
 
-        # Auto-open the Excel file and dashboard
+    def report_progress(self, stage, status, **details):
+        """Send a progress event to progress_callback, if one was given.
+
+        Events carry the stage, its status ('started', 'running', 'done'), rows loaded so
+        far, configurations once grouped, and seconds since run() started, plus `details`.
+        """
+        if self.progress_callback is None:
+            return
+        event = {'stage': stage, 'status': status, 'rows': sum(self.rows_loaded.values()),
+                 'elapsed': round(time.perf_counter() - self.run_started, 3)}
+        if self.df_comparison is not None:
+            event['configurations'] = len(self.df_comparison)
+        elif self.df_old_grouped is not None and self.df_new_grouped is not None:
+            event['configurations'] = len(self.df_old_grouped) + len(self.df_new_grouped)
+        event.update(details)
+        self.progress_callback(event)
+
+    def timed(self, stage, func):
+        """Run one pipeline stage, recording its wall-clock seconds in self.timings.
+
+        Reports 'started' and 'done' progress events around it.
+        """
+        self.report_progress(stage, 'started')
+        start = time.perf_counter()
         try:
-            subprocess.run(['open', excel_file], check=False)
-            subprocess.run(['open', html_file], check=False)
-            print(f"✓ Opened Excel workbook and dashboard")
-        except Exception as e:
-            print(f"⚠ Could not auto-open files: {e}")
-
-        return zip_file
+            result = func()
+        finally:
+            self.timings[stage] = time.perf_counter() - start
+        self.report_progress(stage, 'done', seconds=round(self.timings[stage], 3))
+        return result
+
+    def analyse(self):
+        """Load, clean, group and compare both files (and diff items with item_diff), in memory."""
+        self.run_started = time.perf_counter()
+        self.timed('load', self.load_data)
+        self.timed('clean', self.clean_data)
+        self.timed('group', self.group_by_configuration)
+        self.timed('compare', self.compare_configurations)
+        if self.item_diff:
+            self.timed('items', self.compare_items)
+
+    def summary(self):
+        """Headline numbers of an analysed comparison."""
+        matching = self.df_comparison[self.df_comparison['Status'] == 'Matching']
+        return {
+            'total_configs_old': int(len(self.df_old_grouped)),
+            'total_configs_new': int(len(self.df_new_grouped)),
+            'matching_configs': int(len(matching)),
+            'removed_configs': int((self.df_comparison['Status'] == 'Removed').sum()),
+            'new_configs': int((self.df_comparison['Status'] == 'New').sum()),
+            'significant_changes': int(len(self.df_filtered)),
+            'anomalies': int(len(self.df_anomalies)),
+            'net_qty_change': float(matching['Qty Change'].sum()) if len(matching) > 0 else 0.0,
+            'avg_price_old': float(matching[matching['OLD List Price'] > 0]['OLD List Price'].mean()) if len(matching) > 0 else 0.0,
+            'avg_price_new': float(matching[matching['NEW List Price'] > 0]['NEW List Price'].mean()) if len(matching) > 0 else 0.0,
+        }
 
     def run(self):
         """Execute the complete comparison workflow."""
-        print("=" * 80)
-        print("STOCK LIST COMPARISON TOOL")
-        print("=" * 80)
-        print(f"OLD file: {self.old_file}")
-        print(f"NEW file: {self.new_file}")
-        print(f"Output:   {self.excel_file}")
-        print("=" * 80)
+        self.log("=" * 80)
+        self.log("STOCK LIST COMPARISON TOOL")
+        self.log("=" * 80)
+        self.log(f"OLD file: {self.old_file}")
+        self.log(f"NEW file: {self.new_file}")
+        self.log(f"Output:   {self.excel_file}")
+        self.log("=" * 80)
 
         try:
-            self.load_data()
-            self.clean_data()
-            self.group_by_configuration()
-            self.compare_configurations()
-            zip_file = self.export_results()
-
-            print("\n" + "=" * 80)
-            print("COMPARISON COMPLETE!")
-            print("=" * 80)
-            print(f"\n📦 Package: {zip_file}")
-            print(f"   Contains: Excel Workbook + Text Report + Executive Dashboard")
-            print(f"\nFiles generated:")
-            print(f"   • {self.excel_file}")
-            print(f"   • {self.text_file}")
-            print(f"   • {self.text_file.replace('.txt', '_Dashboard.html')}")
-            print(f"   • {zip_file}")
+            self.analyse()
+            if self.history_db:
+                self.timed('history', self.record_history)
+            zip_file = self.timed('export', self.export_results)
+
+            self.log("\n" + "=" * 80)
+            self.log("COMPARISON COMPLETE!")
+            self.log("=" * 80)
+            if zip_file:
+                self.log(f"\n📦 Package: {zip_file}")
+                self.log(f"   Contains: Excel Workbook + Text Report")
+            generated = [self.artifact_path(o) for o in ('excel', 'text', 'html', 'zip') if o in self.outputs]
+            if generated:
+                self.log(f"\nFiles generated:")
+                for path in generated:
+                    self.log(f"   • {path}")
 
             return True
         except Exception as e:
-            print(f"\n✗ Error during comparison: {e}")
+            self.log(f"\n✗ Error during comparison: {e}")
             import traceback
             traceback.print_exc()
             return False
 
 
+def compact_frame(df):
+    """Copy of a result frame with text columns as categoricals and counts downcast."""
+    if df is None:
+        return None
+    compact = {}
+    for col in df.columns:
+        values = df[col]
+        if values.dtype == object:
+            values = values.astype('category')
+        elif pd.api.types.is_integer_dtype(values):
+            values = pd.to_numeric(values, downcast='integer')
+        compact[col] = values
+    return pd.DataFrame(compact, index=df.index)
+
+
+class ComparisonResult:
+    """In-memory outcome of compare().
+
+    Frames keep their columns (see the text report and Excel workbook for their meaning) but
+    store key and text columns as categoricals and counts as the smallest integer type.
+    """
+
+    def __init__(self, comparator):
+        self.qty_threshold = comparator.qty_threshold
+        self.top_n = comparator.top_n
+        self.summary = comparator.summary()
+        self.comparison = compact_frame(comparator.df_comparison)  # Every configuration, with Status
+        self.significant = compact_frame(comparator.df_filtered)  # Matching, |Qty Change| >= threshold
+        self.anomalies = compact_frame(comparator.df_anomalies)  # Anomaly Score >= ANOMALY_THRESHOLD, highest first
+        self.items = compact_frame(comparator.df_items)  # Per Item # changes (item_diff only)
+        self.item_rollup = compact_frame(comparator.df_item_rollup)
+        self.fuzzy_matches = comparator.fuzzy_matches
+        self.duplicates = comparator.duplicates
+        self.match_stats = comparator.match_stats
+        self.timings = dict(comparator.timings)
+        self.cube = comparator.cube  # RollupCube: Model → Capacity → Grade totals, see drill()
+        self.index = None  # ComparisonIndex over self.comparison, built on first top_insights()
+
+    def top_insights(self, n=None, threshold=None):
+        """Top-N price/qty increase and decrease lists (default: the comparison's settings)."""
+        if self.index is None:
+            self.index = ComparisonIndex(self.comparison)
+        return self.index.top_insights(self.top_n if n is None else n,
+                                       self.qty_threshold if threshold is None else threshold)
+
+
+def compare(old, new, qty_threshold=SIGNIFICANT_QTY_CHANGE, top_n=TOP_N, dedupe='keep-all',
+            match_mode='exact', item_diff=False, reader_engine='auto'):
+    """Compare two stock lists without printing, writing files or running anything.
+
+    `old` and `new` may each be a path, the workbook's bytes (or a binary file object), or
+    a DataFrame already read from one. Returns a ComparisonResult; errors are raised.
+    """
+    comparator = StockComparator(old, new, qty_threshold=qty_threshold, top_n=top_n,
+                                 dedupe=dedupe, match_mode=match_mode, item_diff=item_diff,
+                                 reader_engine=reader_engine, outputs=[], verbose=False)
+    comparator.analyse()
+    return ComparisonResult(comparator)
+
+
+def preview(old, new, rows=PREVIEW_ROWS, stride=1, qty_threshold=SIGNIFICANT_QTY_CHANGE, top_n=TOP_N,
+            dedupe='keep-all', match_mode='exact', reader_engine='auto'):
+    """Approximate summary of a comparison, from a sample of each file (see sample_stock_file()).
+
+    The sampled rows go through the same clean/group/compare steps as compare(). Counts and
+    totals describe the sample only: configurations beyond it are missing and, with a prefix
+    sample, show up as new/removed. Returns summary() plus 'preview': True, the sample size
+    and the seconds taken.
+    """
+    start = time.perf_counter()
+    samples = [source.iloc[::stride].head(rows) if isinstance(source, pd.DataFrame)
+               else sample_stock_file(source, rows, stride, reader_engine) for source in (old, new)]
+    comparator = StockComparator(*samples, qty_threshold=qty_threshold, top_n=top_n, dedupe=dedupe,
+                                 match_mode=match_mode, reader_engine=reader_engine, outputs=[], verbose=False)
+    comparator.analyse()
+    return {
+        **comparator.summary(),
+        'preview': True,
+        'sample': {'rows': rows, 'stride': stride, 'old_rows': len(samples[0]), 'new_rows': len(samples[1])},
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def print_preview(result):
+    """Print a preview() summary, clearly labelled as approximate."""
+    sample = result['sample']
+    rows = f"a 1-in-{sample['stride']} row sample" if sample['stride'] > 1 else "the first rows"
+    print("=" * 80)
+    print(f"PREVIEW - approximate, from {rows} of each file "
+          f"({sample['old_rows']:,} OLD / {sample['new_rows']:,} NEW rows)")
+    print("=" * 80)
+    print(f"Configurations:      {result['total_configs_old']:,} → {result['total_configs_new']:,} "
+          f"({result['matching_configs']:,} matching, {result['removed_configs']:,} removed, "
+          f"{result['new_configs']:,} new)")
+    print(f"Significant changes: {result['significant_changes']:,}")
+    print(f"Anomalies:           {result['anomalies']:,}")
+    print(f"Net qty change:      {result['net_qty_change']:+,.0f}")
+    print(f"Avg price:           ${result['avg_price_old']:.2f} → ${result['avg_price_new']:.2f}")
+    print(f"Preview took {result['seconds']:.2f}s; running the full comparison...\n")
+
+
+def parse_outputs(value):
+    """--outputs value: comma-separated names from OUTPUT_TYPES."""
+    outputs = [o.strip().lower() for o in value.split(',') if o.strip()]
+    unknown = [o for o in outputs if o not in OUTPUT_TYPES]
+    if not outputs or unknown:
+        raise argparse.ArgumentTypeError(f"expected a comma-separated list of {', '.join(OUTPUT_TYPES)}")
+    return outputs
+
+
 def main():
     """Main entry point."""
-    if len(sys.argv) < 3:
-        print("Usage: python stock_comparison_tool.py <old_file.xlsx> <new_file.xlsx> [output_file.txt]")
-        print("\nExample:")
-        print('  python stock_comparison_tool.py "**OLD**Stock_List.xlsx" "**NEW**Stock_List.xlsx"')
-        sys.exit(1)
-
-    old_file = sys.argv[1]
-    new_file = sys.argv[2]
-    output_file = sys.argv[3] if len(sys.argv) > 3 else None
+    if len(sys.argv) > 1 and sys.argv[1] == 'history':
+        sys.exit(history_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        from batch_compare import batch_main  # Imports this module
+        sys.exit(batch_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'watch':
+        from folder_watcher import watch_main  # Imports this module
+        sys.exit(watch_main(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(
+        description="Compare OLD and NEW stock lists.",
+        epilog='Example:\n  python stock_comparison_tool.py "**OLD**Stock_List.xlsx" "**NEW**Stock_List.xlsx"',
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('old_file', help='OLD stock list (.xlsx)')
+    parser.add_argument('new_file', help='NEW stock list (.xlsx)')
+    parser.add_argument('output_file', nargs='?', default=None, help='Output report (.txt or .xlsx)')
+    parser.add_argument('--threshold', type=float, default=SIGNIFICANT_QTY_CHANGE,
+                        help=f'Minimum absolute qty change for a significant change (default: {SIGNIFICANT_QTY_CHANGE})')
+    parser.add_argument('--top', type=int, default=TOP_N,
+                        help=f'Number of entries in each Top-N list (default: {TOP_N})')
+    parser.add_argument('--history-db', default=DEFAULT_HISTORY_DB,
+                        help=f'History database to record this run in (default: {DEFAULT_HISTORY_DB})')
+    parser.add_argument('--no-history', action='store_true', help='Do not record this run in the history database')
+    parser.add_argument('--snapshot-date', help='Date to record this run under (YYYY-MM-DD, default: today)')
+    parser.add_argument('--dedupe', choices=DEDUPE_STRATEGIES, default='keep-all',
+                        help='How to handle duplicated Item # rows (default: keep-all)')
+    parser.add_argument('--match', choices=MATCH_MODES, default='exact',
+                        help='How configuration keys are matched: exact strings, normalised '
+                             '(case/whitespace folded) or fuzzy (default: exact)')
+    parser.add_argument('--reader', choices=READER_ENGINES, default='auto',
+                        help='Excel reader: calamine (fast, needs python-calamine), openpyxl, or auto '
+                             '(calamine when installed; default: auto)')
+    parser.add_argument('--item-diff', action='store_true',
+                        help='Also compare individual Item # rows (added, removed, qty/price change, reclassified)')
+    parser.add_argument('--outputs', type=parse_outputs, default=OUTPUT_TYPES,
+                        help=f"Comma-separated artifacts to write, from {','.join(OUTPUT_TYPES)} (default: all)")
+    parser.add_argument('--detail-rows', type=int, default=REPORT_DETAIL_ROWS,
+                        help=f'Rows in the report\'s detailed comparison section, 0 for all (default: {REPORT_DETAIL_ROWS})')
+    parser.add_argument('--preview', action='store_true',
+                        help='Print an approximate summary from a sample of each file before the full comparison')
+    parser.add_argument('--preview-rows', type=int, default=PREVIEW_ROWS,
+                        help=f'Rows sampled from each file for --preview (default: {PREVIEW_ROWS})')
+    parser.add_argument('--preview-stride', type=int, default=1,
+                        help='Sample every Nth row for --preview instead of the first rows (default: 1)')
+    args = parser.parse_args()
 
     # Validate input files exist
-    if not os.path.exists(old_file):
-        print(f"✗ Error: OLD file not found: {old_file}")
+    if not os.path.exists(args.old_file):
+        print(f"✗ Error: OLD file not found: {args.old_file}")
         sys.exit(1)
-    if not os.path.exists(new_file):
-        print(f"✗ Error: NEW file not found: {new_file}")
+    if not os.path.exists(args.new_file):
+        print(f"✗ Error: NEW file not found: {args.new_file}")
         sys.exit(1)
 
+    if args.preview:
+        if args.preview_rows < 1 or args.preview_stride < 1:
+            print("✗ Error: --preview-rows and --preview-stride must be at least 1")
+            sys.exit(1)
+        try:
+            print_preview(preview(args.old_file, args.new_file, args.preview_rows, args.preview_stride,
+                                  qty_threshold=args.threshold, top_n=args.top, dedupe=args.dedupe,
+                                  match_mode=args.match, reader_engine=args.reader))
+        except Exception as e:
+            # The full run reports problems with the files properly
+            print(f"⚠ Preview not available: {e}\n")
+
     # Run comparison
-    comparator = StockComparator(old_file, new_file, output_file)
+    comparator = StockComparator(args.old_file, args.new_file, args.output_file,
+                                 qty_threshold=args.threshold, top_n=args.top,
+                                 history_db=None if args.no_history else args.history_db,
+                                 snapshot_date=args.snapshot_date,
+                                 detail_rows=args.detail_rows or None, dedupe=args.dedupe,
+                                 match_mode=args.match, item_diff=args.item_diff,
+                                 reader_engine=args.reader, outputs=args.outputs)
     success = comparator.run()
 
     sys.exit(0 if success else 1)
@@ -4,18 +4,33 @@ Flask Web Application for Stock Comparison Tool
 Provides a drag-and-drop interface for comparing stock lists.
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, make_response, stream_with_context
 from werkzeug.utils import secure_filename
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
 import os
 import tempfile
 import shutil
 from pathlib import Path
 from datetime import datetime
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
+import json
+import math
+import threading
+import time
+import uuid
 import pandas as pd
 import logging
 import sys
 import traceback
-from stock_comparison_tool import StockComparator
+from stock_comparison_tool import (StockComparator, ComparisonIndex, SIGNIFICANT_QTY_CHANGE, TOP_N,
+                                   ANOMALY_THRESHOLD, PREVIEW_ROWS, stream_package, load_stock_file, preview)
+from history_store import HistoryStore, DEFAULT_HISTORY_DB
+import metrics
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -34,23 +49,611 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
-app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max request size (multipart upload or one chunk)
+# Set UPLOAD_FOLDER when running several worker processes: they must all share one folder
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER') or tempfile.mkdtemp()
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+app.config['MAX_UPLOAD_SIZE'] = int(os.environ.get('MAX_UPLOAD_MB', 500)) * 1024 * 1024  # Per file, chunked uploads
+app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024  # Chunk size suggested to clients
+# Persistent data (the history database) lives here; relative paths resolve against the app folder
+app.config['DATA_DIR'] = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                      os.environ.get('DATA_DIR', '.')))
+app.config['HISTORY_DB'] = os.path.join(app.config['DATA_DIR'], DEFAULT_HISTORY_DB)
+# Recording web comparisons in the history database is opt-in: every worker writes the one SQLite file
+app.config['RECORD_HISTORY'] = os.environ.get('RECORD_HISTORY', '').lower() in ('1', 'true', 'yes')
 
 # Log startup information
 logger.info("=" * 80)
 logger.info("HYLA Stock Comparison Tool - Starting")
 logger.info(f"Upload folder: {app.config['UPLOAD_FOLDER']}")
 logger.info(f"Max file size: {app.config['MAX_CONTENT_LENGTH'] / (1024*1024)}MB")
+logger.info(f"Max chunked upload size: {app.config['MAX_UPLOAD_SIZE'] / (1024*1024)}MB")
+logger.info(f"History database: {app.config['HISTORY_DB']} "
+            f"({'recording' if app.config['RECORD_HISTORY'] else 'not recording'} web comparisons)")
 logger.info("=" * 80)
 
 ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
 
+# Results API settings
+RESULT_TABLES = ('comparison', 'filtered', 'anomalies', 'items')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MIN_COMPRESS_BYTES = 1024  # Responses smaller than this are sent uncompressed
+
+# Preview limits: rows * stride is how much of each sheet a preview reads
+MAX_PREVIEW_ROWS = 20000
+MAX_PREVIEW_STRIDE = 100
+
+# Result cache settings
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 16))  # Finished sessions kept for reuse
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# One JSON payload per (OLD hash, NEW hash, parameters) on disk, so every worker process shares
+# the cache; file mtime is the last use
+RESULT_CACHE_SUBFOLDER = 'result_cache'
+
+# Pipelined ingest: uploads already on disk are parsed in the background while the rest of the
+# request (or the other file's upload) is still arriving
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 2))
+INGEST_TTL_SECONDS = 10 * 60  # Parsed frames nobody collected are dropped after this
+MAX_FORM_FIELD_SIZE = 64 * 1024  # Non-file fields of a streamed multipart request
+
+# File path -> (Future of the parsed frame, monotonic start time)
+ingest_pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='ingest')
+ingest_jobs = {}
+ingest_lock = threading.Lock()
+
+# Progress stream settings: events are appended to a file per comparison so the stream can be
+# served by any worker process
+PROGRESS_SUBFOLDER = 'progress'
+PROGRESS_POLL_SECONDS = 0.25
+PROGRESS_KEEPALIVE_SECONDS = 15  # Comment line sent while idle, so proxies keep the stream open
+PROGRESS_STREAM_TIMEOUT = 30 * 60
+PROGRESS_FINAL_EVENTS = ('complete', 'error')
+
+# Chunked upload settings
+UPLOAD_SUBFOLDER = 'uploads'
+UPLOAD_TTL_SECONDS = 24 * 60 * 60  # Unfinished or unused uploads older than this are pruned
+STREAM_BLOCK_SIZE = 1024 * 1024  # Bytes read from the request stream at a time
+
+# upload_id -> (running sha256, bytes hashed); rebuilt from disk if missing or if another
+# worker process wrote chunks since
+upload_hashers = {}
+upload_state_lock = threading.Lock()
+thread_locks = {}  # Lock file path -> lock, where fcntl is unavailable
+
+try:
+    import brotli  # Optional: preferred over gzip when installed
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl  # Optional: file locks shared by worker processes (not available on Windows)
+except ImportError:
+    fcntl = None
+
+# Service metrics, exposed at /metrics; one file per metric so every worker process adds to
+# the same totals
+METRICS_SUBFOLDER = 'metrics'
+REGISTRY = metrics.Registry(os.path.join(app.config['UPLOAD_FOLDER'], METRICS_SUBFOLDER))
+HTTP_REQUESTS = REGISTRY.counter('stock_http_requests_total', 'HTTP requests by route, method and status.',
+                                 ['route', 'method', 'status'])
+HTTP_LATENCY = REGISTRY.histogram('stock_http_request_duration_seconds', 'HTTP request latency by route.',
+                                  ['route', 'method'])
+HTTP_IN_FLIGHT = REGISTRY.gauge('stock_http_requests_in_flight', 'Requests currently being handled.')
+COMPARISONS_IN_PROGRESS = REGISTRY.gauge('stock_comparisons_in_progress', 'Comparisons currently running.')
+COMPARISON_STAGE_SECONDS = REGISTRY.histogram('stock_comparison_stage_duration_seconds',
+                                              'Comparison pipeline duration by stage.', ['stage'])
+COMPARISONS = REGISTRY.counter('stock_comparisons_total', 'Comparisons by outcome (success/failed/cached).',
+                               ['outcome'])
+ROWS_PROCESSED = REGISTRY.counter('stock_rows_processed_total', 'Stock list rows loaded, by file.', ['file'])
+UPLOAD_BYTES = REGISTRY.counter('stock_upload_bytes_total', 'Bytes received from uploads, by upload method.',
+                                ['method'])
+ARTIFACT_BYTES = REGISTRY.counter('stock_artifact_bytes_total', 'Bytes of generated artifacts, by type.', ['type'])
+DOWNLOAD_BYTES = REGISTRY.counter('stock_download_bytes_total', 'Bytes of artifacts served, by type.', ['type'])
+RESULT_CACHE_REQUESTS = REGISTRY.counter('stock_result_cache_requests_total',
+                                         'Result cache lookups by result (hit/miss).', ['result'])
+RESULT_CACHE_ENTRIES = REGISTRY.gauge('stock_result_cache_entries', 'Finished sessions held in the result cache.')
+LOADER_CACHE = REGISTRY.gauge('stock_loader_cache_lookups', 'In-memory loader cache lookups (hits/misses).',
+                              ['cache', 'result'])
+TEMP_BYTES = REGISTRY.gauge('stock_temp_folder_bytes', 'Bytes used by files in the upload/temp folder.')
+TEMP_FREE_BYTES = REGISTRY.gauge('stock_temp_folder_free_bytes', 'Free bytes on the upload/temp folder\'s disk.')
+
+# Downloadable artifacts (besides the zip, streamed from text + excel) -> file name suffix
+DOWNLOAD_TYPES = {'text': '.txt', 'excel': '.xlsx', 'html': '_Dashboard.html', 'pdf': '_Top10.pdf'}
+# Artifact file suffix -> metric type label
+ARTIFACT_TYPES = {'.txt': 'text', '.xlsx': 'excel', '.html': 'html', '.pdf': 'pdf', '.pkl': 'results'}
+
 def allowed_file(filename):
     """Check if file has allowed extension."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def result_cache_key(old_hash, new_hash, qty_threshold, top_n, history_date=None):
+    """Cache key for a comparison: both file hashes plus every parameter that affects the output.
+
+    history_date is the date the run is recorded under when history is recorded, so a
+    comparison for a new date is run (and recorded) rather than served from the cache.
+    """
+    key = f'{old_hash}:{new_hash}:{float(qty_threshold)}:{int(top_n)}'
+    if history_date:
+        key += f':{history_date}'
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def parse_query_params(source):
+    """Read significance threshold and Top-N from request args/form, falling back to the defaults."""
+    qty_threshold = float(source.get('threshold', SIGNIFICANT_QTY_CHANGE))
+    top_n = int(source.get('top', TOP_N))
+    if qty_threshold < 0 or top_n < 1:
+        raise ValueError('threshold must be >= 0 and top must be >= 1')
+    return qty_threshold, top_n
+
+
+def remove_session_files(session_id):
+    """Delete every artifact belonging to a session."""
+    for file_path in Path(app.config['UPLOAD_FOLDER']).glob(f'*{session_id}*'):
+        try:
+            file_path.unlink()
+        except OSError as e:
+            logger.warning(f"[{session_id}] Could not delete {file_path.name}: {e}")
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock held across threads and worker processes (flock on `path`).
+
+    Falls back to a per-process thread lock where fcntl is unavailable.
+    """
+    if fcntl is None:
+        with upload_state_lock:
+            lock = thread_locks.setdefault(path, threading.Lock())
+        with lock:
+            yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def result_cache_dir():
+    """Folder holding the cached compare payloads."""
+    folder = os.path.join(app.config['UPLOAD_FOLDER'], RESULT_CACHE_SUBFOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def result_cache_entries():
+    """Cached payload files, least recently used first."""
+    entries = []
+    for file_path in Path(result_cache_dir()).glob('*.json'):
+        try:
+            entries.append((file_path.stat().st_mtime, file_path))
+        except OSError:
+            pass  # Evicted by another worker meanwhile
+    return [file_path for _, file_path in sorted(entries)]
+
+
+def get_cached_result(key):
+    """Return the cached payload for a key (marking it recently used), or None."""
+    path = os.path.join(result_cache_dir(), f'{key}.json')
+    with file_lock(os.path.join(result_cache_dir(), '.lock')):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if not os.path.exists(results_path(payload['session_id'])):
+            # Artifacts were cleaned up behind our back; treat as a miss
+            os.remove(path)
+            return None
+        os.utime(path)
+        return payload
+
+
+def store_cached_result(key, payload):
+    """Add a finished comparison to the cache, evicting the least recently used sessions."""
+    path = os.path.join(result_cache_dir(), f'{key}.json')
+    evicted = []
+    with file_lock(os.path.join(result_cache_dir(), '.lock')):
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+        os.replace(path + '.tmp', path)
+
+        entries = result_cache_entries()
+        for file_path in entries[:max(len(entries) - RESULT_CACHE_SIZE, 0)]:
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    evicted.append(json.load(f)['session_id'])
+            except (OSError, json.JSONDecodeError, KeyError):
+                pass
+            file_path.unlink(missing_ok=True)
+
+    for session_id in evicted:
+        logger.info(f"[{session_id}] Evicted from result cache")
+        remove_session_files(session_id)
+
+
+def upload_dir():
+    """Folder holding chunked uploads."""
+    folder = os.path.join(app.config['UPLOAD_FOLDER'], UPLOAD_SUBFOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def upload_meta_path(upload_id):
+    return os.path.join(upload_dir(), f'{upload_id}.json')
+
+
+def read_upload_meta(upload_id):
+    """Metadata for an upload, or None if the id is unknown."""
+    if not upload_id or not upload_id.isalnum():
+        return None
+    try:
+        with open(upload_meta_path(upload_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_upload_meta(upload_id, meta):
+    """Write upload metadata atomically so other requests never see a partial file."""
+    tmp_path = upload_meta_path(upload_id) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, upload_meta_path(upload_id))
+
+
+def upload_lock(upload_id):
+    """Per-upload lock so concurrent chunk requests (on any worker) cannot interleave writes."""
+    return file_lock(os.path.join(upload_dir(), f'{upload_id}.lock'))
+
+
+def upload_hasher(upload_id, path, received):
+    """Running hash of the first `received` bytes of an upload.
+
+    Kept in memory between chunks; rebuilt once from the bytes on disk after a restart,
+    or when another worker process has written chunks since this one last saw the upload.
+    """
+    with upload_state_lock:
+        hasher, hashed = upload_hashers.get(upload_id, (None, None))
+    if hasher is None or hashed != received:
+        hasher = hashlib.sha256()
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    hasher.update(block)
+    return hasher
+
+
+def upload_status(meta):
+    """Public view of an upload's progress."""
+    return {
+        'upload_id': meta['upload_id'],
+        'filename': meta['filename'],
+        'size': meta['size'],
+        'offset': os.path.getsize(meta['path']) if os.path.exists(meta['path']) else 0,
+        'complete': meta['complete'],
+        'sha256': meta.get('sha256'),
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE']
+    }
+
+
+def completed_upload(upload_id):
+    """(path, sha256, filename) for a finished upload, or None."""
+    meta = read_upload_meta(upload_id)
+    if meta is None or not meta['complete']:
+        return None
+    return meta['path'], meta['sha256'], meta['filename']
+
+
+def prune_stale_uploads():
+    """Remove uploads and progress logs that have not been touched for UPLOAD_TTL_SECONDS."""
+    cutoff = time.time() - UPLOAD_TTL_SECONDS
+    progress_dir = Path(app.config['UPLOAD_FOLDER'], PROGRESS_SUBFOLDER)
+    for file_path in (progress_dir.iterdir() if progress_dir.is_dir() else []):
+        try:
+            if file_path.stat().st_mtime < cutoff:
+                file_path.unlink()
+        except OSError:
+            pass
+    ingest_cutoff = time.time() - INGEST_TTL_SECONDS
+    for file_path in Path(upload_dir()).iterdir():
+        try:
+            if file_path.suffix == '.pkl':
+                if file_path.stat().st_mtime < ingest_cutoff:
+                    file_path.unlink()  # Parsed copy of an upload nobody compared
+                continue
+            if file_path.stat().st_mtime < cutoff:
+                if file_path.is_dir():
+                    shutil.rmtree(file_path)  # Multipart uploads of one comparison
+                else:
+                    file_path.unlink()
+                upload_id = file_path.name.split('.', 1)[0].split('_', 1)[0]
+                with upload_state_lock:
+                    upload_hashers.pop(upload_id, None)
+        except OSError:
+            pass
+
+
+def progress_path(progress_id):
+    """Event file for a client-chosen progress id, or None if the id is not acceptable."""
+    if not progress_id or not progress_id.isalnum() or len(progress_id) > 64:
+        return None
+    folder = os.path.join(app.config['UPLOAD_FOLDER'], PROGRESS_SUBFOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f'{progress_id}.jsonl')
+
+
+def publish_progress(progress_id, event_type, data):
+    """Append one event for /api/progress/<progress_id> subscribers (no-op without an id)."""
+    path = progress_path(progress_id)
+    if path is None:
+        return
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'type': event_type, **data}) + '\n')
+
+
+def comparison_summary(comparator, timestamp):
+    """Headline numbers of a finished comparison (shown on the page and in the PDF)."""
+    return {**comparator.summary(), 'timestamp': timestamp}
+
+
+def ingest_file(path, keep_pickle):
+    """Parse a stock file (background job); optionally pickle it for other worker processes."""
+    start = time.perf_counter()
+    df = load_stock_file(path)
+    if keep_pickle:
+        df.to_pickle(path + '.tmp.pkl')
+        os.replace(path + '.tmp.pkl', path + '.pkl')
+    logger.info(f"[ingest] Parsed {os.path.basename(path)}: {len(df)} rows in {time.perf_counter() - start:.2f}s")
+    return df
+
+
+def start_ingest(path, keep_pickle=False):
+    """Start parsing an uploaded file in the background; collect it with ingested_frame_loader()."""
+    expire_ingest_jobs()
+    with ingest_lock:
+        ingest_jobs[path] = (ingest_pool.submit(ingest_file, path, keep_pickle), time.monotonic())
+    # Drop it later if no comparison in this process collects it
+    timer = threading.Timer(INGEST_TTL_SECONDS + 1, expire_ingest_jobs)
+    timer.daemon = True
+    timer.start()
+
+
+def remove_ingest_pickle(path):
+    """Delete the pickle a background parse wrote for other worker processes, if any."""
+    try:
+        os.remove(path + '.pkl')
+    except FileNotFoundError:
+        pass
+
+
+def discard_ingest(path):
+    """Drop a background parse whose result is no longer needed, and its pickle."""
+    if path is None:
+        return
+    with ingest_lock:
+        job = ingest_jobs.pop(path, None)
+    if job is not None:
+        job[0].cancel()
+        job[0].add_done_callback(lambda _: remove_ingest_pickle(path))  # Once a running parse has written it
+    remove_ingest_pickle(path)
+
+
+def expire_ingest_jobs():
+    """Discard background parses nobody collected within INGEST_TTL_SECONDS."""
+    cutoff = time.monotonic() - INGEST_TTL_SECONDS
+    with ingest_lock:
+        stale = [path for path, (_, started) in ingest_jobs.items() if started < cutoff]
+    for path in stale:
+        discard_ingest(path)
+
+
+def ingested_frame_loader(path):
+    """Loader for StockComparator(preloaded=...).
+
+    Returns the background parse of `path` (waiting for it if still running), or the
+    pickle another worker process wrote for it, or None so the comparator reads the file.
+    The pickle is deleted once collected.
+    """
+    def load():
+        with ingest_lock:
+            job = ingest_jobs.pop(path, None)
+        try:
+            if job is not None:
+                return job[0].result()
+            if os.path.exists(path + '.pkl'):
+                return pd.read_pickle(path + '.pkl')
+        except Exception as e:
+            logger.warning(f"[ingest] Background parse of {os.path.basename(path)} failed, reading it again: {e}")
+        finally:
+            remove_ingest_pickle(path)
+        return None
+    return load
+
+
+def receive_multipart(session_id):
+    """Stream a multipart /api/compare body, saving file parts as they arrive.
+
+    Each file part is written to the session's upload folder and hashed while it is
+    received; as soon as the OLD part is complete it starts parsing in the background,
+    overlapping with the NEW part's upload. Returns (form fields, files) where files maps
+    'old_file'/'new_file' to {'filename', 'path', 'sha256'}; parts with a missing or
+    disallowed filename are drained but not saved (path None).
+    """
+    boundary = parse_options_header(request.headers.get('Content-Type', ''))[1].get('boundary', '')
+    decoder = MultipartDecoder(boundary.encode())
+    session_upload_dir = os.path.join(upload_dir(), session_id)
+    fields, files = {}, {}
+    part = None  # (kind, name, value buffer or open file, hasher)
+
+    stream = request.stream
+    while True:
+        chunk = stream.read(STREAM_BLOCK_SIZE)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, Field):
+                part = ('field', event.name, bytearray(), None)
+            elif isinstance(event, File):
+                target = None
+                if event.name in ('old_file', 'new_file') and event.filename and allowed_file(event.filename):
+                    folder = os.path.join(session_upload_dir, event.name.split('_')[0])
+                    os.makedirs(folder, exist_ok=True)
+                    target = os.path.join(folder, secure_filename(event.filename))
+                files[event.name] = {'filename': event.filename or '', 'path': target, 'sha256': None}
+                part = ('file', event.name, open(target, 'wb') if target else None, hashlib.sha256())
+            elif isinstance(event, Data) and part is not None:
+                kind, name, sink, hasher = part
+                if kind == 'field':
+                    sink.extend(event.data)
+                    if len(sink) > MAX_FORM_FIELD_SIZE:
+                        raise ValueError(f"Form field '{name}' is too large")
+                elif sink is not None:
+                    sink.write(event.data)
+                    hasher.update(event.data)
+                if not event.more_data:
+                    if kind == 'field':
+                        fields[name] = sink.decode('utf-8', 'replace')
+                    elif sink is not None:
+                        UPLOAD_BYTES.inc(sink.tell(), method='multipart')  # Once per part, not per block
+                        sink.close()
+                        files[name]['sha256'] = hasher.hexdigest()
+                        if name == 'old_file':
+                            logger.info(f"[{session_id}] OLD file received, parsing it while NEW uploads")
+                            start_ingest(files[name]['path'])
+                    part = None
+            event = decoder.next_event()
+        if isinstance(event, Epilogue) or not chunk:
+            break
+
+    if part is not None and part[0] == 'file' and part[2] is not None:
+        UPLOAD_BYTES.inc(part[2].tell(), method='multipart')
+        part[2].close()  # Body ended mid-part
+        files[part[1]]['path'] = None
+    return fields, files
+
+
+def results_path(session_id):
+    """Path of the pickled comparison frames for a session."""
+    return os.path.join(app.config['UPLOAD_FOLDER'], f'Comparison_{session_id}_results.pkl')
+
+
+def save_session_results(comparator, session_id, summary):
+    """Persist the comparison so the results API can serve it and downloads can be rendered later."""
+    pd.to_pickle({
+        'comparison': comparator.df_comparison,
+        'filtered': comparator.df_filtered,
+        'anomalies': comparator.df_anomalies,
+        'items': comparator.df_items,
+        'qty_threshold': comparator.qty_threshold,
+        'top_n': comparator.top_n,
+        'summary': summary,
+        'cube': comparator.cube,
+        'state': comparator.render_state(),  # Shares the frames above within the pickle
+    }, results_path(session_id))
+
+
+def record_artifact_bytes(path):
+    """Add the size of a generated artifact to the artifact byte counter."""
+    artifact_type = ARTIFACT_TYPES.get(Path(path).suffix)
+    if artifact_type is not None:
+        ARTIFACT_BYTES.inc(os.path.getsize(path), type=artifact_type)
+
+
+def artifact_path(session_id, file_type):
+    """Where a session's download of `file_type` (one of DOWNLOAD_TYPES) lives once rendered."""
+    base = os.path.join(app.config['UPLOAD_FOLDER'], f'Comparison_{session_id}')
+    return base + DOWNLOAD_TYPES[file_type]
+
+
+def render_artifact(session_id, file_type):
+    """Path of a session's download, rendering it from the saved results on first request.
+
+    Rendering holds a lock on the artifact across threads and worker processes, so concurrent
+    first downloads render it once. Raises FileNotFoundError for unknown sessions.
+    """
+    path = artifact_path(session_id, file_type)
+    if not os.path.exists(results_path(session_id)):
+        raise FileNotFoundError(results_path(session_id))
+    with file_lock(path + '.lock'):
+        if os.path.exists(path):
+            return path
+
+        results = load_session_results(session_id)
+        comparator = StockComparator.from_state(results['state'], artifact_path(session_id, 'text'))
+        logger.info(f"[{session_id}] Rendering {file_type} on first download")
+        start = time.perf_counter()
+        try:
+            if file_type == 'pdf':
+                rendered = generate_top10_pdf(comparator, path, results['summary'])
+            else:
+                rendered = comparator.render(file_type)
+            if rendered is None:
+                raise RuntimeError(f"Could not render {file_type}")
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)  # Don't serve a half-written file to the next request
+            raise
+        COMPARISON_STAGE_SECONDS.observe(time.perf_counter() - start, stage=file_type)
+        record_artifact_bytes(path)
+        return path
+
+
+@lru_cache(maxsize=8)
+def load_session_results(session_id):
+    """Load (and keep in memory) the comparison frames and sorted index for a session."""
+    results = pd.read_pickle(results_path(session_id))
+    results['index'] = ComparisonIndex(results['comparison'])
+    return results
+
+
+@lru_cache(maxsize=32)
+def sorted_positions(session_id, table, sort_column, ascending):
+    """Row order for a table sorted by one column (cached per session/column/direction)."""
+    df = load_session_results(session_id)[table]
+    return df[sort_column].reset_index(drop=True).sort_values(
+        ascending=ascending, na_position='last', kind='stable'
+    ).index.to_numpy()
+
+
+def frame_to_columns(df):
+    """Convert a DataFrame to columnar JSON-safe lists (NaN and ±inf -> None)."""
+    columns = {}
+    for col in df.columns:
+        values = df[col].tolist()
+        # inf is e.g. the Qty Change % of a configuration with OLD Qty 0
+        columns[col] = [None if isinstance(v, float) and not math.isfinite(v) else v for v in values]
+    return columns
+
+
+def compressed_json(payload, status=200):
+    """Build a JSON response, compressed with brotli or gzip when the client accepts it."""
+    body = json.dumps(payload, separators=(',', ':'), default=str, allow_nan=False).encode('utf-8')
+    accept = request.headers.get('Accept-Encoding', '').lower()
+
+    encoding = None
+    if len(body) >= MIN_COMPRESS_BYTES:
+        if brotli is not None and 'br' in accept:
+            body = brotli.compress(body, quality=5)
+            encoding = 'br'
+        elif 'gzip' in accept:
+            body = gzip.compress(body, compresslevel=6)
+            encoding = 'gzip'
+
+    response = make_response(body, status)
+    response.headers['Content-Type'] = 'application/json'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Content-Length'] = len(body)
+    return response
+
+
 def generate_top10_pdf(comparator, output_path, summary):
     """Generate a PDF with Top 10 Price & Quantity Movers - Apple-inspired design."""
     doc = SimpleDocTemplate(output_path, pagesize=letter,
@@ -147,7 +750,7 @@ def generate_top10_pdf(comparator, output_path, summary):
         qty_decreases = comparator.df_filtered[comparator.df_filtered['Qty Change'] < 0].nsmallest(20, 'Qty Change')
 
         # Section 1: Top 20 Price Increases
-        story.append(Paragraph("1. TOP 20 PRICE INCREASES (with qty change ≥ 100)", section_style))
+        story.append(Paragraph(f"1. TOP 20 PRICE INCREASES (with qty change ≥ {comparator.qty_threshold:g})", section_style))
         story.append(Spacer(1, 0.1*inch))
 
         if len(price_increases) > 0:
@@ -175,12 +778,12 @@ def generate_top10_pdf(comparator, output_path, summary):
                 story.append(KeepTogether(item_group))
                 story.append(Spacer(1, 0.08*inch))
         else:
-            story.append(Paragraph("No price increases found with qty change ≥ 100", detail_style))
+            story.append(Paragraph(f"No price increases found with qty change ≥ {comparator.qty_threshold:g}", detail_style))
 
         story.append(PageBreak())
 
         # Section 2: Top 10 Price Decreases
-        story.append(Paragraph("2. TOP 20 PRICE DECREASES (with qty change ≥ 100)", section_style))
+        story.append(Paragraph(f"2. TOP 20 PRICE DECREASES (with qty change ≥ {comparator.qty_threshold:g})", section_style))
         story.append(Spacer(1, 0.1*inch))
 
         if len(price_decreases) > 0:
@@ -208,12 +811,12 @@ def generate_top10_pdf(comparator, output_path, summary):
                 story.append(KeepTogether(item_group))
                 story.append(Spacer(1, 0.08*inch))
         else:
-            story.append(Paragraph("No price decreases found with qty change ≥ 100", detail_style))
+            story.append(Paragraph(f"No price decreases found with qty change ≥ {comparator.qty_threshold:g}", detail_style))
 
         story.append(PageBreak())
 
         # Section 3: Top 10 Quantity Increases
-        story.append(Paragraph("3. TOP 20 QUANTITY INCREASES (with qty change ≥ 100)", section_style))
+        story.append(Paragraph(f"3. TOP 20 QUANTITY INCREASES (with qty change ≥ {comparator.qty_threshold:g})", section_style))
         story.append(Spacer(1, 0.1*inch))
 
         if len(qty_increases) > 0:
@@ -241,12 +844,12 @@ def generate_top10_pdf(comparator, output_path, summary):
                 story.append(KeepTogether(item_group))
                 story.append(Spacer(1, 0.08*inch))
         else:
-            story.append(Paragraph("No quantity increases found with qty change ≥ 100", detail_style))
+            story.append(Paragraph(f"No quantity increases found with qty change ≥ {comparator.qty_threshold:g}", detail_style))
 
         story.append(PageBreak())
 
         # Section 4: Top 10 Quantity Decreases
-        story.append(Paragraph("4. TOP 20 QUANTITY DECREASES (with qty change ≥ 100)", section_style))
+        story.append(Paragraph(f"4. TOP 20 QUANTITY DECREASES (with qty change ≥ {comparator.qty_threshold:g})", section_style))
         story.append(Spacer(1, 0.1*inch))
 
         if len(qty_decreases) > 0:
@@ -274,11 +877,41 @@ def generate_top10_pdf(comparator, output_path, summary):
                 story.append(KeepTogether(item_group))
                 story.append(Spacer(1, 0.08*inch))
         else:
-            story.append(Paragraph("No quantity decreases found with qty change ≥ 100", detail_style))
+            story.append(Paragraph(f"No quantity decreases found with qty change ≥ {comparator.qty_threshold:g}", detail_style))
 
     else:
         story.append(Paragraph("No significant changes detected.", detail_style))
 
+    # Section 5: Anomalies (scored over all matching configurations, not just significant ones)
+    anomalies = comparator.df_anomalies.head(20)
+    story.append(PageBreak())
+    story.append(Paragraph(f"5. TOP 20 ANOMALIES (anomaly score ≥ {ANOMALY_THRESHOLD:g})", section_style))
+    story.append(Spacer(1, 0.1*inch))
+
+    if len(anomalies) > 0:
+        for idx, row in anomalies.iterrows():
+            item_group = [Paragraph(format_item_name(row), item_style)]
+
+            # Score and the robust z-scores behind it
+            score_detail = (f"Anomaly score: <b>{row['Anomaly Score']:.1f}</b> | "
+                            f"qty z {row['Qty Score']:+.1f}, price z {row['Price Score']:+.1f}")
+            item_group.append(Paragraph(score_detail, detail_style))
+
+            qty_pct = row['Qty Change %']
+            qty_color = '#059669' if qty_pct > 0 else '#dc2626' if qty_pct < 0 else '#1d1d1f'
+            qty_detail = f"QTY: {int(row['OLD Qty']):,} → {int(row['NEW Qty']):,} units | Change: {int(row['Qty Change']):+,} (<font color='{qty_color}'><b>{qty_pct:+.1f}%</b></font>)"
+            item_group.append(Paragraph(qty_detail, detail_style))
+
+            price_pct = row['List Price Change %']
+            price_color = '#059669' if price_pct > 0 else '#dc2626' if price_pct < 0 else '#1d1d1f'
+            price_detail = f"PRICE: ${row['OLD List Price']:.2f} → ${row['NEW List Price']:.2f} | Change: ${row['List Price Change $']:+.2f} (<font color='{price_color}'><b>{price_pct:+.1f}%</b></font>)"
+            item_group.append(Paragraph(price_detail, detail_style))
+
+            story.append(KeepTogether(item_group))
+            story.append(Spacer(1, 0.08*inch))
+    else:
+        story.append(Paragraph("No moves stand out within their model.", detail_style))
+
     # Footer
     story.append(Spacer(1, 0.5*inch))
     footer_style = ParagraphStyle('Footer', parent=styles['Normal'],
@@ -404,101 +1037,264 @@ def index():
     return render_template('index.html')
 
 
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Start a chunked upload. Body: {"filename": ..., "size": <total bytes>}."""
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename', '')))
+    try:
+        size = int(data.get('size', -1))
+    except (TypeError, ValueError):
+        size = -1
+
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Only Excel files (.xlsx, .xls) are allowed'}), 400
+    if size <= 0:
+        return jsonify({'error': 'File size is required'}), 400
+    if size > app.config['MAX_UPLOAD_SIZE']:
+        return jsonify({'error': f"File exceeds the {app.config['MAX_UPLOAD_SIZE'] // (1024*1024)}MB limit"}), 413
+
+    prune_stale_uploads()
+
+    upload_id = uuid.uuid4().hex
+    meta = {
+        'upload_id': upload_id,
+        'filename': filename,
+        'size': size,
+        'path': os.path.join(upload_dir(), f'{upload_id}_{filename}'),
+        'complete': False,
+        'sha256': None
+    }
+    open(meta['path'], 'wb').close()
+    write_upload_meta(upload_id, meta)
+
+    logger.info(f"[upload {upload_id}] Created for '{filename}' ({size / (1024*1024):.2f}MB)")
+    return jsonify(upload_status(meta)), 201
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Report how many bytes of an upload have been received (used to resume)."""
+    meta = read_upload_meta(upload_id)
+    if meta is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(upload_status(meta))
+
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """Append one chunk to an upload.
+
+    The chunk's starting byte is given by the ``offset`` query parameter and must equal
+    the number of bytes already received; otherwise 409 is returned with the current
+    offset so the client can resume from there. The body is streamed to the file and
+    hashed as it is written, so no part of the upload is buffered in memory.
+    """
+    meta = read_upload_meta(upload_id)
+    if meta is None:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    try:
+        offset = int(request.args.get('offset', -1))
+    except ValueError:
+        offset = -1
+
+    with upload_lock(upload_id):
+        meta = read_upload_meta(upload_id)
+        if meta['complete']:
+            return jsonify(upload_status(meta))
+
+        received = os.path.getsize(meta['path'])
+        if offset != received:
+            return jsonify({**upload_status(meta), 'error': 'Offset mismatch'}), 409
+
+        hasher = upload_hasher(upload_id, meta['path'], received)
+        chunk_start = received
+        try:
+            with open(meta['path'], 'ab') as f:
+                while True:
+                    block = request.stream.read(STREAM_BLOCK_SIZE)
+                    if not block:
+                        break
+                    if received + len(block) > meta['size']:
+                        return jsonify({'error': 'Chunk extends past the declared file size'}), 400
+                    f.write(block)
+                    hasher.update(block)
+                    received += len(block)
+        finally:
+            UPLOAD_BYTES.inc(received - chunk_start, method='chunked')  # Once per chunk, not per block
+        with upload_state_lock:
+            upload_hashers[upload_id] = (hasher, received)
+
+        if received == meta['size']:
+            meta['complete'] = True
+            meta['sha256'] = hasher.hexdigest()
+            write_upload_meta(upload_id, meta)
+            with upload_state_lock:
+                upload_hashers.pop(upload_id, None)
+            logger.info(f"[upload {upload_id}] Complete: {meta['filename']} sha256={meta['sha256'][:12]}")
+            # Parse it now, while the browser uploads the other file; the pickle lets a
+            # compare request on another worker process use the result too
+            start_ingest(meta['path'], keep_pickle=True)
+
+    return jsonify(upload_status(meta))
+
+
 @app.route('/api/compare', methods=['POST'])
 def compare_files():
     """Handle file upload and comparison."""
-    session_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    session_id = f'{timestamp}_{uuid.uuid4().hex[:8]}'  # Unique across threads and worker processes
+    progress_id = None
+    files = {}
     logger.info(f"[{session_id}] Starting new comparison request")
 
     try:
-        # Validate files
-        if 'old_file' not in request.files or 'new_file' not in request.files:
-            logger.warning(f"[{session_id}] Missing file uploads in request")
-            return jsonify({'error': 'Both OLD and NEW files are required'}), 400
-
-        old_file = request.files['old_file']
-        new_file = request.files['new_file']
-
-        logger.info(f"[{session_id}] Files received: OLD='{old_file.filename}', NEW='{new_file.filename}'")
+        if request.mimetype == 'multipart/form-data':
+            # Stream the body ourselves so the OLD file is parsed while NEW is still arriving
+            prune_stale_uploads()
+            form, files = receive_multipart(session_id)
+        else:
+            form = request.form
+        progress_id = form.get('progress_id')  # Events go to /api/progress/<progress_id>
+        # Background parse of the OLD part, dropped on any early return
+        old_part_path = files.get('old_file', {}).get('path')
+
+        def reject(error):
+            """400 response for a request that can't be compared; also ends the progress stream."""
+            publish_progress(progress_id, 'error', {'error': error})
+            discard_ingest(old_part_path)
+            return jsonify({'error': error}), 400
+
+        try:
+            qty_threshold, top_n = parse_query_params(form)
+            snapshot_date = form.get('snapshot_date') or None  # History date of the lists (default: today)
+            if snapshot_date:
+                datetime.strptime(snapshot_date, '%Y-%m-%d')
+        except ValueError as e:
+            logger.warning(f"[{session_id}] Invalid comparison parameters: {e}")
+            return reject(f'Invalid parameters: {e}')
+
+        if form.get('old_upload_id') or form.get('new_upload_id'):
+            # Files were already streamed to disk (and hashed) through the chunked upload API
+            old_upload = completed_upload(form.get('old_upload_id'))
+            new_upload = completed_upload(form.get('new_upload_id'))
+            if old_upload is None or new_upload is None:
+                logger.warning(f"[{session_id}] Unknown or incomplete upload ids")
+                return reject('Both OLD and NEW uploads must be complete')
+
+            old_path, old_hash, old_name = old_upload
+            new_path, new_hash, new_name = new_upload
+            logger.info(f"[{session_id}] Using chunked uploads: OLD='{old_name}', NEW='{new_name}'")
+        else:
+            # Validate files (already saved and hashed by receive_multipart, in per-request
+            # folders so concurrent requests with the same file names don't collide)
+            if 'old_file' not in files or 'new_file' not in files:
+                logger.warning(f"[{session_id}] Missing file uploads in request")
+                return reject('Both OLD and NEW files are required')
 
-        if old_file.filename == '' or new_file.filename == '':
-            logger.warning(f"[{session_id}] Empty filename detected")
-            return jsonify({'error': 'No files selected'}), 400
+            old_file, new_file = files['old_file'], files['new_file']
+            logger.info(f"[{session_id}] Files received: OLD='{old_file['filename']}', NEW='{new_file['filename']}'")
 
-        if not (allowed_file(old_file.filename) and allowed_file(new_file.filename)):
-            logger.warning(f"[{session_id}] Invalid file extensions")
-            return jsonify({'error': 'Only Excel files (.xlsx, .xls) are allowed'}), 400
+            if old_file['filename'] == '' or new_file['filename'] == '':
+                logger.warning(f"[{session_id}] Empty filename detected")
+                return reject('No files selected')
 
-        # Save uploaded files
-        old_filename = secure_filename(old_file.filename)
-        new_filename = secure_filename(new_file.filename)
+            if not (allowed_file(old_file['filename']) and allowed_file(new_file['filename'])):
+                logger.warning(f"[{session_id}] Invalid file extensions")
+                return reject('Only Excel files (.xlsx, .xls) are allowed')
 
-        old_path = os.path.join(app.config['UPLOAD_FOLDER'], old_filename)
-        new_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
+            if old_file['sha256'] is None or new_file['sha256'] is None:
+                logger.warning(f"[{session_id}] Upload ended before both files were received")
+                return reject('Both OLD and NEW files are required')
 
-        logger.info(f"[{session_id}] Saving files to: {app.config['UPLOAD_FOLDER']}")
-        old_file.save(old_path)
-        new_file.save(new_path)
+            old_path, old_hash = old_file['path'], old_file['sha256']
+            new_path, new_hash = new_file['path'], new_file['sha256']
 
         old_size = os.path.getsize(old_path) / (1024*1024)  # MB
         new_size = os.path.getsize(new_path) / (1024*1024)  # MB
         logger.info(f"[{session_id}] File sizes: OLD={old_size:.2f}MB, NEW={new_size:.2f}MB")
 
-        # Generate output filename with timestamp
-        timestamp = session_id
-        output_file = os.path.join(app.config['UPLOAD_FOLDER'], f'Comparison_{timestamp}.txt')
+        # Reuse a finished session if this exact pair was compared before
+        history_date = None
+        if app.config['RECORD_HISTORY']:
+            history_date = snapshot_date or datetime.now().strftime('%Y-%m-%d')  # The history store's default
+        cache_key = result_cache_key(old_hash, new_hash, qty_threshold, top_n, history_date)
+        cached = get_cached_result(cache_key)
+        RESULT_CACHE_REQUESTS.inc(result='miss' if cached is None else 'hit')
+        if cached is not None:
+            logger.info(f"[{session_id}] Result cache hit, reusing session {cached['session_id']}")
+            COMPARISONS.inc(outcome='cached')
+            # The parses started during the uploads aren't needed
+            discard_ingest(old_path)
+            discard_ingest(new_path)
+            publish_progress(progress_id, 'summary', {'summary': cached['summary']})
+            publish_progress(progress_id, 'complete', {**cached, 'cached': True})
+            return jsonify({**cached, 'cached': True})
+
+        # Generate output filename with the session id
+        output_file = os.path.join(app.config['UPLOAD_FOLDER'], f'Comparison_{session_id}.txt')
+
+        def on_progress(event):
+            publish_progress(progress_id, 'progress', event)
+            if event['stage'] == 'compare' and event['status'] == 'done':
+                # Headline numbers are known now; send them before the slow renderers run
+                publish_progress(progress_id, 'summary', {'summary': comparison_summary(comparator, timestamp)})
 
         # Run comparison
         logger.info(f"[{session_id}] Starting StockComparator")
-        comparator = StockComparator(old_path, new_path, output_file)
-        success = comparator.run()
+        comparator = StockComparator(old_path, new_path, output_file,
+                                     qty_threshold=qty_threshold, top_n=top_n,
+                                     history_db=app.config['HISTORY_DB'] if app.config['RECORD_HISTORY'] else None,
+                                     snapshot_date=snapshot_date,
+                                     outputs=[],  # Artifacts are rendered on first download
+                                     item_diff=True,
+                                     progress_callback=on_progress if progress_id else None,
+                                     preloaded={'old': ingested_frame_loader(old_path),
+                                                'new': ingested_frame_loader(new_path)})
+        COMPARISONS_IN_PROGRESS.inc()
+        try:
+            success = comparator.run()
+        finally:
+            COMPARISONS_IN_PROGRESS.dec()
+        for stage, seconds in comparator.timings.items():
+            COMPARISON_STAGE_SECONDS.observe(seconds, stage=stage)
+        for label, rows in comparator.rows_loaded.items():
+            ROWS_PROCESSED.inc(rows, file=label)
 
         if not success:
             logger.error(f"[{session_id}] Comparison failed")
+            COMPARISONS.inc(outcome='failed')
+            publish_progress(progress_id, 'error', {'error': 'Comparison failed. Please check your files.'})
             return jsonify({'error': 'Comparison failed. Please check your files.'}), 500
 
         logger.info(f"[{session_id}] Comparison completed successfully")
 
-        # Generate summary statistics first (needed for PDF)
-        matching = comparator.df_comparison[comparator.df_comparison['Status'] == 'Matching']
-        summary = {
-            'total_configs_old': int(len(comparator.df_old_grouped)),
-            'total_configs_new': int(len(comparator.df_new_grouped)),
-            'matching_configs': int(len(matching)),
-            'removed_configs': int((comparator.df_comparison['Status'] == 'Removed').sum()),
-            'new_configs': int((comparator.df_comparison['Status'] == 'New').sum()),
-            'significant_changes': int(len(comparator.df_filtered)),
-            'net_qty_change': float(matching['Qty Change'].sum()) if len(matching) > 0 else 0.0,
-            'avg_price_old': float(matching[matching['OLD List Price'] > 0]['OLD List Price'].mean()) if len(matching) > 0 else 0.0,
-            'avg_price_new': float(matching[matching['NEW List Price'] > 0]['NEW List Price'].mean()) if len(matching) > 0 else 0.0,
-            'timestamp': timestamp
-        }
+        # Generate summary statistics (also used by the PDF)
+        summary = comparison_summary(comparator, timestamp)
 
         logger.info(f"[{session_id}] Summary stats: {summary['total_configs_old']} old configs, {summary['total_configs_new']} new configs, {summary['significant_changes']} significant changes")
 
-        # Generate Top 20 Movers PDF
-        logger.info(f"[{session_id}] Generating Top 20 Movers PDF")
-        pdf_file = comparator.text_file.replace('.txt', '_Top10.pdf')
-        generate_top10_pdf(comparator, pdf_file, summary)
-        logger.info(f"[{session_id}] PDF generated: {os.path.basename(pdf_file)}")
-
-        # Read text report content for inline display
-        text_content = ""
-        if os.path.exists(comparator.text_file):
-            with open(comparator.text_file, 'r', encoding='utf-8') as f:
-                text_content = f.read()
-            logger.info(f"[{session_id}] Text report loaded: {len(text_content)} characters")
-
-        # Store result paths in session/temp
-        session_id = timestamp
+        # Keep the comparison frames for the results API and for rendering downloads
+        comparator.timed('save', lambda: save_session_results(comparator, session_id, summary))
+        logger.info(f"[{session_id}] Results saved for API access")
+        record_artifact_bytes(results_path(session_id))
+        COMPARISONS.inc(outcome='success')
 
         logger.info(f"[{session_id}] Comparison request completed successfully")
 
-        return jsonify({
+        payload = {
             'success': True,
             'summary': summary,
             'session_id': session_id,
-            'text_content': text_content,  # Include text content for inline display
+            'results': {
+                'comparison': f'/api/results/{session_id}/comparison',
+                'filtered': f'/api/results/{session_id}/filtered',
+                'anomalies': f'/api/results/{session_id}/anomalies',
+                'items': f'/api/results/{session_id}/items',
+                'movers': f'/api/results/{session_id}/movers',
+                'drilldown': f'/api/results/{session_id}/drilldown'
+            },
             'files': {
                 'pdf': f'/api/download/{session_id}/pdf',
                 'excel': f'/api/download/{session_id}/excel',
@@ -506,7 +1302,11 @@ def compare_files():
                 'zip': f'/api/download/{session_id}/zip',
                 'text': f'/api/download/{session_id}/text'
             }
-        })
+        }
+        store_cached_result(cache_key, payload)
+        publish_progress(progress_id, 'complete', {**payload, 'cached': False})
+
+        return jsonify({**payload, 'cached': False})
 
     except Exception as e:
         error_traceback = traceback.format_exc()
@@ -514,37 +1314,124 @@ def compare_files():
         logger.error(f"[{session_id}] Exception type: {type(e).__name__}")
         logger.error(f"[{session_id}] Exception message: {str(e)}")
         logger.error(f"[{session_id}] Full traceback:\n{error_traceback}")
+        publish_progress(progress_id, 'error', {'error': f'Error processing files: {str(e)}'})
+        discard_ingest(files.get('old_file', {}).get('path'))
         return jsonify({'error': f'Error processing files: {str(e)}'}), 500
 
 
+@app.route('/api/preview', methods=['POST'])
+def preview_files():
+    """Approximate summary from a sample of two finished chunked uploads, in about a second.
+
+    Form fields: old_upload_id, new_upload_id, and optionally threshold, top, rows (sampled
+    from each file) and stride (every Nth row instead of the first rows). Send /api/compare
+    alongside it for the full result; the preview response has 'preview': true.
+    """
+    old_upload = completed_upload(request.form.get('old_upload_id'))
+    new_upload = completed_upload(request.form.get('new_upload_id'))
+    if old_upload is None or new_upload is None:
+        return jsonify({'error': 'Both OLD and NEW uploads must be complete'}), 400
+
+    try:
+        qty_threshold, top_n = parse_query_params(request.form)
+        rows = int(request.form.get('rows', PREVIEW_ROWS))
+        stride = int(request.form.get('stride', 1))
+        if not (1 <= rows <= MAX_PREVIEW_ROWS and 1 <= stride <= MAX_PREVIEW_STRIDE):
+            raise ValueError(f'rows must be 1-{MAX_PREVIEW_ROWS} and stride 1-{MAX_PREVIEW_STRIDE}')
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameters: {e}'}), 400
+
+    try:
+        result = preview(old_upload[0], new_upload[0], rows, stride, qty_threshold=qty_threshold, top_n=top_n)
+    except Exception as e:
+        logger.warning(f"Preview of '{old_upload[2]}' vs '{new_upload[2]}' failed: {e}")
+        return jsonify({'error': f'Could not preview: {e}'}), 400
+
+    COMPARISON_STAGE_SECONDS.observe(result['seconds'], stage='preview')
+    logger.info(f"Preview of '{old_upload[2]}' vs '{new_upload[2]}' in {result['seconds']:.2f}s "
+                f"({result['sample']['old_rows']} / {result['sample']['new_rows']} rows)")
+    return jsonify(result)
+
+
+@app.route('/api/progress/<progress_id>')
+def progress_stream(progress_id):
+    """Server-Sent Events stream of a comparison's progress.
+
+    The client picks a random progress id, opens this stream and passes the same id as the
+    ``progress_id`` form field of /api/compare. Events: ``progress`` (stage, status, rows,
+    elapsed seconds), ``summary`` (headline numbers, sent before the reports are rendered),
+    then ``complete`` (the /api/compare response) or ``error``. Each event's id is its
+    position, so a reconnecting EventSource resumes after the last event it received.
+    """
+    path = progress_path(progress_id)
+    if path is None:
+        return jsonify({'error': 'Invalid progress id'}), 400
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', -1))
+    except ValueError:
+        last_event_id = -1
+
+    def events():
+        yield 'retry: 2000\n\n'
+        position, event_id, pending = 0, 0, ''
+        deadline = time.monotonic() + PROGRESS_STREAM_TIMEOUT
+        last_sent = time.monotonic()
+        while time.monotonic() < deadline:
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    f.seek(position)
+                    pending += f.read()
+                    position = f.tell()
+                *lines, pending = pending.split('\n')  # Keep a partially written line for later
+                for line in lines:
+                    event_type = json.loads(line)['type']
+                    if event_id > last_event_id:
+                        yield f'id: {event_id}\nevent: {event_type}\ndata: {line}\n\n'
+                        last_sent = time.monotonic()
+                    event_id += 1
+                    if event_type in PROGRESS_FINAL_EVENTS:
+                        return
+            if time.monotonic() - last_sent >= PROGRESS_KEEPALIVE_SECONDS:
+                yield ': keep-alive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(PROGRESS_POLL_SECONDS)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
+
+def stream_zip_package(session_id):
+    """Stream the session's text report and Excel workbook as a zip, built on the fly."""
+    text_path = Path(render_artifact(session_id, 'text'))
+    excel_path = Path(render_artifact(session_id, 'excel'))
+
+    logger.info(f"[{session_id}] Streaming package: {text_path.name}, {excel_path.name}")
+    response = Response(stream_with_context(stream_package([text_path, excel_path])),
+                        mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{text_path.stem}_Package.zip"'
+    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+
 @app.route('/api/download/<session_id>/<file_type>')
 def download_file(session_id, file_type):
     """Download result files."""
     logger.info(f"[{session_id}] Download requested: {file_type}")
 
+    session_id = secure_filename(session_id)
     try:
-        # Find files with matching session_id (timestamp)
-        files = list(Path(app.config['UPLOAD_FOLDER']).glob(f'*{session_id}*'))
-        logger.info(f"[{session_id}] Found {len(files)} files for session")
-
-        if file_type == 'pdf':
-            file_path = next((f for f in files if f.suffix == '.pdf'), None)
-        elif file_type == 'excel':
-            file_path = next((f for f in files if f.suffix == '.xlsx'), None)
-        elif file_type == 'html':
-            file_path = next((f for f in files if f.suffix == '.html'), None)
-        elif file_type == 'zip':
-            file_path = next((f for f in files if f.suffix == '.zip'), None)
-        elif file_type == 'text':
-            file_path = next((f for f in files if f.suffix == '.txt'), None)
+        # Artifacts are rendered from the saved results the first time they are asked for
+        if file_type == 'zip':
+            return stream_zip_package(session_id)
+        elif file_type in DOWNLOAD_TYPES:
+            file_path = Path(render_artifact(session_id, file_type))
         else:
             logger.warning(f"[{session_id}] Invalid file type requested: {file_type}")
             return jsonify({'error': 'Invalid file type'}), 400
 
-        if not file_path or not file_path.exists():
-            logger.error(f"[{session_id}] File not found for type: {file_type}")
-            return jsonify({'error': 'File not found'}), 404
-
         logger.info(f"[{session_id}] Serving file: {file_path.name} ({os.path.getsize(file_path) / 1024:.2f}KB)")
 
         # CRITICAL: Force download by using octet-stream and proper headers
@@ -554,7 +1441,7 @@ def download_file(session_id, file_type):
         with open(file_path, 'rb') as f:
             file_data = f.read()
 
-        from flask import make_response
+        DOWNLOAD_BYTES.inc(len(file_data), type=file_type)
         response = make_response(file_data)
         response.headers['Content-Type'] = 'application/octet-stream'
         response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
@@ -567,18 +1454,254 @@ def download_file(session_id, file_type):
         logger.info(f"[{session_id}] Download completed: {file_type}")
         return response
 
+    except FileNotFoundError:
+        logger.error(f"[{session_id}] File not found for type: {file_type}")
+        return jsonify({'error': 'File not found'}), 404
     except Exception as e:
         logger.error(f"[{session_id}] Error during download: {str(e)}")
         logger.error(f"[{session_id}] Traceback:\n{traceback.format_exc()}")
         return jsonify({'error': f'Error downloading file: {str(e)}'}), 500
 
 
+@app.route('/api/results/<session_id>/movers')
+def get_movers(session_id):
+    """Answer threshold / Top-N queries from the session's pre-sorted index.
+
+    Query parameters:
+        threshold - minimum absolute qty change (default: the session's threshold)
+        top       - entries per Top-N list (default: the session's Top-N)
+    """
+    session_id = secure_filename(session_id)
+    try:
+        results = load_session_results(session_id)
+    except FileNotFoundError:
+        logger.warning(f"[{session_id}] Movers requested for unknown session")
+        return jsonify({'error': 'Results not found'}), 404
+
+    try:
+        qty_threshold = float(request.args.get('threshold', results['qty_threshold']))
+        top_n = int(request.args.get('top', results['top_n']))
+        if qty_threshold < 0 or top_n < 1:
+            raise ValueError('threshold must be >= 0 and top must be >= 1')
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameters: {e}'}), 400
+
+    index = results['index']
+    insights = index.top_insights(top_n, qty_threshold)
+
+    return compressed_json({
+        'session_id': session_id,
+        'threshold': qty_threshold,
+        'top': top_n,
+        'significant_changes': index.count_significant(qty_threshold),
+        'lists': {
+            name: {'columns': list(df.columns), 'data': frame_to_columns(df)}
+            for name, df in insights.items()
+        }
+    })
+
+
+@app.route('/api/results/<session_id>/drilldown')
+def get_drilldown(session_id):
+    """Totals for one node of the session's rollup cube (Model → Capacity → Grade) and its children.
+
+    Query parameters:
+        path - the node's key values from the top level down, repeated
+               (no path = grand total by Model; ?path=iPhone 13&path=128GB = that capacity by Grade)
+    """
+    session_id = secure_filename(session_id)
+    try:
+        results = load_session_results(session_id)
+    except FileNotFoundError:
+        logger.warning(f"[{session_id}] Drill-down requested for unknown session")
+        return jsonify({'error': 'Results not found'}), 404
+
+    cube = results.get('cube')
+    if cube is None:
+        return jsonify({'error': 'No rollup for this session'}), 404
+
+    path = request.args.getlist('path')
+    if len(path) > len(cube.levels):
+        return jsonify({'error': f"path has at most {len(cube.levels)} levels ({', '.join(cube.levels)})"}), 400
+    try:
+        node = cube.drill(path)
+    except KeyError:
+        return jsonify({'error': f"Unknown path: {' / '.join(path)}"}), 404
+
+    return compressed_json({'session_id': session_id, 'levels': cube.levels, **node})
+
+
+@app.route('/api/results/<session_id>/<table>')
+def get_results(session_id, table):
+    """Serve comparison results as paginated, sortable, filterable columnar JSON.
+
+    Query parameters:
+        page, page_size  - 1-based page number and rows per page
+        sort, order      - column to sort by, 'asc' or 'desc'
+        status           - keep only rows with this Status (Matching/Removed/New), or for
+                           the items table this Change (added/removed/reclassified/...)
+        search           - case-insensitive substring match on Model/Capacity/Color (and Item #)
+        columns          - comma-separated subset of columns to return
+    """
+    if table not in RESULT_TABLES:
+        return jsonify({'error': f"Invalid table. Use one of: {', '.join(RESULT_TABLES)}"}), 400
+
+    session_id = secure_filename(session_id)
+    try:
+        results = load_session_results(session_id)
+    except FileNotFoundError:
+        logger.warning(f"[{session_id}] Results requested for unknown session")
+        return jsonify({'error': 'Results not found'}), 404
+
+    df = results.get(table)
+    if df is None:
+        return jsonify({'error': f"No {table} results for this session"}), 404
+
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('page_size', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'page and page_size must be integers'}), 400
+
+    sort_column = request.args.get('sort')
+    ascending = request.args.get('order', 'desc').lower() == 'asc'
+    if sort_column and sort_column not in df.columns:
+        return jsonify({'error': f"Unknown sort column: {sort_column}"}), 400
+
+    columns = [c for c in request.args.get('columns', '').split(',') if c]
+    unknown = [c for c in columns if c not in df.columns]
+    if unknown:
+        return jsonify({'error': f"Unknown columns: {', '.join(unknown)}"}), 400
+
+    # Row order: cached sort positions, then filters applied as a boolean mask in that order
+    if sort_column:
+        positions = sorted_positions(session_id, table, sort_column, ascending)
+    else:
+        positions = None
+
+    mask = pd.Series(True, index=df.index)
+    status = request.args.get('status')
+    if status:
+        mask &= df['Change' if table == 'items' else 'Status'] == status
+    search = request.args.get('search', '').strip()
+    if search:
+        text = df['Model'].astype(str) + ' ' + df['Capacity'].astype(str) + ' ' + df['Color'].astype(str)
+        if 'Item #' in df.columns:
+            text = df['Item #'].astype(str) + ' ' + text
+        mask &= text.str.contains(search, case=False, regex=False)
+
+    mask_values = mask.to_numpy()
+    if positions is not None:
+        selected = positions[mask_values[positions]]
+    else:
+        selected = mask_values.nonzero()[0]
+
+    total_rows = len(selected)
+    start = (page - 1) * page_size
+    page_df = df.iloc[selected[start:start + page_size]]
+    if columns:
+        page_df = page_df[columns]
+
+    return compressed_json({
+        'session_id': session_id,
+        'table': table,
+        'page': page,
+        'page_size': page_size,
+        'total_rows': int(total_rows),
+        'total_pages': int(math.ceil(total_rows / page_size)) if total_rows else 0,
+        'columns': list(page_df.columns),
+        'data': frame_to_columns(page_df)
+    })
+
+
+@app.route('/api/history')
+def get_history():
+    """Price and quantity trend for a configuration from the history store.
+
+    Query parameters: model (required), capacity, color, lock_status, grade, days (default 30).
+    """
+    model = request.args.get('model')
+    if not model:
+        return jsonify({'error': 'model is required'}), 400
+    try:
+        days = int(request.args.get('days', 30))
+    except ValueError:
+        return jsonify({'error': 'days must be an integer'}), 400
+
+    df = HistoryStore(app.config['HISTORY_DB']).trend(
+        model,
+        capacity=request.args.get('capacity'),
+        color=request.args.get('color'),
+        lock_status=request.args.get('lock_status'),
+        grade=request.args.get('grade'),
+        days=days
+    )
+    return compressed_json({'columns': list(df.columns), 'data': frame_to_columns(df)})
+
+
 @app.route('/api/health')
 def health():
     """Health check endpoint."""
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
 
 
+def temp_folder_bytes():
+    """Total size of the files under the upload/temp folder."""
+    total = 0
+    for root, _, names in os.walk(app.config['UPLOAD_FOLDER']):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Removed while walking
+    return total
+
+
+def loader_cache_lookups():
+    """Hit/miss counts of the in-memory results loader caches."""
+    samples = {}
+    for name, cached in (('session_results', load_session_results), ('sorted_positions', sorted_positions)):
+        info = cached.cache_info()
+        samples[(name, 'hit')] = info.hits
+        samples[(name, 'miss')] = info.misses
+    return samples
+
+
+RESULT_CACHE_ENTRIES.set_function(lambda: {(): len(result_cache_entries())})
+LOADER_CACHE.set_function(loader_cache_lookups, per_process=True)
+TEMP_BYTES.set_function(lambda: {(): temp_folder_bytes()})
+TEMP_FREE_BYTES.set_function(lambda: {(): shutil.disk_usage(app.config['UPLOAD_FOLDER']).free})
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Label by route pattern, not the concrete URL, so session ids don't explode the series
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    if 'request_start' in g:
+        HTTP_LATENCY.observe(time.perf_counter() - g.request_start, route=route, method=request.method)
+    return response
+
+
+@app.teardown_request
+def finish_request(exc):
+    if g.pop('request_start', None) is not None:
+        HTTP_IN_FLIGHT.dec()
+    REGISTRY.refresh()
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint (text exposition format)."""
+    return Response(REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
 # Cleanup old files on startup
 def cleanup_old_files():
     """Clean up old temporary files."""
@@ -590,6 +1713,8 @@ def cleanup_old_files():
                 try:
                     if os.path.isfile(file_path):
                         os.unlink(file_path)
+                    elif os.path.isdir(file_path):
+                        shutil.rmtree(file_path)
                 except Exception as e:
                     print(f"Error deleting {file_path}: {e}")
     except Exception as e: